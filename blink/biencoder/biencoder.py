@@ -21,6 +21,8 @@ from pytorch_transformers.tokenization_bert import BertTokenizer
 
 from blink.common.ranker_base import BertEncoder, get_model_obj
 from blink.common.optimizer import get_bert_optimizer
+from blink.entity_encoding import EntityEncodingStore
+from blink.common.profiling import record_function
 
 
 def load_biencoder(params):
@@ -89,7 +91,9 @@ class BiEncoderRanker(torch.nn.Module):
         self.build_model()
         model_path = params.get("path_to_model", None)
         if model_path is not None:
-            self.load_model(model_path)
+            self.load_model(model_path, cpu=self.device.type == "cpu")
+        # compiled context encoder, see blink.biencoder.export
+        self.context_encoder = None
 
         self.model = self.model.to(self.device)
         self.data_parallel = params.get("data_parallel")
@@ -123,13 +127,26 @@ class BiEncoderRanker(torch.nn.Module):
             fp16=self.params.get("fp16"),
         )
  
-    def encode_context(self, cands):
-        token_idx_cands, segment_idx_cands, mask_cands = to_bert_input(
-            cands, self.NULL_IDX
+    def set_context_encoder(self, context_encoder):
+        """
+        Use a compiled context encoder (blink.biencoder.export) instead of the
+        eager model to encode the contexts at inference.
+        """
+        self.context_encoder = context_encoder
+
+    def _encode_context(self, text_vecs):
+        if self.context_encoder is not None:
+            return self.context_encoder(text_vecs)
+        token_idx_ctxt, segment_idx_ctxt, mask_ctxt = to_bert_input(
+            text_vecs, self.NULL_IDX
         )
-        embedding_context, _ = self.model(
-            token_idx_cands, segment_idx_cands, mask_cands, None, None, None
+        embedding_ctxt, _ = self.model(
+            token_idx_ctxt, segment_idx_ctxt, mask_ctxt, None, None, None
         )
+        return embedding_ctxt
+
+    def encode_context(self, cands):
+        embedding_context = self._encode_context(cands)
         return embedding_context.cpu().detach()
 
     def encode_candidate(self, cands):
@@ -150,20 +167,19 @@ class BiEncoderRanker(torch.nn.Module):
         text_vecs,
         cand_vecs,
         random_negs=True,
-        cand_encs=None,  # pre-computed candidate encoding.
+        cand_encs=None,  # pre-computed candidate encoding (tensor or EntityEncodingStore).
     ):
         # Encode contexts first
-        token_idx_ctxt, segment_idx_ctxt, mask_ctxt = to_bert_input(
-            text_vecs, self.NULL_IDX
-        )
-        embedding_ctxt, _ = self.model(
-            token_idx_ctxt, segment_idx_ctxt, mask_ctxt, None, None, None
-        )
+        embedding_ctxt = self._encode_context(text_vecs)
 
         # Candidate encoding is given, do not need to re-compute
         # Directly return the score of context encoding and candidate encoding
         if cand_encs is not None:
-            return embedding_ctxt.mm(cand_encs.t())
+            with record_function("candidate_scoring"):
+                if isinstance(cand_encs, EntityEncodingStore):
+                    # memory-mapped encodings are upcast block by block
+                    return cand_encs.score(embedding_ctxt)
+                return embedding_ctxt.mm(cand_encs.t())
 
         # Train time. We compare with all elements of the batch
         token_idx_cands, segment_idx_cands, mask_cands = to_bert_input(
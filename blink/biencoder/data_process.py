@@ -5,7 +5,10 @@
 # LICENSE file in the root directory of this source tree.
 #
 
+import functools
 import logging
+import multiprocessing
+import tempfile
 import torch
 from tqdm import tqdm, trange
 from torch.utils.data import DataLoader, TensorDataset
@@ -32,16 +35,44 @@ def get_context_representation(
     ent_start_token=ENT_START_TAG,
     ent_end_token=ENT_END_TAG,
 ):
-    mention_tokens = []
+    mention_tokens = None
     if sample[mention_key] and len(sample[mention_key]) > 0:
         mention_tokens = tokenizer.tokenize(sample[mention_key])
-        mention_tokens = [ent_start_token] + mention_tokens + [ent_end_token]
 
     context_left = sample[context_key + "_left"]
     context_right = sample[context_key + "_right"]
     context_left = tokenizer.tokenize(context_left)
     context_right = tokenizer.tokenize(context_right)
 
+    return _context_representation_from_tokens(
+        mention_tokens,
+        context_left,
+        context_right,
+        tokenizer,
+        max_seq_length,
+        ent_start_token,
+        ent_end_token,
+    )
+
+
+def _context_representation_from_tokens(
+    mention_tokens,
+    context_left,
+    context_right,
+    tokenizer,
+    max_seq_length,
+    ent_start_token=ENT_START_TAG,
+    ent_end_token=ENT_END_TAG,
+):
+    """
+    Truncate, tag and pad an already tokenized context. ``mention_tokens`` is
+    None when the sample has no mention.
+    """
+    if mention_tokens is not None:
+        mention_tokens = [ent_start_token] + mention_tokens + [ent_end_token]
+    else:
+        mention_tokens = []
+
     left_quota = (max_seq_length - len(mention_tokens)) // 2 - 1
     right_quota = max_seq_length - len(mention_tokens) - left_quota - 2
     left_add = len(context_left)
@@ -76,11 +107,26 @@ def get_candidate_representation(
     candidate_title=None,
     title_tag=ENT_TITLE_TAG,
 ):
-    cls_token = tokenizer.cls_token
-    sep_token = tokenizer.sep_token
     cand_tokens = tokenizer.tokenize(candidate_desc)
+    title_tokens = None
     if candidate_title is not None:
         title_tokens = tokenizer.tokenize(candidate_title)
+
+    return _candidate_representation_from_tokens(
+        cand_tokens, title_tokens, tokenizer, max_seq_length, title_tag,
+    )
+
+
+def _candidate_representation_from_tokens(
+    cand_tokens, title_tokens, tokenizer, max_seq_length, title_tag=ENT_TITLE_TAG,
+):
+    """
+    Truncate and pad an already tokenized candidate. ``title_tokens`` is None
+    when the candidate has no title.
+    """
+    cls_token = tokenizer.cls_token
+    sep_token = tokenizer.sep_token
+    if title_tokens is not None:
         cand_tokens = title_tokens + [title_tag] + cand_tokens
 
     cand_tokens = cand_tokens[: max_seq_length - 2]
@@ -97,6 +143,276 @@ def get_candidate_representation(
     }
 
 
+def get_candidate_representations(
+    candidate_descs,
+    tokenizer,
+    max_seq_length,
+    candidate_titles=None,
+    title_tag=ENT_TITLE_TAG,
+    fast_tokenizer=None,
+):
+    """
+    get_candidate_representation of a list of candidates. With a
+    ``fast_tokenizer`` (see get_fast_tokenizer) the descriptions and titles
+    are tokenized in one batch.
+    """
+    if candidate_titles is None:
+        candidate_titles = [None] * len(candidate_descs)
+    if fast_tokenizer is None:
+        return [
+            get_candidate_representation(
+                desc, tokenizer, max_seq_length, title, title_tag
+            )
+            for desc, title in zip(candidate_descs, candidate_titles)
+        ]
+
+    cand_tokens = _batch_tokenize(fast_tokenizer, list(candidate_descs))
+    titles = [title for title in candidate_titles if title is not None]
+    title_tokens = iter(_batch_tokenize(fast_tokenizer, titles))
+    representations = []
+    for tokens, title in zip(cand_tokens, candidate_titles):
+        representations.append(
+            _candidate_representation_from_tokens(
+                tokens,
+                next(title_tokens) if title is not None else None,
+                tokenizer,
+                max_seq_length,
+                title_tag,
+            )
+        )
+    return representations
+
+
+TOKENIZER_BACKENDS = ["python", "process", "fast"]
+
+# tokenizer of the current process pool worker
+_worker_tokenizer = None
+
+
+def _init_tokenizer_worker(tokenizer):
+    global _worker_tokenizer
+    _worker_tokenizer = tokenizer
+
+
+def _mention_data_representations(
+    samples,
+    tokenizer,
+    max_context_length,
+    max_cand_length,
+    mention_key="mention",
+    context_key="context",
+    label_key="label",
+    title_key="label_title",
+    ent_start_token=ENT_START_TAG,
+    ent_end_token=ENT_END_TAG,
+):
+    """(context representation, label representation) of every sample."""
+    representations = []
+    for sample in samples:
+        context_tokens = get_context_representation(
+            sample,
+            tokenizer,
+            max_context_length,
+            mention_key,
+            context_key,
+            ent_start_token,
+            ent_end_token,
+        )
+        label_tokens = get_candidate_representation(
+            sample[label_key], tokenizer, max_cand_length, sample.get(title_key, None),
+        )
+        representations.append((context_tokens, label_tokens))
+    return representations
+
+
+def _worker_mention_data_representations(samples, **kwargs):
+    return _mention_data_representations(samples, _worker_tokenizer, **kwargs)
+
+
+def _process_pool_representations(samples, tokenizer, num_workers, chunk_size, **kwargs):
+    chunks = [samples[i : i + chunk_size] for i in range(0, len(samples), chunk_size)]
+    representations = []
+    with multiprocessing.Pool(
+        num_workers, initializer=_init_tokenizer_worker, initargs=(tokenizer,)
+    ) as pool:
+        # imap keeps the order of the chunks
+        for chunk_representations in pool.imap(
+            functools.partial(_worker_mention_data_representations, **kwargs), chunks
+        ):
+            representations.extend(chunk_representations)
+    return representations
+
+
+def get_fast_tokenizer(tokenizer):
+    """
+    Rust-backed ``transformers.BertTokenizerFast`` with the vocabulary and
+    special tokens of the (python) BertTokenizer ``tokenizer``.
+    """
+    from transformers import BertTokenizerFast
+
+    # the vocabulary is read when the tokenizer is built
+    with tempfile.TemporaryDirectory() as vocab_dir:
+        vocab_file = tokenizer.save_vocabulary(vocab_dir)[0]
+        fast_tokenizer = BertTokenizerFast(
+            vocab_file,
+            do_lower_case=tokenizer.basic_tokenizer.do_lower_case,
+            tokenize_chinese_chars=tokenizer.basic_tokenizer.tokenize_chinese_chars,
+        )
+    if tokenizer.additional_special_tokens:
+        fast_tokenizer.add_special_tokens(
+            {"additional_special_tokens": tokenizer.additional_special_tokens}
+        )
+    return fast_tokenizer
+
+
+def _batch_tokenize(fast_tokenizer, texts):
+    if len(texts) == 0:
+        return []
+    encoded = fast_tokenizer(
+        texts,
+        add_special_tokens=False,
+        return_token_type_ids=False,
+        return_attention_mask=False,
+    )
+    return [fast_tokenizer.convert_ids_to_tokens(ids) for ids in encoded["input_ids"]]
+
+
+def _fast_representations(
+    samples,
+    tokenizer,
+    max_context_length,
+    max_cand_length,
+    mention_key="mention",
+    context_key="context",
+    label_key="label",
+    title_key="label_title",
+    ent_start_token=ENT_START_TAG,
+    ent_end_token=ENT_END_TAG,
+    chunk_size=1024,
+    fast_tokenizer=None,
+):
+    if fast_tokenizer is None:
+        fast_tokenizer = get_fast_tokenizer(tokenizer)
+
+    representations = []
+    for start in range(0, len(samples), chunk_size):
+        chunk = samples[start : start + chunk_size]
+        # tokenize all the strings of the chunk in one call, in the order:
+        # mention, left context, right context, label, title
+        texts = []
+        for sample in chunk:
+            if sample[mention_key] and len(sample[mention_key]) > 0:
+                texts.append(sample[mention_key])
+            texts.append(sample[context_key + "_left"])
+            texts.append(sample[context_key + "_right"])
+            texts.append(sample[label_key])
+            if sample.get(title_key, None) is not None:
+                texts.append(sample[title_key])
+        tokens = iter(_batch_tokenize(fast_tokenizer, texts))
+
+        for sample in chunk:
+            mention_tokens = None
+            if sample[mention_key] and len(sample[mention_key]) > 0:
+                mention_tokens = next(tokens)
+            context_left = next(tokens)
+            context_right = next(tokens)
+            cand_tokens = next(tokens)
+            title_tokens = None
+            if sample.get(title_key, None) is not None:
+                title_tokens = next(tokens)
+            context_rep = _context_representation_from_tokens(
+                mention_tokens,
+                context_left,
+                context_right,
+                tokenizer,
+                max_context_length,
+                ent_start_token,
+                ent_end_token,
+            )
+            label_rep = _candidate_representation_from_tokens(
+                cand_tokens, title_tokens, tokenizer, max_cand_length,
+            )
+            representations.append((context_rep, label_rep))
+    return representations
+
+
+def get_mention_data_representations(
+    samples,
+    tokenizer,
+    max_context_length,
+    max_cand_length,
+    backend="python",
+    num_workers=None,
+    chunk_size=1024,
+    silent=True,
+    **kwargs
+):
+    """
+    Tokenize ``samples`` with one of the TOKENIZER_BACKENDS:
+
+        python:  one sample at a time in this process
+        process: python tokenization in a pool of ``num_workers`` processes
+        fast:    batched Rust tokenization (transformers.BertTokenizerFast)
+
+    All backends return the same (context, label) representations as
+    get_context_representation / get_candidate_representation, see
+    verify_representations.
+    """
+    if backend == "python":
+        if not silent:
+            samples = tqdm(samples)
+        return _mention_data_representations(
+            samples, tokenizer, max_context_length, max_cand_length, **kwargs
+        )
+    elif backend == "process":
+        return _process_pool_representations(
+            samples,
+            tokenizer,
+            num_workers or multiprocessing.cpu_count(),
+            chunk_size,
+            max_context_length=max_context_length,
+            max_cand_length=max_cand_length,
+            **kwargs
+        )
+    elif backend == "fast":
+        return _fast_representations(
+            samples,
+            tokenizer,
+            max_context_length,
+            max_cand_length,
+            chunk_size=chunk_size,
+            **kwargs
+        )
+    raise ValueError(
+        "Unsupported tokenizer backend {}. Choose from {}.".format(
+            backend, ",".join(TOKENIZER_BACKENDS)
+        )
+    )
+
+
+def verify_representations(representations, expected_representations):
+    """Raise an error unless both representations have identical token ids."""
+    if len(representations) != len(expected_representations):
+        raise ValueError(
+            "Tokenization returned {} samples, expected {}".format(
+                len(representations), len(expected_representations)
+            )
+        )
+    for idx, (reps, expected_reps) in enumerate(
+        zip(representations, expected_representations)
+    ):
+        for name, rep, expected_rep in zip(("context", "label"), reps, expected_reps):
+            if rep["ids"] != expected_rep["ids"]:
+                raise ValueError(
+                    "Tokenization mismatch for the {} of sample {}:\n{}\n{}".format(
+                        name,
+                        idx,
+                        " ".join(rep["tokens"]),
+                        " ".join(expected_rep["tokens"]),
+                    )
+                )
+
+
 def process_mention_data(
     samples,
     tokenizer,
@@ -112,35 +428,55 @@ def process_mention_data(
     title_token=ENT_TITLE_TAG,
     debug=False,
     logger=None,
+    tokenizer_backend="python",
+    tokenizer_workers=None,
+    verify_tokenization=False,
 ):
     processed_samples = []
 
     if debug:
         samples = samples[:200]
 
-    if silent:
-        iter_ = samples
-    else:
-        iter_ = tqdm(samples)
-
-    use_world = True
-
-    for idx, sample in enumerate(iter_):
-        context_tokens = get_context_representation(
-            sample,
+    representations = get_mention_data_representations(
+        samples,
+        tokenizer,
+        max_context_length,
+        max_cand_length,
+        backend=tokenizer_backend,
+        num_workers=tokenizer_workers,
+        silent=silent,
+        mention_key=mention_key,
+        context_key=context_key,
+        label_key=label_key,
+        title_key=title_key,
+        ent_start_token=ent_start_token,
+        ent_end_token=ent_end_token,
+    )
+    if verify_tokenization and tokenizer_backend != "python":
+        expected_representations = get_mention_data_representations(
+            samples,
             tokenizer,
             max_context_length,
-            mention_key,
-            context_key,
-            ent_start_token,
-            ent_end_token,
+            max_cand_length,
+            mention_key=mention_key,
+            context_key=context_key,
+            label_key=label_key,
+            title_key=title_key,
+            ent_start_token=ent_start_token,
+            ent_end_token=ent_end_token,
         )
+        verify_representations(representations, expected_representations)
+        if logger:
+            logger.info(
+                "Tokenization with the %s backend verified on %d samples"
+                % (tokenizer_backend, len(samples))
+            )
 
-        label = sample[label_key]
-        title = sample.get(title_key, None)
-        label_tokens = get_candidate_representation(
-            label, tokenizer, max_cand_length, title,
-        )
+    use_world = True
+
+    for idx, (sample, (context_tokens, label_tokens)) in enumerate(
+        zip(samples, representations)
+    ):
         label_idx = int(sample["label_id"])
 
         record = {
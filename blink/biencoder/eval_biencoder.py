@@ -266,6 +266,9 @@ def main(params):
         silent=params["silent"],
         logger=logger,
         debug=params["debug"],
+        tokenizer_backend=params["tokenizer_backend"],
+        tokenizer_workers=params["tokenizer_workers"],
+        verify_tokenization=params["verify_tokenization"],
     )
     test_sampler = SequentialSampler(test_tensor_data)
     test_dataloader = DataLoader(
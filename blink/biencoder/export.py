@@ -0,0 +1,322 @@
+# Copyright (c) Facebook, Inc. and its affiliates.
+# All rights reserved.
+#
+# This source code is licensed under the license found in the
+# LICENSE file in the root directory of this source tree.
+#
+"""
+Compiled (TorchScript or ONNX) context encoder of the biencoder, for serving.
+
+The exported graph takes the padded context token ids and includes the
+``to_bert_input`` step, with dynamic batch and sequence axes:
+
+    BLINK: token ids (bsz, seqlen) -> context embeddings (bsz, embed_dim)
+    ELQ:   token ids (bsz, seqlen) -> raw token encodings (bsz, seqlen, embed_dim)
+
+For ELQ, the mention scoring and pruning heads stay in eager mode, since
+their output shapes depend on the data. Export with
+
+    python blink/biencoder/export.py --biencoder_model models/biencoder_wiki_large.bin \
+        --biencoder_config models/biencoder_wiki_large.json --output_path models/context_encoder.pt
+
+and pass ``--context_encoder models/context_encoder.pt`` to main_dense.py.
+"""
+import argparse
+import inspect
+import json
+import time
+
+import torch
+
+from blink.common.ranker_base import get_model_obj
+
+EXPORT_FORMATS = ["torchscript", "onnx"]
+
+
+class ContextEncoderGraph(torch.nn.Module):
+    """Context side of the BLINK BiEncoderModule, from token ids."""
+
+    def __init__(self, context_encoder, null_idx=0):
+        super(ContextEncoderGraph, self).__init__()
+        self.context_encoder = context_encoder
+        self.null_idx = null_idx
+
+    def forward(self, token_ids):
+        mask = token_ids != self.null_idx
+        token_ids = token_ids * mask.long()
+        segment_ids = token_ids * 0
+        return self.context_encoder(token_ids, segment_ids, mask)
+
+
+class ElqContextEncoderGraph(torch.nn.Module):
+    """Raw, shared context token encodings of the ELQ BiEncoderModule."""
+
+    def __init__(self, bert_model, null_idx=0):
+        super(ElqContextEncoderGraph, self).__init__()
+        self.bert_model = bert_model
+        self.null_idx = null_idx
+
+    def forward(self, token_ids):
+        mask = token_ids != self.null_idx
+        token_ids = token_ids * mask.long()
+        segment_ids = token_ids * 0
+        return self.bert_model(token_ids, segment_ids, mask)[0]
+
+
+def context_encoder_graph(biencoder):
+    """Exportable context encoder of a BLINK or ELQ ``BiEncoderRanker``."""
+    model = get_model_obj(biencoder.model)
+    if hasattr(model, "get_raw_ctxt_encoding"):
+        if model.mention_aggregation_type is None:
+            raise ValueError(
+                "Only ELQ models with mention aggregation can be exported"
+            )
+        graph = ElqContextEncoderGraph(
+            model.context_encoder.bert_model, biencoder.NULL_IDX
+        )
+    else:
+        graph = ContextEncoderGraph(model.context_encoder, biencoder.NULL_IDX)
+    return graph.eval()
+
+
+def _example_input(batch_size, seq_length, vocab_size, device, seed=0):
+    # random token ids with some trailing padding
+    generator = torch.Generator().manual_seed(seed)
+    token_ids = torch.randint(1, vocab_size, (batch_size, seq_length), generator=generator)
+    lengths = torch.randint(1, seq_length + 1, (batch_size,), generator=generator)
+    token_ids[torch.arange(seq_length).unsqueeze(0) >= lengths.unsqueeze(1)] = 0
+    return token_ids.to(device)
+
+
+def _vocab_size(graph):
+    for module in graph.modules():
+        if hasattr(module, "word_embeddings"):
+            return module.word_embeddings.num_embeddings
+    raise ValueError("Cannot find the word embeddings of the context encoder")
+
+
+def export_context_encoder(
+    biencoder, output_path, export_format="torchscript", seq_length=32, opset_version=11
+):
+    """
+    Trace the context encoder of ``biencoder`` on an example batch and save
+    it to ``output_path``, as TorchScript or ONNX.
+    """
+    if export_format not in EXPORT_FORMATS:
+        raise ValueError(
+            "Unsupported export format {}. Choose from {}.".format(
+                export_format, ",".join(EXPORT_FORMATS)
+            )
+        )
+    graph = context_encoder_graph(biencoder)
+    device = next(graph.parameters()).device
+    example = _example_input(2, seq_length, _vocab_size(graph), device)
+
+    with torch.no_grad():
+        if export_format == "torchscript":
+            traced = torch.jit.trace(graph, (example,), check_trace=False)
+            traced.save(output_path)
+            return
+
+        output_axes = {0: "batch"}
+        if isinstance(graph, ElqContextEncoderGraph):
+            output_axes[1] = "sequence"
+        kwargs = {}
+        if "dynamo" in inspect.signature(torch.onnx.export).parameters:
+            # the TorchScript based exporter handles the dynamic axes below
+            kwargs["dynamo"] = False
+        torch.onnx.export(
+            graph,
+            (example,),
+            output_path,
+            input_names=["token_ids"],
+            output_names=["embeddings"],
+            dynamic_axes={
+                "token_ids": {0: "batch", 1: "sequence"},
+                "embeddings": output_axes,
+            },
+            opset_version=opset_version,
+            **kwargs
+        )
+
+
+class CompiledContextEncoder(object):
+    """
+    Context encoder saved by ``export_context_encoder``, called on padded
+    token ids. ``.onnx`` files are run with onnxruntime.
+    """
+
+    def __init__(self, path, device="cpu"):
+        self.path = path
+        self.device = torch.device(device)
+        self.module = None
+        self.session = None
+        if path.endswith(".onnx"):
+            try:
+                import onnxruntime
+            except ImportError:
+                raise ImportError(
+                    "ONNX context encoders need onnxruntime: pip install onnxruntime"
+                )
+            providers = ["CPUExecutionProvider"]
+            if self.device.type == "cuda":
+                providers.insert(0, "CUDAExecutionProvider")
+            self.session = onnxruntime.InferenceSession(path, providers=providers)
+        else:
+            self.module = torch.jit.load(path, map_location=self.device)
+            self.module.eval()
+
+    def __call__(self, token_ids):
+        if self.session is not None:
+            outputs = self.session.run(None, {"token_ids": token_ids.cpu().numpy()})
+            return torch.from_numpy(outputs[0]).to(self.device)
+        with torch.no_grad():
+            return self.module(token_ids.to(self.device))
+
+
+def check_parity(
+    biencoder, compiled, batch_sizes=(1, 8), seq_lengths=(16, 32, 64), atol=1e-4
+):
+    """
+    Maximum absolute difference between the eager and ``compiled`` context
+    encodings on random inputs of every (batch size, sequence length), which
+    also checks the dynamic axes. Raises a ValueError above ``atol``.
+    """
+    graph = context_encoder_graph(biencoder)
+    device = next(graph.parameters()).device
+    vocab_size = _vocab_size(graph)
+    max_diff = 0.0
+    for batch_size in batch_sizes:
+        for seq_length in seq_lengths:
+            token_ids = _example_input(batch_size, seq_length, vocab_size, device, seed=1)
+            with torch.no_grad():
+                expected = graph(token_ids).cpu()
+            actual = compiled(token_ids).cpu()
+            if actual.size() != expected.size():
+                raise ValueError(
+                    "Compiled context encoder output {} for input {}, expected {}".format(
+                        tuple(actual.size()), tuple(token_ids.size()), tuple(expected.size())
+                    )
+                )
+            max_diff = max(max_diff, float((actual - expected).abs().max()))
+    if max_diff > atol:
+        raise ValueError(
+            "Compiled context encoder differs from the eager one by {} > {}".format(
+                max_diff, atol
+            )
+        )
+    return max_diff
+
+
+def benchmark_latency(
+    biencoder, compiled, batch_sizes=(1, 8, 32), seq_length=32, repeats=20
+):
+    """Mean latency (ms) of the eager and compiled context encoders per batch size."""
+    graph = context_encoder_graph(biencoder)
+    device = next(graph.parameters()).device
+    vocab_size = _vocab_size(graph)
+
+    def _time(encoder, token_ids):
+        encoder(token_ids)  # warm up
+        if device.type == "cuda":
+            torch.cuda.synchronize()
+        start_time = time.perf_counter()
+        for _ in range(repeats):
+            encoder(token_ids)
+        if device.type == "cuda":
+            torch.cuda.synchronize()
+        return 1000 * (time.perf_counter() - start_time) / repeats
+
+    def _eager(token_ids):
+        with torch.no_grad():
+            return graph(token_ids)
+
+    results = []
+    for batch_size in batch_sizes:
+        token_ids = _example_input(batch_size, seq_length, vocab_size, device)
+        results.append(
+            {
+                "batch_size": batch_size,
+                "eager_ms": _time(_eager, token_ids),
+                "compiled_ms": _time(compiled, token_ids),
+            }
+        )
+    return results
+
+
+if __name__ == "__main__":
+    import blink.candidate_ranking.utils as utils
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "--biencoder_model",
+        type=str,
+        default="models/biencoder_wiki_large.bin",
+        help="Path to the biencoder model.",
+    )
+    parser.add_argument(
+        "--biencoder_config",
+        type=str,
+        default="models/biencoder_wiki_large.json",
+        help="Path to the biencoder configuration.",
+    )
+    parser.add_argument(
+        "--output_path",
+        type=str,
+        required=True,
+        help="File to save the context encoder to (.pt or .onnx).",
+    )
+    parser.add_argument(
+        "--format", type=str, default="torchscript", choices=EXPORT_FORMATS,
+    )
+    parser.add_argument(
+        "--elq", action="store_true", help="Export the context encoder of an ELQ model."
+    )
+    parser.add_argument(
+        "--cuda", action="store_true", help="Export and check the encoder on GPU."
+    )
+    parser.add_argument("--max_context_length", type=int, default=32)
+    parser.add_argument("--atol", type=float, default=1e-4)
+    parser.add_argument(
+        "--benchmark",
+        action="store_true",
+        help="Report the latency of the eager and compiled encoders.",
+    )
+    args = parser.parse_args()
+
+    logger = utils.get_logger()
+    with open(args.biencoder_config) as json_file:
+        biencoder_params = json.load(json_file)
+    biencoder_params["path_to_model"] = args.biencoder_model
+    biencoder_params["no_cuda"] = not args.cuda
+    biencoder_params["data_parallel"] = False
+    if args.elq:
+        from elq.biencoder.biencoder import load_biencoder
+
+        biencoder_params["load_cand_enc_only"] = False
+    else:
+        from blink.biencoder.biencoder import load_biencoder
+    biencoder = load_biencoder(biencoder_params)
+    biencoder.model.eval()
+
+    logger.info("Exporting context encoder to %s" % args.output_path)
+    export_context_encoder(
+        biencoder, args.output_path, args.format, seq_length=args.max_context_length
+    )
+    compiled = CompiledContextEncoder(args.output_path, biencoder.device)
+    max_diff = check_parity(biencoder, compiled, atol=args.atol)
+    logger.info("Parity check passed, max abs difference %.2e" % max_diff)
+
+    if args.benchmark:
+        for row in benchmark_latency(
+            biencoder, compiled, seq_length=args.max_context_length
+        ):
+            logger.info(
+                "batch size %d: eager %.2f ms, compiled %.2f ms (%.2fx)"
+                % (
+                    row["batch_size"],
+                    row["eager_ms"],
+                    row["compiled_ms"],
+                    row["eager_ms"] / max(row["compiled_ms"], 1e-6),
+                )
+            )
@@ -34,6 +34,8 @@ import blink.biencoder.data_process as data
 from blink.biencoder.zeshel_utils import DOC_PATH, WORLDS, world_to_id
 from blink.common.optimizer import get_bert_optimizer
 from blink.common.params import BlinkParser
+from blink.common.length_bucketing import length_bucketed_dataloader
+from blink.common.profiling import add_profiler_args, get_profiler
 
 
 logger = None
@@ -158,15 +160,27 @@ def main(params):
         silent=params["silent"],
         logger=logger,
         debug=params["debug"],
+        tokenizer_backend=params["tokenizer_backend"],
+        tokenizer_workers=params["tokenizer_workers"],
+        verify_tokenization=params["verify_tokenization"],
     )
-    if params["shuffle"]:
-        train_sampler = RandomSampler(train_tensor_data)
+    if params["length_bucketing"]:
+        # context and candidate tensors are trimmed separately
+        train_dataloader = length_bucketed_dataloader(
+            train_tensor_data,
+            train_batch_size,
+            fields=(0, 1),
+            shuffle=params["shuffle"],
+        )
     else:
-        train_sampler = SequentialSampler(train_tensor_data)
+        if params["shuffle"]:
+            train_sampler = RandomSampler(train_tensor_data)
+        else:
+            train_sampler = SequentialSampler(train_tensor_data)
 
-    train_dataloader = DataLoader(
-        train_tensor_data, sampler=train_sampler, batch_size=train_batch_size
-    )
+        train_dataloader = DataLoader(
+            train_tensor_data, sampler=train_sampler, batch_size=train_batch_size
+        )
 
     # Load eval data
     # TODO: reduce duplicated code here
@@ -182,11 +196,19 @@ def main(params):
         silent=params["silent"],
         logger=logger,
         debug=params["debug"],
+        tokenizer_backend=params["tokenizer_backend"],
+        tokenizer_workers=params["tokenizer_workers"],
+        verify_tokenization=params["verify_tokenization"],
     )
-    valid_sampler = SequentialSampler(valid_tensor_data)
-    valid_dataloader = DataLoader(
-        valid_tensor_data, sampler=valid_sampler, batch_size=eval_batch_size
-    )
+    if params["length_bucketing"]:
+        valid_dataloader = length_bucketed_dataloader(
+            valid_tensor_data, eval_batch_size, fields=(0, 1),
+        )
+    else:
+        valid_sampler = SequentialSampler(valid_tensor_data)
+        valid_dataloader = DataLoader(
+            valid_tensor_data, sampler=valid_sampler, batch_size=eval_batch_size
+        )
 
     # evaluate before training
     results = evaluate(
@@ -214,6 +236,8 @@ def main(params):
     best_epoch_idx = -1
     best_score = -1
 
+    # --profile: operator profile of a window of training batches
+    profiler = get_profiler(params, "train_biencoder", logger)
     num_train_epochs = params["num_train_epochs"]
     for epoch_idx in trange(int(num_train_epochs), desc="Epoch"):
         tr_loss = 0
@@ -265,6 +289,8 @@ def main(params):
                 model.train()
                 logger.info("\n")
 
+            profiler.step()
+
         logger.info("***** Saving fine - tuned model *****")
         epoch_output_folder_path = os.path.join(
             model_output_path, "epoch_{}".format(epoch_idx)
@@ -282,6 +308,7 @@ def main(params):
         best_score = ls[np.argmax(ls)]
         best_epoch_idx = li[np.argmax(ls)]
         logger.info("\n")
+    profiler.close()
 
     execution_time = (time.time() - time_start) / 60
     utils.write_to_file(
@@ -305,6 +332,7 @@ def main(params):
 if __name__ == "__main__":
     parser = BlinkParser(add_model_args=True)
     parser.add_training_args()
+    add_profiler_args(parser)
 
     # args = argparse.Namespace(**params)
     args = parser.parse_args()
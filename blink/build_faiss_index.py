@@ -11,34 +11,88 @@ import os
 import time
 import torch
 
-from blink.indexer.faiss_indexer import DenseFlatIndexer, DenseHNSWFlatIndexer
+from blink.index.faiss_indexer import (
+    DenseFlatIndexer,
+    DenseHNSWFlatIndexer,
+    DenseIVFPQIndexer,
+    DenseSQIndexer,
+    DenseShardedIndexer,
+)
+from blink.entity_encoding import encoding_checksum, load_entity_encoding
+from blink.entity_catalogue import catalogue_checksum
 import blink.candidate_ranking.utils as utils
 
 logger = utils.get_logger()
 
-def main(params): 
-    output_path = params["output_path"]
-    if not os.path.exists(output_path):
-        os.makedirs(output_path)
-    logger = utils.get_logger(output_path)
-
-    logger.info("Loading candidate encoding from path: %s" % params["candidate_encoding"])
-    candidate_encoding = torch.load(params["candidate_encoding"])
-    vector_size = candidate_encoding.size(1)
+def get_index(params, faiss_index, vector_size):
     index_buffer = params["index_buffer"]
-    if params["hnsw"]:
+    if faiss_index == "hnsw":
         logger.info("Using HNSW index in FAISS")
         index = DenseHNSWFlatIndexer(vector_size, index_buffer)
+    elif faiss_index == "ivfpq":
+        logger.info("Using IVF-PQ index in FAISS")
+        index = DenseIVFPQIndexer(
+            vector_size,
+            index_buffer,
+            nlist=params["nlist"],
+            pq_m=params["pq_m"],
+            pq_nbits=params["pq_nbits"],
+            opq=params["opq"],
+            nprobe=params["nprobe"],
+            train_size=params["train_size"],
+        )
+    elif faiss_index in DenseSQIndexer.QUANTIZER_TYPES:
+        logger.info("Using %s scalar quantized index in FAISS" % faiss_index)
+        index = DenseSQIndexer(
+            vector_size,
+            index_buffer,
+            quantizer=faiss_index,
+            train_size=params["train_size"],
+        )
     else:
         logger.info("Using Flat index in FAISS")
         index = DenseFlatIndexer(vector_size, index_buffer)
+    return index
+
+
+def main(params): 
+    output_path = params["output_path"]
+    output_dir = os.path.dirname(output_path) or "."
+    if not os.path.exists(output_dir):
+        os.makedirs(output_dir)
+    logger = utils.get_logger(output_dir)
+
+    # an encoding store (blink/entity_encoding.py) is memory-mapped, and the
+    # chunks of scripts/generate_candidates.py are loaded one at a time; both
+    # are read one --index_buffer batch at a time while indexing
+    logger.info("Loading candidate encoding from path: %s" % params["candidate_encoding"])
+    candidate_encoding = load_entity_encoding(params["candidate_encoding"], chunks=True)
+    vector_size = candidate_encoding.size(1)
+    faiss_index = "hnsw" if params["hnsw"] else params["faiss_index"]
+    num_shards = params["num_shards"]
+    if num_shards > 1:
+        # every shard is an index of its own, so that they can be built by
+        # parallel jobs (--shard_id) and searched in parallel
+        logger.info("Splitting the entities in %d shards" % num_shards)
+        index = DenseShardedIndexer(
+            lambda: get_index(params, faiss_index, vector_size), num_shards
+        )
+    else:
+        index = get_index(params, faiss_index, vector_size)
 
     logger.info("Building index.")
-    index.index_data(candidate_encoding.numpy())
+    if num_shards > 1 and params["shard_id"] is not None:
+        index.index_shard(candidate_encoding, params["shard_id"])
+    else:
+        index.index_data(candidate_encoding)
     logger.info("Done indexing data.")
 
     if params.get("save_index", None):
-        index.serialize(output_path)
+        # written to the sidecar manifest, checked when the index is loaded
+        meta = {"encoding_checksum": encoding_checksum(candidate_encoding)}
+        if params["entity_catalogue"]:
+            meta["catalogue_checksum"] = catalogue_checksum(params["entity_catalogue"])
+        index.serialize(output_path, meta)
 
 
 if __name__ == '__main__':
@@ -53,11 +107,21 @@ if __name__ == '__main__':
         "--candidate_encoding",
         default="/private/home/ledell/BLINK-Internal/models/all_entities_large.t7",
         type=str,
-        help="file path for candidte encoding.",
+        help="file path for candidte encoding (.t7 tensor, encoding store directory, or directory / .json manifest of {start}_{end}.t7 chunks from scripts/generate_candidates.py).",
+    )
+    parser.add_argument(
+        "--entity_catalogue",
+        default=None,
+        type=str,
+        help="entity catalogue (jsonl or compiled) of the encoding: its checksum is saved with the index, which then cannot be loaded with another catalogue",
+    )
+    parser.add_argument(
+        "--faiss_index", type=str, default="flat", choices=["flat", "hnsw", "ivfpq", "sq8", "fp16"],
+        help='Which faiss index to build',
     )
     parser.add_argument(
         "--hnsw", action='store_true', 
-        help='If enabled, use inference time efficient HNSW index',
+        help='If enabled, use inference time efficient HNSW index (same as --faiss_index hnsw)',
     )
     parser.add_argument(
         "--save_index", action='store_true', 
@@ -67,6 +131,38 @@ if __name__ == '__main__':
         '--index_buffer', type=int, default=50000,
         help="Temporal memory data buffer size (in samples) for indexer",
     )
+    parser.add_argument(
+        '--nlist', type=int, default=None,
+        help="ivfpq: number of clusters (default: about 4 * sqrt(number of entities))",
+    )
+    parser.add_argument(
+        '--pq_m', type=int, default=64,
+        help="ivfpq: number of sub-quantizers, i.e. bytes per vector with 8 bits",
+    )
+    parser.add_argument(
+        '--pq_nbits', type=int, default=8,
+        help="ivfpq: bits per sub-quantizer code",
+    )
+    parser.add_argument(
+        "--opq", action='store_true',
+        help='ivfpq: rotate the vectors with OPQ before quantizing them',
+    )
+    parser.add_argument(
+        '--nprobe', type=int, default=64,
+        help="ivfpq: clusters searched per query (can be changed at search time)",
+    )
+    parser.add_argument(
+        '--train_size', type=int, default=None,
+        help="ivfpq, sq8: number of vectors sampled to train the clusters and codebooks, or the value ranges",
+    )
+    parser.add_argument(
+        '--num_shards', type=int, default=1,
+        help="Split the entities in N contiguous shards, each one a separate index searched in parallel",
+    )
+    parser.add_argument(
+        '--shard_id', type=int, default=None,
+        help="With --num_shards, only build this shard (e.g. one job per shard), writing <output_path>.shard<i>-of-<N> and the manifest <output_path>",
+    )
 
     params = parser.parse_args()
     params = params.__dict__
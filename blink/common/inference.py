@@ -0,0 +1,59 @@
+# Copyright (c) Facebook, Inc. and its affiliates.
+# All rights reserved.
+#
+# This source code is licensed under the license found in the
+# LICENSE file in the root directory of this source tree.
+#
+"""
+CPU inference helpers: thread settings, inference mode and dynamic int8
+quantization, with fallbacks for older torch versions.
+"""
+import torch
+
+
+def inference_mode():
+    """``torch.inference_mode()`` where available, ``torch.no_grad()`` otherwise."""
+    if hasattr(torch, "inference_mode"):
+        return torch.inference_mode()
+    return torch.no_grad()
+
+
+def set_num_threads(num_threads=None, num_interop_threads=None, logger=None):
+    """
+    Number of threads used within (intra-op) and across (inter-op) torch
+    operators. The inter-op threads can only be set before the first
+    parallel work, later calls keep the current setting.
+    """
+    if num_threads:
+        torch.set_num_threads(num_threads)
+    if num_interop_threads and hasattr(torch, "set_num_interop_threads"):
+        try:
+            torch.set_num_interop_threads(num_interop_threads)
+        except RuntimeError as e:
+            if logger:
+                logger.warning("cannot set the inter-op threads: %s" % e)
+    if logger:
+        logger.info(
+            "torch threads: %d intra-op, %d inter-op"
+            % (
+                torch.get_num_threads(),
+                torch.get_num_interop_threads()
+                if hasattr(torch, "get_num_interop_threads")
+                else -1,
+            )
+        )
+
+
+def quantize_dynamic(module):
+    """
+    Dynamic int8 quantization of the linear layers of ``module`` (CPU only):
+    weights are stored in int8, activations are quantized on the fly.
+    """
+    quantization = getattr(torch, "quantization", None)
+    if quantization is None or not hasattr(quantization, "quantize_dynamic"):
+        raise ValueError(
+            "Dynamic quantization needs torch>=1.3, found {}".format(torch.__version__)
+        )
+    return quantization.quantize_dynamic(
+        module, {torch.nn.Linear}, dtype=torch.qint8
+    )
@@ -0,0 +1,153 @@
+# Copyright (c) Facebook, Inc. and its affiliates.
+# All rights reserved.
+#
+# This source code is licensed under the license found in the
+# LICENSE file in the root directory of this source tree.
+#
+"""
+Length-bucketed dataloaders with dynamic padding.
+
+Token id tensors are padded to a fixed maximum length when they are built.
+Batching sequences of similar real length together, and trimming every batch
+to its longest real sequence, keeps the BERT encoders from attending over
+columns that only contain padding. Padding is assumed to be at the end of
+every sequence.
+"""
+import torch
+
+from torch.utils.data import DataLoader, Sampler
+from torch.utils.data.dataloader import default_collate
+
+
+def sequence_lengths(token_ids, null_idx=0):
+    """
+    Real length of every row of a (N x L) tensor, i.e. the position after
+    its last non-padding token. For (N x C x L) tensors, the maximum over C.
+    """
+    positions = torch.arange(1, token_ids.size(-1) + 1, device=token_ids.device)
+    lengths = ((token_ids != null_idx).long() * positions).max(dim=-1)[0]
+    while lengths.dim() > 1:
+        lengths = lengths.max(dim=-1)[0]
+    return lengths
+
+
+class LengthBucketBatchSampler(Sampler):
+    """
+    Batches of indices of sequences of similar length.
+
+    Without ``shuffle``, the dataset is sorted by decreasing length once and
+    the order is kept to map the outputs back (see ``restore_order``). With
+    ``shuffle``, every epoch shuffles the dataset, sorts pools of
+    ``bucket_size`` batches by length, and shuffles the resulting batches.
+    """
+
+    def __init__(
+        self, lengths, batch_size, shuffle=False, bucket_size=100, drop_last=False
+    ):
+        self.lengths = torch.as_tensor(lengths)
+        self.batch_size = batch_size
+        self.shuffle = shuffle
+        self.bucket_size = bucket_size
+        self.drop_last = drop_last
+        self.order = None
+        if not shuffle:
+            self.order = self._sort_by_length(torch.arange(len(self.lengths)))
+
+    def _sort_by_length(self, indices):
+        # stable, so that sequences of the same length keep their order
+        keys = -self.lengths[indices] * len(self.lengths) + torch.arange(len(indices))
+        return indices[keys.argsort()]
+
+    def _batches(self, indices):
+        batches = [
+            indices[start : start + self.batch_size].tolist()
+            for start in range(0, len(indices), self.batch_size)
+        ]
+        if self.drop_last and len(batches) > 0 and len(batches[-1]) < self.batch_size:
+            batches = batches[:-1]
+        return batches
+
+    def __iter__(self):
+        if not self.shuffle:
+            return iter(self._batches(self.order))
+
+        indices = torch.randperm(len(self.lengths))
+        pool_size = self.batch_size * self.bucket_size
+        batches = []
+        for start in range(0, len(indices), pool_size):
+            pool = self._sort_by_length(indices[start : start + pool_size])
+            batches.extend(self._batches(pool))
+        return iter([batches[i] for i in torch.randperm(len(batches)).tolist()])
+
+    def __len__(self):
+        if self.drop_last:
+            return len(self.lengths) // self.batch_size
+        return (len(self.lengths) + self.batch_size - 1) // self.batch_size
+
+    def restore_order(self, items):
+        """Map per-sample ``items``, in the order of the batches, back to the dataset order."""
+        if self.order is None:
+            raise ValueError("The order of a shuffled sampler cannot be restored")
+        restored = [None] * len(items)
+        for item, idx in zip(items, self.order.tolist()):
+            restored[idx] = item
+        return restored
+
+
+class TrimPadding(object):
+    """
+    Collate function trimming the last dimension of the tensors at
+    ``fields`` to the longest real sequence of the batch (and at least
+    ``min_length``).
+    """
+
+    def __init__(self, fields=(0,), null_idx=0, min_length=1):
+        self.fields = fields
+        self.null_idx = null_idx
+        self.min_length = min_length
+
+    def __call__(self, batch):
+        batch = default_collate(batch)
+        for field in self.fields:
+            length = int(sequence_lengths(batch[field], self.null_idx).max())
+            length = max(length, self.min_length)
+            batch[field] = batch[field][..., :length].contiguous()
+        return batch
+
+
+def length_bucketed_dataloader(
+    tensor_data,
+    batch_size,
+    fields=(0,),
+    null_idx=0,
+    min_length=1,
+    shuffle=False,
+    bucket_size=100,
+):
+    """
+    DataLoader over the TensorDataset ``tensor_data`` with batches of similar
+    lengths of the token id tensors at ``fields``, trimmed to their longest
+    real sequence.
+    """
+    lengths = None
+    for field in fields:
+        field_lengths = sequence_lengths(tensor_data.tensors[field], null_idx)
+        lengths = field_lengths if lengths is None else torch.max(lengths, field_lengths)
+    batch_sampler = LengthBucketBatchSampler(
+        lengths, batch_size, shuffle=shuffle, bucket_size=bucket_size
+    )
+    return DataLoader(
+        tensor_data,
+        batch_sampler=batch_sampler,
+        collate_fn=TrimPadding(fields, null_idx, min_length),
+    )
+
+
+def restore_order(items, dataloader):
+    """
+    Per-sample outputs of a pass over ``dataloader``, in the order of its
+    dataset. Outputs of other dataloaders are returned as they are.
+    """
+    if isinstance(dataloader.batch_sampler, LengthBucketBatchSampler):
+        return dataloader.batch_sampler.restore_order(items)
+    return items
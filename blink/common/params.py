@@ -89,6 +89,26 @@ class BlinkParser(argparse.ArgumentParser):
             type=bool,
             help="Whether the dataset is from zeroshot.",
         )
+        parser.add_argument(
+            "--tokenizer_backend",
+            default="python",
+            choices=["python", "process", "fast"],
+            help="How to tokenize the mention data: one sample at a time (python), "
+            "in a pool of processes (process) or in batches with the Rust "
+            "tokenizer of transformers (fast). All produce the same token ids.",
+        )
+        parser.add_argument(
+            "--tokenizer_workers",
+            default=None,
+            type=int,
+            help="Number of processes of the process tokenizer backend "
+            "(default: number of CPUs).",
+        )
+        parser.add_argument(
+            "--verify_tokenization",
+            action="store_true",
+            help="Check the token ids of the tokenizer backend against the python one.",
+        )
 
     def add_model_args(self, args=None):
         """
@@ -188,6 +208,12 @@ class BlinkParser(argparse.ArgumentParser):
             help="Total batch size for evaluation.",
         )
         parser.add_argument("--max_grad_norm", default=1.0, type=float)
+        parser.add_argument(
+            "--length_bucketing",
+            action="store_true",
+            help="Batch samples of similar length together and trim the "
+            "padding of every batch.",
+        )
         parser.add_argument(
             "--learning_rate",
             default=3e-5,
@@ -0,0 +1,234 @@
+# Copyright (c) Facebook, Inc. and its affiliates.
+# All rights reserved.
+#
+# This source code is licensed under the license found in the
+# LICENSE file in the root directory of this source tree.
+#
+"""
+Opt-in operator level profiling of a window of batches.
+
+With ``--profile``, ``get_profiler`` returns a ``BatchProfiler`` which skips
+the first ``--profile_skip`` batches, warms up for ``--profile_warmup``
+batches and records the next ``--profile_active`` ones with
+``torch.profiler``. When the window ends (or the profiler is closed) it
+writes, in ``--profile_dir``:
+
+    <name>_trace.json   Chrome trace (chrome://tracing or https://ui.perfetto.dev)
+    <name>_ops.txt      operator table, sorted by self time
+
+The spans of the BERT encoders, the ELQ mention head, the candidate scoring
+matmul and the nearest neighbour search are labelled with ``record_function``
+(``bert_encoder``, ``elq_mention_head``, ``candidate_scoring``,
+``faiss_search``). Without ``--profile`` the labels are the only overhead.
+"""
+import contextlib
+import os
+
+import torch
+
+
+def record_function(name):
+    """``torch.autograd.profiler.record_function(name)``, if available."""
+    profiler = getattr(torch.autograd, "profiler", None)
+    if profiler is None or not hasattr(profiler, "record_function"):
+        return _no_record()
+    return profiler.record_function(name)
+
+
+@contextlib.contextmanager
+def _no_record():
+    yield
+
+
+def add_profiler_args(parser):
+    """Add the --profile* arguments to ``parser``."""
+    parser.add_argument(
+        "--profile",
+        action="store_true",
+        help="Profile a window of batches with torch.profiler.",
+    )
+    parser.add_argument(
+        "--profile_dir",
+        type=str,
+        default=None,
+        help="Directory of the Chrome traces and operator tables "
+        "(default: <output_path>/profile).",
+    )
+    parser.add_argument(
+        "--profile_skip",
+        type=int,
+        default=1,
+        help="Batches run before the profiler warm up.",
+    )
+    parser.add_argument(
+        "--profile_warmup",
+        type=int,
+        default=1,
+        help="Batches profiled but not recorded, before the recorded ones.",
+    )
+    parser.add_argument(
+        "--profile_active", type=int, default=3, help="Batches recorded."
+    )
+    parser.add_argument(
+        "--profile_record_shapes",
+        action="store_true",
+        help="Record the input shapes of the operators.",
+    )
+    parser.add_argument(
+        "--profile_memory",
+        action="store_true",
+        help="Record the memory allocated by the operators.",
+    )
+
+
+class NoProfiler(object):
+    """Profiler interface, doing nothing."""
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def step(self):
+        pass
+
+    def close(self):
+        pass
+
+
+class BatchProfiler(NoProfiler):
+    """
+    Profile batches ``[skip + warmup, skip + warmup + active)``; ``step()``
+    is called after every batch. Uses ``torch.profiler`` with a schedule
+    where available (torch>=1.8.1), ``torch.autograd.profiler`` otherwise.
+    """
+
+    def __init__(
+        self,
+        output_dir,
+        name="profile",
+        skip=1,
+        warmup=1,
+        active=3,
+        record_shapes=False,
+        profile_memory=False,
+        row_limit=40,
+        logger=None,
+    ):
+        self.output_dir = output_dir
+        self.name = name
+        self.skip = skip
+        self.warmup = warmup
+        self.active = active
+        self.record_shapes = record_shapes
+        self.profile_memory = profile_memory
+        self.row_limit = row_limit
+        self.logger = logger
+        self.use_cuda = torch.cuda.is_available()
+        self.num_steps = 0
+        self.profiler = None
+        self.exported = False
+        if not os.path.exists(output_dir):
+            os.makedirs(output_dir)
+
+        self.legacy = not (
+            hasattr(torch, "profiler") and hasattr(torch.profiler, "schedule")
+        )
+        if not self.legacy:
+            activities = [torch.profiler.ProfilerActivity.CPU]
+            if self.use_cuda:
+                activities.append(torch.profiler.ProfilerActivity.CUDA)
+            self.profiler = torch.profiler.profile(
+                activities=activities,
+                schedule=torch.profiler.schedule(
+                    wait=skip, warmup=warmup, active=active, repeat=1
+                ),
+                on_trace_ready=self._export,
+                record_shapes=record_shapes,
+                profile_memory=profile_memory,
+            )
+            self.profiler.start()
+        else:
+            self._legacy_update()
+
+    def _legacy_update(self):
+        # torch.autograd.profiler has no schedule, the recording starts and
+        # stops at the window bounds and the warmup batches are only skipped
+        start = self.skip + self.warmup
+        if self.num_steps == start and self.profiler is None and not self.exported:
+            kwargs = {}
+            if self.use_cuda:
+                kwargs["use_cuda"] = True
+            if self.record_shapes:
+                kwargs["record_shapes"] = True
+            if self.profile_memory:
+                kwargs["profile_memory"] = True
+            self.profiler = torch.autograd.profiler.profile(**kwargs)
+            self.profiler.__enter__()
+        elif self.num_steps == start + self.active and self.profiler is not None:
+            self._legacy_stop()
+
+    def _legacy_stop(self):
+        self.profiler.__exit__(None, None, None)
+        self._export(self.profiler)
+        self.profiler = None
+
+    def _export(self, profiler):
+        trace_path = os.path.join(self.output_dir, "%s_trace.json" % self.name)
+        table_path = os.path.join(self.output_dir, "%s_ops.txt" % self.name)
+        profiler.export_chrome_trace(trace_path)
+        sort_by = "self_cuda_time_total" if self.use_cuda else "self_cpu_time_total"
+        table = profiler.key_averages().table(sort_by=sort_by, row_limit=self.row_limit)
+        with open(table_path, "w") as fout:
+            fout.write(table)
+        self.exported = True
+        if self.logger:
+            self.logger.info(
+                "%s profile: Chrome trace written to %s, operators to %s"
+                % (self.name, trace_path, table_path)
+            )
+
+    def step(self):
+        self.num_steps += 1
+        if self.legacy:
+            self._legacy_update()
+        elif self.profiler is not None:
+            self.profiler.step()
+
+    def close(self):
+        """Stop profiling, exporting a window cut short by the end of the data."""
+        if self.profiler is not None:
+            if self.legacy:
+                self._legacy_stop()
+            else:
+                self.profiler.stop()
+                self.profiler = None
+        if not self.exported and self.logger:
+            self.logger.warning(
+                "%s profile: only %d batches, nothing recorded (--profile_skip %d "
+                "--profile_warmup %d)" % (self.name, self.num_steps, self.skip, self.warmup)
+            )
+
+
+def get_profiler(params, name, logger=None):
+    """
+    ``BatchProfiler`` writing ``<name>_trace.json`` and ``<name>_ops.txt``
+    with the --profile* ``params`` (dict), or a ``NoProfiler`` without
+    ``params["profile"]``.
+    """
+    if not params.get("profile"):
+        return NoProfiler()
+    output_dir = params.get("profile_dir") or os.path.join(
+        params.get("output_path") or ".", "profile"
+    )
+    return BatchProfiler(
+        output_dir,
+        name=name,
+        skip=params.get("profile_skip", 1),
+        warmup=params.get("profile_warmup", 1),
+        active=params.get("profile_active", 3),
+        record_shapes=params.get("profile_record_shapes", False),
+        profile_memory=params.get("profile_memory", False),
+        logger=logger,
+    )
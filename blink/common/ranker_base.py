@@ -6,6 +6,8 @@
 #
 from torch import nn
 
+from blink.common.profiling import record_function
+
 
 def get_model_obj(model):
     model = model.module if hasattr(model, "module") else model
@@ -26,9 +28,10 @@ class BertEncoder(nn.Module):
             self.additional_linear = None
 
     def forward(self, token_ids, segment_ids, attention_mask):
-        output_bert, output_pooler = self.bert_model(
-            token_ids, segment_ids, attention_mask
-        )
+        with record_function("bert_encoder"):
+            output_bert, output_pooler = self.bert_model(
+                token_ids, segment_ids, attention_mask
+            )
         # get embedding of [CLS] token
         if self.additional_linear is not None:
             embeddings = output_pooler
@@ -0,0 +1,184 @@
+# Copyright (c) Facebook, Inc. and its affiliates.
+# All rights reserved.
+#
+# This source code is licensed under the license found in the
+# LICENSE file in the root directory of this source tree.
+#
+"""
+Lightweight per-stage instrumentation: wall time, number of calls, number of
+items (e.g. mentions or candidate pairs) and memory of every stage.
+
+    timer = StageTimer()
+    with timer.stage("biencoder", count=len(samples)):
+        ...
+    timer.report()  # {"biencoder": {"time": ..., "calls": 1, "count": ..., ...}}
+
+Stages can be nested, the time and peak memory of an inner stage are also
+counted in the outer one.
+
+The memory of a stage is the growth of the resident memory of the process
+over the stage (``rss_growth_mb``, the peak during the stage minus the
+resident memory at its start) and the peak CUDA memory allocated during the
+stage (``peak_cuda_mb``). ``process_peak_rss_mb`` is the high-water mark of
+the process at the end of the stage, it never decreases. CUDA peak stats are
+global to the process and are reset at the start of every stage, other
+users of ``torch.cuda.max_memory_allocated`` see them reset too. The module
+level ``stage(timer, name, count)``
+accepts ``timer=None``, so that code paths can be instrumented without
+checking for a timer.
+"""
+import contextlib
+import json
+import os
+import threading
+import time
+
+from collections import OrderedDict
+
+import torch
+
+try:
+    import resource
+except ImportError:  # not available on Windows
+    resource = None
+
+
+def _peak_rss_mb():
+    """Peak resident memory of the process so far, in MB."""
+    if resource is None:
+        return -1.0
+    # kilobytes on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.0
+
+
+def _rss_mb():
+    """Current resident memory of the process, in MB (Linux only)."""
+    try:
+        with open("/proc/self/statm") as fin:
+            resident_pages = int(fin.read().split()[1])
+    except (IOError, OSError, IndexError, ValueError):
+        return -1.0
+    return resident_pages * os.sysconf("SC_PAGE_SIZE") / 2 ** 20
+
+
+def _reset_peak_cuda():
+    if not torch.cuda.is_available():
+        return
+    if hasattr(torch.cuda, "reset_peak_memory_stats"):
+        torch.cuda.reset_peak_memory_stats()
+    else:
+        torch.cuda.reset_max_memory_allocated()
+
+
+def _peak_cuda_mb():
+    if not torch.cuda.is_available():
+        return -1.0
+    return torch.cuda.max_memory_allocated() / 2 ** 20
+
+
+class StageTimer(object):
+    def __init__(self):
+        self.stages = OrderedDict()
+        self._lock = threading.Lock()
+        # CUDA peaks of the open stages of every thread
+        self._local = threading.local()
+
+    def _record(self, name):
+        if name not in self.stages:
+            self.stages[name] = {
+                "time": 0.0,
+                "calls": 0,
+                "count": 0,
+                "rss_growth_mb": -1.0,
+                "process_peak_rss_mb": -1.0,
+                "peak_cuda_mb": -1.0,
+            }
+        return self.stages[name]
+
+    @contextlib.contextmanager
+    def stage(self, name, count=0):
+        """Time the ``with`` block as stage ``name``, processing ``count`` items."""
+        open_peaks = getattr(self._local, "peaks", None)
+        if open_peaks is None:
+            open_peaks = self._local.peaks = []
+        if open_peaks:
+            # the peak of the enclosing stage so far, before resetting it
+            open_peaks[-1] = max(open_peaks[-1], _peak_cuda_mb())
+        open_peaks.append(-1.0)
+        _reset_peak_cuda()
+        start_rss = _rss_mb()
+        start_peak_rss = _peak_rss_mb()
+        start_time = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - start_time
+            peak_cuda = max(open_peaks.pop(), _peak_cuda_mb())
+            if open_peaks:
+                open_peaks[-1] = max(open_peaks[-1], peak_cuda)
+            end_peak_rss = _peak_rss_mb()
+            rss_growth = -1.0
+            if start_rss >= 0:
+                # a new process high-water mark was reached in the stage,
+                # otherwise its peak is only known to be at least the
+                # current resident memory
+                stage_peak_rss = max(start_rss, _rss_mb())
+                if end_peak_rss > start_peak_rss:
+                    stage_peak_rss = max(stage_peak_rss, end_peak_rss)
+                rss_growth = stage_peak_rss - start_rss
+            with self._lock:
+                record = self._record(name)
+                record["time"] += elapsed
+                record["calls"] += 1
+                record["count"] += count
+                record["rss_growth_mb"] = max(record["rss_growth_mb"], rss_growth)
+                record["process_peak_rss_mb"] = max(
+                    record["process_peak_rss_mb"], end_peak_rss
+                )
+                record["peak_cuda_mb"] = max(record["peak_cuda_mb"], peak_cuda)
+
+    def time(self, name):
+        return self.stages[name]["time"] if name in self.stages else 0.0
+
+    def report(self):
+        """Per-stage metrics, with the throughput in items per second."""
+        report = OrderedDict()
+        with self._lock:
+            for name, record in self.stages.items():
+                report[name] = dict(record)
+                report[name]["items_per_s"] = (
+                    record["count"] / record["time"] if record["time"] > 0 else 0.0
+                )
+        return report
+
+    def summary(self):
+        lines = []
+        for name, record in self.report().items():
+            lines.append(
+                "%s: %.3fs, %d calls, %d items (%.1f items/s), RSS +%.0f MB"
+                % (
+                    name,
+                    record["time"],
+                    record["calls"],
+                    record["count"],
+                    record["items_per_s"],
+                    record["rss_growth_mb"],
+                )
+            )
+        return "\n".join(lines)
+
+    def save(self, path):
+        with open(path, "w") as fout:
+            json.dump(self.report(), fout, indent=2)
+
+
+def stage(timer, name, count=0):
+    """``timer.stage(name, count)``, or a no-op context without a timer."""
+    if timer is None:
+        return _no_stage()
+    return timer.stage(name, count)
+
+
+@contextlib.contextmanager
+def _no_stage():
+    yield
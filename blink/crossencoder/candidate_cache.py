@@ -0,0 +1,239 @@
+# Copyright (c) Facebook, Inc. and its affiliates.
+# All rights reserved.
+#
+# This source code is licensed under the license found in the
+# LICENSE file in the root directory of this source tree.
+#
+"""
+Persistent cache of the crossencoder token ids of every entity.
+
+``prepare_crossencoder_candidates`` tokenizes the title and text of every
+top-k candidate of every mention, so popular entities are tokenized over and
+over. The cache holds the ``get_candidate_representation`` ids of all the
+entities of the catalogue, computed once, and is memory-mapped on load so
+that building the candidate input is a gather:
+
+    meta.json      format version, tokenizer checksum, number of entities
+                   and the cached max_cand_lengths
+    ids_<L>.npy    (num_entities x L) token ids for max_cand_length L
+"""
+import argparse
+import hashlib
+import json
+import os
+
+import numpy as np
+from tqdm import tqdm
+
+import blink.biencoder.data_process as data
+
+
+CANDIDATE_CACHE_VERSION = 1
+META_NAME = "meta.json"
+
+
+def _ids_name(max_cand_length):
+    return "ids_{}.npy".format(max_cand_length)
+
+
+def tokenizer_checksum(tokenizer):
+    """Checksum of the vocabulary, added tokens and casing of ``tokenizer``."""
+    checksum = hashlib.sha1()
+    basic_tokenizer = getattr(tokenizer, "basic_tokenizer", None)
+    checksum.update(str(getattr(basic_tokenizer, "do_lower_case", None)).encode())
+    tokens = tokenizer.convert_ids_to_tokens(list(range(len(tokenizer))))
+    checksum.update("\n".join(tokens).encode("utf-8"))
+    return checksum.hexdigest()
+
+
+def is_candidate_cache(path):
+    return os.path.isdir(path) and os.path.exists(os.path.join(path, META_NAME))
+
+
+def build_candidate_cache(
+    tokenizer,
+    id2title,
+    id2text,
+    output_path,
+    max_cand_length=128,
+    num_entities=None,
+    tokenizer_backend="python",
+    chunk_size=4096,
+    logger=None,
+):
+    """
+    Tokenize every entity of the catalogue with ``tokenizer`` and add the
+    ids for ``max_cand_length`` to the cache at ``output_path``.
+    """
+    if num_entities is None:
+        num_entities = len(id2title)
+    checksum = tokenizer_checksum(tokenizer)
+
+    meta = {
+        "version": CANDIDATE_CACHE_VERSION,
+        "tokenizer_checksum": checksum,
+        "num_entities": num_entities,
+        "max_cand_lengths": [],
+    }
+    if is_candidate_cache(output_path):
+        with open(os.path.join(output_path, META_NAME)) as fin:
+            old_meta = json.load(fin)
+        if (
+            old_meta["tokenizer_checksum"] == checksum
+            and old_meta["num_entities"] == num_entities
+        ):
+            meta["max_cand_lengths"] = [
+                length
+                for length in old_meta["max_cand_lengths"]
+                if length != max_cand_length
+            ]
+    os.makedirs(output_path, exist_ok=True)
+
+    fast_tokenizer = None
+    if tokenizer_backend == "fast":
+        fast_tokenizer = data.get_fast_tokenizer(tokenizer)
+    elif tokenizer_backend != "python":
+        raise ValueError(
+            "Unsupported tokenizer backend {} for the candidate cache".format(
+                tokenizer_backend
+            )
+        )
+
+    # the BERT vocabularies fit in 16 bits
+    dtype = np.uint16 if len(tokenizer) <= np.iinfo(np.uint16).max else np.int32
+    ids = np.lib.format.open_memmap(
+        os.path.join(output_path, _ids_name(max_cand_length)),
+        mode="w+",
+        dtype=dtype,
+        shape=(num_entities, max_cand_length),
+    )
+    for start in tqdm(range(0, num_entities, chunk_size)):
+        entity_ids = range(start, min(start + chunk_size, num_entities))
+        reps = data.get_candidate_representations(
+            [id2text[entity_id] for entity_id in entity_ids],
+            tokenizer,
+            max_cand_length,
+            [id2title[entity_id] for entity_id in entity_ids],
+            fast_tokenizer=fast_tokenizer,
+        )
+        ids[start : start + len(reps)] = [rep["ids"] for rep in reps]
+    ids.flush()
+    del ids
+
+    meta["max_cand_lengths"] = sorted(meta["max_cand_lengths"] + [max_cand_length])
+    with open(os.path.join(output_path, META_NAME), "w") as fout:
+        json.dump(meta, fout, indent=2)
+    if logger:
+        logger.info(
+            "Cached the token ids of %d entities (max_cand_length %d) in %s"
+            % (num_entities, max_cand_length, output_path)
+        )
+    return meta
+
+
+class CandidateCache(object):
+    def __init__(self, path, max_cand_length=128):
+        self.path = path
+        self.max_cand_length = max_cand_length
+        with open(os.path.join(path, META_NAME)) as fin:
+            self.meta = json.load(fin)
+        if self.meta["version"] != CANDIDATE_CACHE_VERSION:
+            raise ValueError(
+                "Unsupported candidate cache version {} (expected {})".format(
+                    self.meta["version"], CANDIDATE_CACHE_VERSION
+                )
+            )
+        if max_cand_length not in self.meta["max_cand_lengths"]:
+            raise ValueError(
+                "The candidate cache {} has no token ids for max_cand_length {} "
+                "(cached: {})".format(
+                    path, max_cand_length, self.meta["max_cand_lengths"]
+                )
+            )
+        self.ids = np.load(
+            os.path.join(path, _ids_name(max_cand_length)), mmap_mode="r"
+        )
+
+    def __len__(self):
+        return self.ids.shape[0]
+
+    def __getitem__(self, entity_ids):
+        """Token ids of ``entity_ids`` as an int64 (len(entity_ids) x L) array."""
+        return self.ids[np.asarray(entity_ids, dtype=np.int64)].astype(np.int64)
+
+    def check(self, tokenizer=None, num_entities=None):
+        """Raise an error if the cache was built for another tokenizer or catalogue."""
+        if num_entities is not None and num_entities != len(self):
+            raise ValueError(
+                "The candidate cache {} has {} entities, the catalogue {}".format(
+                    self.path, len(self), num_entities
+                )
+            )
+        if (
+            tokenizer is not None
+            and tokenizer_checksum(tokenizer) != self.meta["tokenizer_checksum"]
+        ):
+            raise ValueError(
+                "The candidate cache {} was built with another tokenizer".format(
+                    self.path
+                )
+            )
+
+
+def load_candidate_cache(path, tokenizer=None, num_entities=None, max_cand_length=128):
+    candidate_cache = CandidateCache(path, max_cand_length)
+    candidate_cache.check(tokenizer, num_entities)
+    return candidate_cache
+
+
+if __name__ == "__main__":
+    import blink.candidate_ranking.utils as utils
+    from blink.crossencoder.crossencoder import get_crossencoder_tokenizer
+    from blink.main_dense import _load_catalogue
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "--crossencoder_config",
+        type=str,
+        default="models/crossencoder_wiki_large.json",
+        help="Path to the crossencoder configuration.",
+    )
+    parser.add_argument(
+        "--entity_catalogue",
+        type=str,
+        default="models/entity.jsonl",
+        help="Path to the entity catalogue (jsonl or compiled).",
+    )
+    parser.add_argument(
+        "--output_path",
+        type=str,
+        default="models/candidate_cache",
+        help="Directory to save the candidate cache to.",
+    )
+    parser.add_argument("--max_cand_length", type=int, default=128)
+    parser.add_argument(
+        "--tokenizer_backend",
+        type=str,
+        default="python",
+        choices=["python", "fast"],
+        help="Tokenize one entity at a time (python) or in batches with the "
+        "Rust tokenizer of transformers (fast).",
+    )
+    args = parser.parse_args()
+
+    logger = utils.get_logger()
+    with open(args.crossencoder_config) as json_file:
+        crossencoder_params = json.load(json_file)
+    tokenizer = get_crossencoder_tokenizer(crossencoder_params)
+
+    logger.info("Loading entity catalogue from %s" % args.entity_catalogue)
+    _, id2title, id2text, _ = _load_catalogue(args.entity_catalogue, logger)
+    build_candidate_cache(
+        tokenizer,
+        id2title,
+        id2text,
+        args.output_path,
+        max_cand_length=args.max_cand_length,
+        tokenizer_backend=args.tokenizer_backend,
+        logger=logger,
+    )
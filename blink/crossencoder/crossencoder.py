@@ -29,6 +29,7 @@ from pytorch_transformers.tokenization_bert import BertTokenizer
 from pytorch_transformers.tokenization_roberta import RobertaTokenizer
 
 from blink.common.ranker_base import BertEncoder, get_model_obj
+from blink.common.inference import quantize_dynamic
 from blink.common.optimizer import get_bert_optimizer
 from blink.common.params import ENT_START_TAG, ENT_END_TAG, ENT_TITLE_TAG
 
@@ -39,6 +40,25 @@ def load_crossencoder(params):
     return crossencoder
 
 
+def get_crossencoder_tokenizer(params):
+    if params.get("roberta"):
+        tokenizer = RobertaTokenizer.from_pretrained(params["bert_model"],)
+    else:
+        tokenizer = BertTokenizer.from_pretrained(
+            params["bert_model"], do_lower_case=params["lowercase"]
+        )
+
+    special_tokens_dict = {
+        "additional_special_tokens": [
+            ENT_START_TAG,
+            ENT_END_TAG,
+            ENT_TITLE_TAG,
+        ],
+    }
+    tokenizer.add_special_tokens(special_tokens_dict)
+    return tokenizer
+
+
 class CrossEncoderModule(torch.nn.Module):
     def __init__(self, params, tokenizer):
         super(CrossEncoderModule, self).__init__()
@@ -72,21 +92,7 @@ class CrossEncoderRanker(torch.nn.Module):
         )
         self.n_gpu = torch.cuda.device_count()
 
-        if params.get("roberta"):
-            self.tokenizer = RobertaTokenizer.from_pretrained(params["bert_model"],)
-        else:
-            self.tokenizer = BertTokenizer.from_pretrained(
-                params["bert_model"], do_lower_case=params["lowercase"]
-            )
-
-        special_tokens_dict = {
-            "additional_special_tokens": [
-                ENT_START_TAG,
-                ENT_END_TAG,
-                ENT_TITLE_TAG,
-            ],
-        }
-        self.tokenizer.add_special_tokens(special_tokens_dict)
+        self.tokenizer = get_crossencoder_tokenizer(params)
         self.NULL_IDX = self.tokenizer.pad_token_id
         self.START_TOKEN = self.tokenizer.cls_token
         self.END_TOKEN = self.tokenizer.sep_token
@@ -94,7 +100,7 @@ class CrossEncoderRanker(torch.nn.Module):
         # init model
         self.build_model()
         if params["path_to_model"] is not None:
-            self.load_model(params["path_to_model"])
+            self.load_model(params["path_to_model"], cpu=self.device.type == "cpu")
 
         self.model = self.model.to(self.device)
         self.data_parallel = params.get("data_parallel")
@@ -114,6 +120,16 @@ class CrossEncoderRanker(torch.nn.Module):
 
     def build_model(self):
         self.model = CrossEncoderModule(self.params, self.tokenizer)
+
+    def quantize(self):
+        """
+        Dynamic int8 quantization of the linear layers of the BERT encoder,
+        for inference on CPU.
+        """
+        if self.device.type != "cpu":
+            raise ValueError("Quantized crossencoder only runs on CPU")
+        model = get_model_obj(self.model)
+        model.encoder = quantize_dynamic(model.encoder)
     
     def save_model(self, output_dir):
         if not os.path.exists(output_dir):
@@ -43,10 +43,55 @@ def prepare_crossencoder_mentions(
     return context_input_list
 
 
+def truncate_candidates(nns, scores, topk=100, score_drop=None, min_k=1):
+    """
+    Candidates of every mention for the crossencoder: the first ``topk``
+    biencoder candidates and, with a ``score_drop``, only the ones whose score
+    is within ``score_drop`` of the top-1 one (at least ``min_k``). ``scores``
+    are the biencoder similarities, in descending order.
+    """
+    truncated = []
+    for nn, mention_scores in zip(nns, scores):
+        nn = np.asarray(nn)[:topk]
+        if score_drop is not None and len(nn) > 0:
+            mention_scores = np.asarray(mention_scores)[: len(nn)]
+            num_cands = int(np.sum(mention_scores >= mention_scores[0] - score_drop))
+            nn = nn[: max(num_cands, min_k)]
+        truncated.append(nn)
+    return truncated
+
+
+def pad_candidates(candidate_input_list, max_cand_length=128):
+    """
+    (samples X candidates X max_cand_length) array of per-mention candidate
+    token ids, mentions with fewer candidates are padded with empty ones.
+    """
+    num_cands = max([len(candidates) for candidates in candidate_input_list] + [0])
+    candidate_input = np.zeros(
+        (len(candidate_input_list), num_cands, max_cand_length), dtype=np.int64
+    )
+    for i, candidates in enumerate(candidate_input_list):
+        if len(candidates) > 0:
+            candidate_input[i, : len(candidates)] = candidates
+    return candidate_input
+
+
 def prepare_crossencoder_candidates(
-    tokenizer, labels, nns, id2title, id2text, max_cand_length=128, topk=100
+    tokenizer,
+    labels,
+    nns,
+    id2title,
+    id2text,
+    max_cand_length=128,
+    topk=100,
+    candidate_cache=None,
 ):
 
+    if candidate_cache is not None:
+        return gather_crossencoder_candidates(
+            candidate_cache, labels, nns, max_cand_length, topk
+        )
+
     START_TOKEN = tokenizer.cls_token
     END_TOKEN = tokenizer.sep_token
 
@@ -81,7 +126,36 @@ def prepare_crossencoder_candidates(
         sys.stdout.flush()
 
     label_input_list = np.asarray(label_input_list)
-    candidate_input_list = np.asarray(candidate_input_list)
+    candidate_input_list = pad_candidates(candidate_input_list, max_cand_length)
+
+    return label_input_list, candidate_input_list
+
+
+def gather_crossencoder_candidates(
+    candidate_cache, labels, nns, max_cand_length=128, topk=100
+):
+    """
+    prepare_crossencoder_candidates from the token ids of a
+    blink.crossencoder.candidate_cache.CandidateCache, without tokenizing.
+    """
+    if candidate_cache.max_cand_length != max_cand_length:
+        raise ValueError(
+            "The candidate cache has max_cand_length {}, expected {}".format(
+                candidate_cache.max_cand_length, max_cand_length
+            )
+        )
+
+    candidate_input_list = []  # samples X topk=10 X 128
+    label_input_list = []  # samples
+    for label, nn in zip(labels, nns):
+        nn = np.asarray(nn[:topk])
+        # last occurrence, as in prepare_crossencoder_candidates
+        matches = np.flatnonzero(nn == label)
+        label_input_list.append(int(matches[-1]) if len(matches) > 0 else -1)
+        candidate_input_list.append(candidate_cache[nn])
+
+    label_input_list = np.asarray(label_input_list)
+    candidate_input_list = pad_candidates(candidate_input_list, max_cand_length)
 
     return label_input_list, candidate_input_list
 
@@ -113,15 +187,35 @@ def filter_crossencoder_tensor_input(
 
 
 def prepare_crossencoder_data(
-    tokenizer, samples, labels, nns, id2title, id2text, keep_all=False
+    tokenizer,
+    samples,
+    labels,
+    nns,
+    id2title,
+    id2text,
+    keep_all=False,
+    candidate_cache=None,
+    topk=100,
 ):
+    """
+    Crossencoder inputs of the mentions and their first ``topk`` candidates.
+    Mentions can have different numbers of candidates (see
+    ``truncate_candidates``), the candidate tensor is then padded with empty
+    candidates.
+    """
 
     # encode mentions
     context_input_list = prepare_crossencoder_mentions(tokenizer, samples)
 
     # encode candidates (output of biencoder)
     label_input_list, candidate_input_list = prepare_crossencoder_candidates(
-        tokenizer, labels, nns, id2title, id2text
+        tokenizer,
+        labels,
+        nns,
+        id2title,
+        id2text,
+        topk=topk,
+        candidate_cache=candidate_cache,
     )
 
     if not keep_all:
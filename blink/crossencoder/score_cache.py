@@ -0,0 +1,129 @@
+# Copyright (c) Facebook, Inc. and its affiliates.
+# All rights reserved.
+#
+# This source code is licensed under the license found in the
+# LICENSE file in the root directory of this source tree.
+#
+"""
+LRU cache of crossencoder scores.
+
+Streams of news and web text link the same mention in the same context over
+and over. Scores are cached per (context, entity) pair, keyed by a hash of
+the crossencoder context token ids and the local id of the entity, so that
+only the missing pairs go through the model. At most ``max_entries`` scores
+are kept in memory; with a ``spill_path``, evicted scores are written to a
+sqlite file and read back on a memory miss.
+"""
+import hashlib
+import sqlite3
+import struct
+import threading
+
+from collections import OrderedDict
+
+import numpy as np
+
+
+class CrossencoderScoreCache(object):
+    def __init__(self, max_entries=1000000, spill_path=None, namespace=""):
+        self.max_entries = max_entries
+        self.spill_path = spill_path
+        # e.g. the crossencoder model path, so that a spill file is not
+        # reused with another model
+        self.namespace = namespace.encode("utf-8")
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self._scores = OrderedDict()
+        self._lock = threading.Lock()
+        self._db = None
+        if spill_path is not None:
+            self._db = sqlite3.connect(spill_path, check_same_thread=False)
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS scores (key BLOB PRIMARY KEY, score REAL)"
+            )
+            self._db.commit()
+
+    def context_key(self, context_ids):
+        """Hash of the (padded) context token ids of a mention."""
+        context_ids = np.ascontiguousarray(context_ids, dtype=np.int64)
+        return hashlib.blake2b(
+            self.namespace + context_ids.tobytes(), digest_size=16
+        ).digest()
+
+    @staticmethod
+    def _key(context_key, entity_id):
+        return context_key + struct.pack("<q", int(entity_id))
+
+    def get_many(self, keys):
+        """
+        Scores of the (context_key, entity_id) ``keys``, None for the ones that
+        are not cached.
+        """
+        scores = []
+        with self._lock:
+            for context_key, entity_id in keys:
+                key = self._key(context_key, entity_id)
+                score = self._scores.get(key)
+                if score is not None:
+                    self._scores.move_to_end(key)
+                    self.hits += 1
+                elif self._db is not None:
+                    row = self._db.execute(
+                        "SELECT score FROM scores WHERE key = ?", (key,)
+                    ).fetchone()
+                    if row is not None:
+                        score = row[0]
+                        self.disk_hits += 1
+                        self._insert(key, score)
+                if score is None:
+                    self.misses += 1
+                scores.append(score)
+            self._spill()
+        return scores
+
+    def put_many(self, keys, scores):
+        with self._lock:
+            for (context_key, entity_id), score in zip(keys, scores):
+                self._insert(self._key(context_key, entity_id), float(score))
+            self._spill()
+
+    def _insert(self, key, score):
+        self._scores[key] = score
+        self._scores.move_to_end(key)
+
+    def _spill(self):
+        # evict the least recently used scores
+        evicted = []
+        while len(self._scores) > self.max_entries:
+            evicted.append(self._scores.popitem(last=False))
+        if self._db is not None and len(evicted) > 0:
+            self._db.executemany(
+                "INSERT OR REPLACE INTO scores (key, score) VALUES (?, ?)", evicted
+            )
+            self._db.commit()
+
+    def __len__(self):
+        return len(self._scores)
+
+    def stats(self):
+        lookups = self.hits + self.disk_hits + self.misses
+        return {
+            "hits": self.hits,
+            "disk_hits": self.disk_hits,
+            "misses": self.misses,
+            "hit_rate": (self.hits + self.disk_hits) / lookups if lookups else 0.0,
+            "size": len(self),
+        }
+
+    def close(self):
+        if self._db is not None:
+            with self._lock:
+                # keep the scores still in memory for the next run
+                self._db.executemany(
+                    "INSERT OR REPLACE INTO scores (key, score) VALUES (?, ?)",
+                    list(self._scores.items()),
+                )
+                self._db.commit()
+                self._db.close()
+                self._db = None
@@ -35,32 +35,52 @@ import blink.biencoder.data_process as data
 from blink.biencoder.zeshel_utils import DOC_PATH, WORLDS, world_to_id
 from blink.common.optimizer import get_bert_optimizer
 from blink.common.params import BlinkParser
+from blink.common.length_bucketing import length_bucketed_dataloader
+from blink.common.inference import inference_mode
+from blink.common.profiling import add_profiler_args, get_profiler
 
 
 logger = None
 
 
-def modify(context_input, candidate_input, max_seq_length):
-    new_input = []
-    context_input = context_input.tolist()
-    candidate_input = candidate_input.tolist()
-
-    for i in range(len(context_input)):
-        cur_input = context_input[i]
-        cur_candidate = candidate_input[i]
-        mod_input = []
-        for j in range(len(cur_candidate)):
-            # remove [CLS] token from candidate
-            sample = cur_input + cur_candidate[j][1:]
-            sample = sample[:max_seq_length]
-            mod_input.append(sample)
-
-        new_input.append(mod_input)
+def modify(context_input, candidate_input, max_seq_length, out=None):
+    """
+    Crossencoder input: every candidate of a mention, without its [CLS]
+    token, appended to the context of the mention, and truncated to
+    ``max_seq_length``. (N x context_len), (N x C x cand_len) ->
+    (N x C x min(context_len + cand_len - 1, max_seq_length)).
+
+    The result is written to ``out`` if given.
+    """
+    if len(context_input) == 0:
+        return torch.LongTensor([]) if out is None else out
+
+    num_samples, num_cands, cand_len = candidate_input.size()
+    context_len = context_input.size(1)
+    seq_len = min(context_len + cand_len - 1, max_seq_length)
+    if out is None:
+        out = torch.empty(
+            (num_samples, num_cands, seq_len),
+            dtype=torch.long,
+            device=context_input.device,
+        )
+    elif out.size() != (num_samples, num_cands, seq_len):
+        raise ValueError(
+            "Expected an output buffer of size {}, got {}".format(
+                (num_samples, num_cands, seq_len), tuple(out.size())
+            )
+        )
 
-    return torch.LongTensor(new_input)
+    context_len = min(context_len, seq_len)
+    out[:, :, :context_len] = context_input[:, None, :context_len]
+    # remove [CLS] token from candidate
+    out[:, :, context_len:] = candidate_input[:, :, 1 : 1 + seq_len - context_len]
+    return out
 
 
-def evaluate(reranker, eval_dataloader, device, logger, context_length, silent=True):
+def evaluate(
+    reranker, eval_dataloader, device, logger, context_length, silent=True, profiler=None
+):
     reranker.model.eval()
     if silent:
         iter_ = eval_dataloader
@@ -78,7 +98,7 @@ def evaluate(reranker, eval_dataloader, device, logger, context_length, silent=T
     for step, batch in enumerate(iter_):
         batch = tuple(t.to(device) for t in batch)
         context_input, label_input = batch
-        with torch.no_grad():
+        with inference_mode():
             eval_loss, logits = reranker(context_input, label_input, context_length)
 
         logits = logits.detach().cpu().numpy()
@@ -91,9 +111,12 @@ def evaluate(reranker, eval_dataloader, device, logger, context_length, silent=T
 
         nb_eval_examples += context_input.size(0)
         nb_eval_steps += 1
+        if profiler is not None:
+            profiler.step()
 
     normalized_eval_accuracy = eval_accuracy / nb_eval_examples
-    logger.info("Eval accuracy: %.5f" % normalized_eval_accuracy)
+    if logger:
+        logger.info("Eval accuracy: %.5f" % normalized_eval_accuracy)
     results["normalized_accuracy"] = normalized_eval_accuracy
     results["logits"] = all_logits
     return results
@@ -181,13 +204,21 @@ def main(params):
     context_input = modify(context_input, candidate_input, max_seq_length)
 
     train_tensor_data = TensorDataset(context_input, label_input)
-    train_sampler = RandomSampler(train_tensor_data)
+    if params["length_bucketing"]:
+        train_dataloader = length_bucketed_dataloader(
+            train_tensor_data,
+            params["train_batch_size"],
+            min_length=context_length,
+            shuffle=True,
+        )
+    else:
+        train_sampler = RandomSampler(train_tensor_data)
 
-    train_dataloader = DataLoader(
-        train_tensor_data, 
-        sampler=train_sampler, 
-        batch_size=params["train_batch_size"]
-    )
+        train_dataloader = DataLoader(
+            train_tensor_data, 
+            sampler=train_sampler, 
+            batch_size=params["train_batch_size"]
+        )
 
     max_n = 2048
     if params["debug"]:
@@ -201,13 +232,18 @@ def main(params):
     context_input = modify(context_input, candidate_input, max_seq_length)
 
     valid_tensor_data = TensorDataset(context_input, label_input)
-    valid_sampler = SequentialSampler(valid_tensor_data)
+    if params["length_bucketing"]:
+        valid_dataloader = length_bucketed_dataloader(
+            valid_tensor_data, params["eval_batch_size"], min_length=context_length,
+        )
+    else:
+        valid_sampler = SequentialSampler(valid_tensor_data)
 
-    valid_dataloader = DataLoader(
-        valid_tensor_data, 
-        sampler=valid_sampler, 
-        batch_size=params["eval_batch_size"]
-    )
+        valid_dataloader = DataLoader(
+            valid_tensor_data, 
+            sampler=valid_sampler, 
+            batch_size=params["eval_batch_size"]
+        )
 
     # evaluate before training
     results = evaluate(
@@ -240,6 +276,8 @@ def main(params):
     best_epoch_idx = -1
     best_score = -1
 
+    # --profile: operator profile of a window of training batches
+    profiler = get_profiler(params, "train_cross", logger)
     num_train_epochs = params["num_train_epochs"]
 
     for epoch_idx in trange(int(num_train_epochs), desc="Epoch"):
@@ -304,6 +342,8 @@ def main(params):
                 model.train()
                 logger.info("\n")
 
+            profiler.step()
+
         logger.info("***** Saving fine - tuned model *****")
         epoch_output_folder_path = os.path.join(
             model_output_path, "epoch_{}".format(epoch_idx)
@@ -327,6 +367,7 @@ def main(params):
         best_score = ls[np.argmax(ls)]
         best_epoch_idx = li[np.argmax(ls)]
         logger.info("\n")
+    profiler.close()
 
     execution_time = (time.time() - time_start) / 60
     utils.write_to_file(
@@ -348,6 +389,7 @@ def main(params):
 if __name__ == "__main__":
     parser = BlinkParser(add_model_args=True)
     parser.add_training_args()
+    add_profiler_args(parser)
 
     # args = argparse.Namespace(**params)
     args = parser.parse_args()
@@ -0,0 +1,342 @@
+# Copyright (c) Facebook, Inc. and its affiliates.
+# All rights reserved.
+#
+# This source code is licensed under the license found in the
+# LICENSE file in the root directory of this source tree.
+#
+"""
+Compiled, memory-mapped entity catalogue.
+
+The plain ``entity.jsonl`` catalogue has to be parsed in full into Python
+dicts by every process. The compiled catalogue stores the same information
+in a directory of flat files that are memory-mapped on load:
+
+    meta.json           format version, number of entities, source checksum
+    data.bin            utf-8 title, text and raw wikipedia idx of every entity
+    offsets.npy         (3 * num_entities + 1) int64 byte offsets into data.bin
+    has_idx.npy         (num_entities,) bool, whether the entity has an "idx"
+    title_index.npy     open-addressing hash table, title -> local id
+    wikipedia_index.npy open-addressing hash table, wikipedia id -> local id
+
+Texts are only decoded when they are accessed, and all pages are shared
+between the processes that open the same catalogue.
+"""
+import argparse
+import hashlib
+import json
+import mmap
+import os
+
+from collections.abc import Mapping
+
+import numpy as np
+
+
+CATALOGUE_VERSION = 2
+META_NAME = "meta.json"
+DATA_NAME = "data.bin"
+OFFSETS_NAME = "offsets.npy"
+HAS_IDX_NAME = "has_idx.npy"
+TITLE_INDEX_NAME = "title_index.npy"
+WIKIPEDIA_INDEX_NAME = "wikipedia_index.npy"
+
+# fields stored for every entity, in this order
+TITLE_FIELD = 0
+TEXT_FIELD = 1
+IDX_FIELD = 2
+NUM_FIELDS = 3
+
+EMPTY_SLOT = -1
+
+
+def parse_wikipedia_id(idx):
+    split = idx.split("curid=")
+    if len(split) > 1:
+        return int(split[-1].strip())
+    return idx.strip()
+
+
+def wikipedia_id2url(wikipedia_id):
+    return "https://en.wikipedia.org/wiki?curid=%s" % wikipedia_id
+
+
+def is_entity_catalogue(path):
+    return os.path.isdir(path) and os.path.exists(os.path.join(path, META_NAME))
+
+
+def _hash_key(key):
+    # stable across processes, unlike the builtin hash() of str; typed like
+    # dict keys, the wikipedia id 123 and the string "123" are different keys
+    if isinstance(key, (int, np.integer)):
+        encoded = b"i" + str(int(key)).encode("utf-8")
+    else:
+        encoded = b"s" + str(key).encode("utf-8")
+    digest = hashlib.blake2b(encoded, digest_size=8).digest()
+    return int.from_bytes(digest, "little")
+
+
+def _table_size(num_keys):
+    size = 1
+    while size < 2 * num_keys:
+        size *= 2
+    return size
+
+
+def _build_hash_table(keys, local_ids, overwrite):
+    """
+    Linear-probing table of local ids. With ``overwrite`` a repeated key
+    points to its last occurrence (as ``dict`` assignment would), otherwise
+    repeated keys raise an error.
+    """
+    table = np.full(_table_size(len(keys)), EMPTY_SLOT, dtype=np.int64)
+    slot_keys = {}
+    mask = len(table) - 1
+    for key, local_id in zip(keys, local_ids):
+        slot = _hash_key(key) & mask
+        while table[slot] != EMPTY_SLOT and slot_keys[slot] != key:
+            slot = (slot + 1) & mask
+        if table[slot] != EMPTY_SLOT and not overwrite:
+            raise ValueError("Duplicate key in entity catalogue: {}".format(key))
+        table[slot] = local_id
+        slot_keys[slot] = key
+    return table
+
+
+def file_checksum(path, block_size=1 << 20):
+    sha = hashlib.sha1()
+    with open(path, "rb") as fin:
+        for block in iter(lambda: fin.read(block_size), b""):
+            sha.update(block)
+    return sha.hexdigest()
+
+
+def catalogue_checksum(entity_catalogue):
+    """Checksum of a jsonl catalogue, or of the source of a compiled one."""
+    if is_entity_catalogue(entity_catalogue):
+        with open(os.path.join(entity_catalogue, META_NAME)) as fin:
+            return json.load(fin)["checksum"]
+    return file_checksum(entity_catalogue)
+
+
+def build_entity_catalogue(entity_catalogue, output_path, logger=None):
+    """
+    Compile ``entity_catalogue`` (jsonl, one entity per line) into a
+    memory-mapped catalogue directory at ``output_path``.
+    """
+    os.makedirs(output_path, exist_ok=True)
+
+    offsets = [0]
+    has_idx = []
+    titles = []
+    wikipedia_ids = []
+    wikipedia_local_ids = []
+    local_idx = 0
+    with open(entity_catalogue, "r") as fin, open(
+        os.path.join(output_path, DATA_NAME), "wb"
+    ) as fout:
+        for line in fin:
+            entity = json.loads(line)
+            idx = entity.get("idx", "")
+            if "idx" in entity:
+                wikipedia_ids.append(parse_wikipedia_id(idx))
+                wikipedia_local_ids.append(local_idx)
+            for field in (entity["title"], entity["text"], idx):
+                encoded = field.encode("utf-8")
+                fout.write(encoded)
+                offsets.append(offsets[-1] + len(encoded))
+            has_idx.append("idx" in entity)
+            titles.append(entity["title"])
+            local_idx += 1
+            if logger and local_idx % 1000000 == 0:
+                logger.info("Read %d entities" % local_idx)
+
+    if logger:
+        logger.info("Building hash indexes for %d entities" % local_idx)
+    title_index = _build_hash_table(titles, range(local_idx), overwrite=True)
+    wikipedia_index = _build_hash_table(
+        wikipedia_ids, wikipedia_local_ids, overwrite=False
+    )
+
+    np.save(os.path.join(output_path, OFFSETS_NAME), np.asarray(offsets, dtype=np.int64))
+    np.save(os.path.join(output_path, HAS_IDX_NAME), np.asarray(has_idx, dtype=np.bool_))
+    np.save(os.path.join(output_path, TITLE_INDEX_NAME), title_index)
+    np.save(os.path.join(output_path, WIKIPEDIA_INDEX_NAME), wikipedia_index)
+
+    meta = {
+        "version": CATALOGUE_VERSION,
+        "num_entities": local_idx,
+        "num_titles": int((title_index != EMPTY_SLOT).sum()),
+        "num_wikipedia_ids": len(wikipedia_ids),
+        "source": os.path.abspath(entity_catalogue),
+        "checksum": file_checksum(entity_catalogue),
+    }
+    with open(os.path.join(output_path, META_NAME), "w") as fout:
+        json.dump(meta, fout, indent=2)
+    if logger:
+        logger.info("Saved entity catalogue to %s" % output_path)
+    return meta
+
+
+class EntityCatalogue(object):
+    def __init__(self, path):
+        self.path = path
+        with open(os.path.join(path, META_NAME)) as fin:
+            self.meta = json.load(fin)
+        if self.meta["version"] != CATALOGUE_VERSION:
+            raise ValueError(
+                "Unsupported entity catalogue version {} (expected {})".format(
+                    self.meta["version"], CATALOGUE_VERSION
+                )
+            )
+        self.num_entities = self.meta["num_entities"]
+
+        def load(name):
+            return np.load(os.path.join(path, name), mmap_mode="r")
+
+        self.offsets = load(OFFSETS_NAME)
+        self.has_idx = load(HAS_IDX_NAME)
+        self.title_index = load(TITLE_INDEX_NAME)
+        self.wikipedia_index = load(WIKIPEDIA_INDEX_NAME)
+
+        self._data_file = open(os.path.join(path, DATA_NAME), "rb")
+        if os.fstat(self._data_file.fileno()).st_size > 0:
+            self.data = mmap.mmap(
+                self._data_file.fileno(), 0, access=mmap.ACCESS_READ
+            )
+        else:
+            self.data = b""
+
+        self.title2id = Title2Id(self)
+        self.id2title = Id2Field(self, TITLE_FIELD)
+        self.id2text = Id2Field(self, TEXT_FIELD)
+        self.wikipedia_id2local_id = WikipediaId2LocalId(self)
+        self.id2url = Id2Url(self)
+
+    def __len__(self):
+        return self.num_entities
+
+    def get_field(self, local_id, field):
+        local_id = int(local_id)
+        if local_id < 0 or local_id >= self.num_entities:
+            raise KeyError(local_id)
+        pos = NUM_FIELDS * local_id + field
+        start, end = int(self.offsets[pos]), int(self.offsets[pos + 1])
+        return self.data[start:end].decode("utf-8")
+
+    def get_wikipedia_id(self, local_id):
+        if not self.has_idx[int(local_id)]:
+            raise KeyError(local_id)
+        return parse_wikipedia_id(self.get_field(local_id, IDX_FIELD))
+
+    def _lookup(self, table, key, get_key):
+        mask = len(table) - 1
+        slot = _hash_key(key) & mask
+        while True:
+            local_id = int(table[slot])
+            if local_id == EMPTY_SLOT:
+                return EMPTY_SLOT
+            if get_key(local_id) == key:
+                return local_id
+            slot = (slot + 1) & mask
+
+    def lookup_title(self, title):
+        return self._lookup(
+            self.title_index, title, lambda i: self.get_field(i, TITLE_FIELD)
+        )
+
+    def lookup_wikipedia_id(self, wikipedia_id):
+        return self._lookup(
+            self.wikipedia_index, wikipedia_id, self.get_wikipedia_id
+        )
+
+    def close(self):
+        if isinstance(self.data, mmap.mmap):
+            self.data.close()
+        self._data_file.close()
+
+
+class _CatalogueView(Mapping):
+    """Read-only dict-like view over an :class:`EntityCatalogue`."""
+
+    def __init__(self, catalogue):
+        self.catalogue = catalogue
+
+
+class Id2Field(_CatalogueView):
+    def __init__(self, catalogue, field):
+        super(Id2Field, self).__init__(catalogue)
+        self.field = field
+
+    def __getitem__(self, local_id):
+        return self.catalogue.get_field(local_id, self.field)
+
+    def __iter__(self):
+        return iter(range(len(self.catalogue)))
+
+    def __len__(self):
+        return len(self.catalogue)
+
+
+class Id2Url(_CatalogueView):
+    def __getitem__(self, local_id):
+        return wikipedia_id2url(self.catalogue.get_wikipedia_id(local_id))
+
+    def __iter__(self):
+        return (int(i) for i in np.flatnonzero(self.catalogue.has_idx))
+
+    def __len__(self):
+        return self.catalogue.meta["num_wikipedia_ids"]
+
+
+class Title2Id(_CatalogueView):
+    def __getitem__(self, title):
+        local_id = self.catalogue.lookup_title(title)
+        if local_id == EMPTY_SLOT:
+            raise KeyError(title)
+        return local_id
+
+    def __iter__(self):
+        table = self.catalogue.title_index
+        for local_id in table[table != EMPTY_SLOT]:
+            yield self.catalogue.get_field(local_id, TITLE_FIELD)
+
+    def __len__(self):
+        return self.catalogue.meta["num_titles"]
+
+
+class WikipediaId2LocalId(_CatalogueView):
+    def __getitem__(self, wikipedia_id):
+        local_id = self.catalogue.lookup_wikipedia_id(wikipedia_id)
+        if local_id == EMPTY_SLOT:
+            raise KeyError(wikipedia_id)
+        return local_id
+
+    def __iter__(self):
+        table = self.catalogue.wikipedia_index
+        for local_id in table[table != EMPTY_SLOT]:
+            yield self.catalogue.get_wikipedia_id(local_id)
+
+    def __len__(self):
+        return self.catalogue.meta["num_wikipedia_ids"]
+
+
+if __name__ == "__main__":
+    import blink.candidate_ranking.utils as utils
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "--entity_catalogue",
+        type=str,
+        default="models/entity.jsonl",
+        help="Path to the entity catalogue (jsonl) to compile.",
+    )
+    parser.add_argument(
+        "--output_path",
+        type=str,
+        default="models/entity_catalogue",
+        help="Directory to save the compiled entity catalogue to.",
+    )
+    args = parser.parse_args()
+
+    logger = utils.get_logger()
+    build_entity_catalogue(args.entity_catalogue, args.output_path, logger)
@@ -0,0 +1,341 @@
+# Copyright (c) Facebook, Inc. and its affiliates.
+# All rights reserved.
+#
+# This source code is licensed under the license found in the
+# LICENSE file in the root directory of this source tree.
+#
+"""
+Memory-mapped store for pre-computed entity encodings.
+
+``torch.load`` on ``all_entities_large.t7`` materializes the full float32
+(num_entities x dim) matrix in every process. The store keeps the matrix in
+a raw, row-major file that is memory-mapped on load, optionally in half
+precision (float16 or bfloat16), and upcasts it to float32 one block of rows
+at a time:
+
+    meta.json       format version, dtype and shape
+    encodings.bin   raw (num_entities x dim) matrix in the stored dtype
+
+``ChunkedEntityEncoding`` reads the ``{start}_{end}.t7`` chunks written by
+scripts/generate_candidates.py as one encoding, one chunk at a time, so that
+indexes can be built without merging them first.
+"""
+import argparse
+import hashlib
+import json
+import os
+import re
+
+import numpy as np
+import torch
+
+
+ENCODING_STORE_VERSION = 1
+META_NAME = "meta.json"
+DATA_NAME = "encodings.bin"
+
+# numpy has no bfloat16, bfloat16 rows are stored as the upper 16 bits of
+# the float32 values
+STORAGE_DTYPES = {
+    "float32": np.float32,
+    "float16": np.float16,
+    "bfloat16": np.uint16,
+}
+
+
+def is_entity_encoding_store(path):
+    return os.path.isdir(path) and os.path.exists(os.path.join(path, META_NAME))
+
+
+def _to_storage(block, dtype):
+    """float32 numpy block -> numpy block in the storage dtype."""
+    block = np.ascontiguousarray(block, dtype=np.float32)
+    if dtype == "bfloat16":
+        # round to nearest even before truncating the mantissa
+        bits = block.view(np.uint32)
+        rounding = ((bits >> 16) & 1) + 0x7FFF
+        return ((bits + rounding) >> 16).astype(np.uint16)
+    return block.astype(STORAGE_DTYPES[dtype])
+
+
+def _from_storage(block, dtype):
+    """numpy block in the storage dtype -> float32 numpy block."""
+    if dtype == "bfloat16":
+        return (block.astype(np.uint32) << 16).view(np.float32)
+    return block.astype(np.float32)
+
+
+def save_entity_encoding(
+    candidate_encoding, output_path, dtype="float16", block_size=65536
+):
+    """
+    Write a (num_entities x dim) tensor or array to an encoding store at
+    ``output_path``, converting ``block_size`` rows at a time.
+    """
+    if dtype not in STORAGE_DTYPES:
+        raise ValueError(
+            "Unsupported dtype {}. Choose from {}.".format(
+                dtype, ",".join(STORAGE_DTYPES)
+            )
+        )
+    os.makedirs(output_path, exist_ok=True)
+    num_entities, dim = candidate_encoding.shape
+    with open(os.path.join(output_path, DATA_NAME), "wb") as fout:
+        for start in range(0, num_entities, block_size):
+            block = candidate_encoding[start : start + block_size]
+            if isinstance(block, torch.Tensor):
+                block = block.float().numpy()
+            fout.write(_to_storage(block, dtype).tobytes())
+
+    meta = {
+        "version": ENCODING_STORE_VERSION,
+        "dtype": dtype,
+        "shape": [int(num_entities), int(dim)],
+    }
+    with open(os.path.join(output_path, META_NAME), "w") as fout:
+        json.dump(meta, fout, indent=2)
+    return meta
+
+
+class EntityEncodingStore(object):
+    def __init__(self, path, block_size=65536):
+        self.path = path
+        self.block_size = block_size
+        with open(os.path.join(path, META_NAME)) as fin:
+            self.meta = json.load(fin)
+        if self.meta["version"] != ENCODING_STORE_VERSION:
+            raise ValueError(
+                "Unsupported entity encoding store version {} (expected {})".format(
+                    self.meta["version"], ENCODING_STORE_VERSION
+                )
+            )
+        self.dtype = self.meta["dtype"]
+        self.shape = tuple(self.meta["shape"])
+        # the file is only mapped here, pages are read on first access
+        self.data = np.memmap(
+            os.path.join(path, DATA_NAME),
+            dtype=STORAGE_DTYPES[self.dtype],
+            mode="r",
+            shape=self.shape,
+        )
+
+    def __len__(self):
+        return self.shape[0]
+
+    def size(self, dim=None):
+        if dim is None:
+            return torch.Size(self.shape)
+        return self.shape[dim]
+
+    def __getitem__(self, idx):
+        """Rows of the encoding as a float32 tensor."""
+        if isinstance(idx, torch.Tensor):
+            idx = idx.numpy()
+        return torch.from_numpy(_from_storage(self.data[idx], self.dtype))
+
+    def iter_blocks(self, block_size=None):
+        """Yield (start, float32 tensor of rows start:start + block_size)."""
+        block_size = block_size or self.block_size
+        for start in range(0, len(self), block_size):
+            yield start, self[start : start + block_size]
+
+    def score(self, embedding_ctxt, block_size=None):
+        """
+        Inner product of ``embedding_ctxt`` (bs x dim) with every stored
+        entity, i.e. ``embedding_ctxt.mm(candidate_encoding.t())``.
+        """
+        scores = []
+        for _, block in self.iter_blocks(block_size):
+            block = block.to(device=embedding_ctxt.device, dtype=embedding_ctxt.dtype)
+            scores.append(embedding_ctxt.mm(block.t()))
+        return torch.cat(scores, dim=1)
+
+
+def encoding_checksum(candidate_encoding, num_rows=1024):
+    """
+    Checksum of the shape and of ``num_rows`` evenly spaced rows of an
+    encoding (tensor, array, store or chunks). The rows are rounded to
+    float16, so that a float16 store has the checksum of its source.
+    """
+    num_entities, dim = tuple(candidate_encoding.shape)
+    checksum = hashlib.sha1("{}x{}".format(num_entities, dim).encode())
+    if num_entities > 0:
+        rows = np.unique(
+            np.linspace(0, num_entities - 1, min(num_entities, num_rows)).astype(
+                np.int64
+            )
+        )
+        sample = candidate_encoding[rows]
+        if isinstance(sample, torch.Tensor):
+            sample = sample.float().numpy()
+        checksum.update(np.asarray(sample, dtype=np.float16).tobytes())
+    return checksum.hexdigest()
+
+
+CHUNK_PATTERN = re.compile(r"^(\d+)_(-?\d+)\.t7$")
+
+
+def is_encoding_chunks(path):
+    """
+    Whether ``path`` is a directory of ``{start}_{end}.t7`` encoding chunks,
+    or a .json manifest ``{"chunks": [chunk paths, in entity order]}``.
+    """
+    if os.path.isdir(path):
+        return not is_entity_encoding_store(path)
+    return path.endswith(".json")
+
+
+def _chunk_files(path):
+    if os.path.isdir(path):
+        chunks = []
+        for name in os.listdir(path):
+            match = CHUNK_PATTERN.match(name)
+            if match:
+                chunks.append((int(match.group(1)), os.path.join(path, name)))
+        if not chunks:
+            raise ValueError("No {start}_{end}.t7 encoding chunks in %s" % path)
+        return [chunk_file for _, chunk_file in sorted(chunks)]
+    with open(path) as fin:
+        manifest = json.load(fin)
+    return [
+        os.path.join(os.path.dirname(path), chunk_file)
+        for chunk_file in manifest["chunks"]
+    ]
+
+
+def _load_chunk(chunk_file, mmap=False):
+    if mmap:
+        # only the shape is needed, without reading the data if possible
+        try:
+            return torch.load(chunk_file, map_location="cpu", mmap=True)
+        except (TypeError, RuntimeError):
+            pass
+    return torch.load(chunk_file, map_location="cpu")
+
+
+class ChunkedEntityEncoding(object):
+    """
+    The encoding chunks of ``path`` (see ``is_encoding_chunks``) read as one
+    (num_entities x dim) float32 encoding. Only the last chunk read is kept
+    in memory, so rows are best read in order, e.g. to build an index.
+    """
+
+    def __init__(self, path, block_size=65536):
+        self.path = path
+        self.block_size = block_size
+        self.chunk_files = _chunk_files(path)
+        sizes = []
+        dim = None
+        for chunk_file in self.chunk_files:
+            if os.path.getsize(chunk_file) == 0:
+                # generate_candidates.py creates the file before encoding
+                raise ValueError(
+                    "Empty encoding chunk %s, is it still being encoded?" % chunk_file
+                )
+            chunk = _load_chunk(chunk_file, mmap=True)
+            start = CHUNK_PATTERN.match(os.path.basename(chunk_file))
+            if start is not None and int(start.group(1)) != sum(sizes):
+                raise ValueError(
+                    "Encoding chunk %s does not start at entity %d, "
+                    "is a chunk missing?" % (chunk_file, sum(sizes))
+                )
+            if dim is not None and chunk.size(1) != dim:
+                raise ValueError(
+                    "Encoding chunk %s has dimension %d instead of %d"
+                    % (chunk_file, chunk.size(1), dim)
+                )
+            sizes.append(chunk.size(0))
+            dim = chunk.size(1)
+            del chunk
+        self.offsets = np.cumsum([0] + sizes)
+        self.shape = (int(self.offsets[-1]), dim)
+        self._chunk_id = None
+        self._chunk = None
+
+    def __len__(self):
+        return self.shape[0]
+
+    def size(self, dim=None):
+        if dim is None:
+            return torch.Size(self.shape)
+        return self.shape[dim]
+
+    def _get_chunk(self, chunk_id):
+        if chunk_id != self._chunk_id:
+            self._chunk = None
+            self._chunk = _load_chunk(self.chunk_files[chunk_id]).float()
+            self._chunk_id = chunk_id
+        return self._chunk
+
+    def __getitem__(self, idx):
+        """Rows of the encoding as a float32 tensor."""
+        if isinstance(idx, slice):
+            rows = np.arange(*idx.indices(len(self)))
+        else:
+            if isinstance(idx, torch.Tensor):
+                idx = idx.numpy()
+            rows = np.asarray(idx)
+        single = rows.ndim == 0
+        rows = np.where(rows < 0, rows + len(self), rows).reshape(-1)
+        chunk_ids = np.searchsorted(self.offsets, rows, side="right") - 1
+        out = torch.empty((len(rows), self.shape[1]), dtype=torch.float32)
+        # every chunk is read once, in order
+        for chunk_id in np.unique(chunk_ids):
+            positions = np.nonzero(chunk_ids == chunk_id)[0]
+            chunk_rows = rows[positions] - self.offsets[chunk_id]
+            out[torch.from_numpy(positions)] = self._get_chunk(chunk_id)[
+                torch.from_numpy(chunk_rows)
+            ]
+        return out[0] if single else out
+
+    def iter_blocks(self, block_size=None):
+        """Yield (start, float32 tensor of rows start:start + block_size)."""
+        block_size = block_size or self.block_size
+        for start in range(0, len(self), block_size):
+            yield start, self[start : start + block_size]
+
+
+def load_entity_encoding(entity_encoding, chunks=False):
+    """
+    Open an encoding store lazily, or fall back to ``torch.load``. With
+    ``chunks``, encoding chunks are opened as a ``ChunkedEntityEncoding``
+    (for sequential reads).
+    """
+    if chunks and is_encoding_chunks(entity_encoding):
+        return ChunkedEntityEncoding(entity_encoding)
+    if is_entity_encoding_store(entity_encoding):
+        return EntityEncodingStore(entity_encoding)
+    return torch.load(entity_encoding)
+
+
+if __name__ == "__main__":
+    import blink.candidate_ranking.utils as utils
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "--entity_encoding",
+        type=str,
+        default="models/all_entities_large.t7",
+        help="Path to the entity encoding tensor (.t7) to convert, or to a "
+        "directory (or .json manifest) of {start}_{end}.t7 encoding chunks.",
+    )
+    parser.add_argument(
+        "--output_path",
+        type=str,
+        default="models/all_entities_large_fp16",
+        help="Directory to save the entity encoding store to.",
+    )
+    parser.add_argument(
+        "--dtype",
+        type=str,
+        default="float16",
+        choices=list(STORAGE_DTYPES),
+        help="Storage precision of the encodings.",
+    )
+    args = parser.parse_args()
+
+    logger = utils.get_logger()
+    logger.info("Loading entity encoding from %s" % args.entity_encoding)
+    candidate_encoding = load_entity_encoding(args.entity_encoding, chunks=True)
+    save_entity_encoding(candidate_encoding, args.output_path, args.dtype)
+    logger.info("Saved %s entity encoding store to %s" % (args.dtype, args.output_path))
@@ -0,0 +1,111 @@
+# Copyright (c) Facebook, Inc. and its affiliates.
+# All rights reserved.
+#
+# This source code is licensed under the license found in the
+# LICENSE file in the root directory of this source tree.
+#
+"""
+Exact inner product top-k search without FAISS.
+
+Scoring a batch of contexts against all the entities at once materializes a
+(batch x num_entities) score matrix. The searcher instead scans the entity
+encodings in blocks, sized to fit a memory budget, keeps a running top-k per
+query and merges the top-k of every block into it. Contiguous ranges of
+blocks are scanned in parallel by a thread pool (torch releases the GIL in
+the matrix products), and the per-thread top-k are merged at the end.
+"""
+from multiprocessing.pool import ThreadPool
+
+import numpy as np
+import torch
+
+
+def _merge_top_k(scores, ids, top_k):
+    """Top-k of the concatenated (num_queries x n) ``scores`` and their ``ids``."""
+    scores = torch.cat(scores, dim=1)
+    ids = torch.cat(ids, dim=1)
+    scores, order = scores.topk(min(top_k, scores.size(1)), dim=1)
+    return scores, ids.gather(1, order)
+
+
+class BlockwiseTopKSearcher(object):
+    """
+    Exact top-k search over a (num_entities x dim) ``candidate_encoding``
+    tensor or ``blink.entity_encoding.EntityEncodingStore``, with the same
+    ``search_knn`` interface as the FAISS indexers.
+    """
+
+    def __init__(
+        self, candidate_encoding, num_threads=4, memory_budget_mb=256, min_block_size=1024
+    ):
+        self.candidate_encoding = candidate_encoding
+        self.num_threads = max(num_threads or 1, 1)
+        self.memory_budget = memory_budget_mb * 2 ** 20
+        self.min_block_size = min_block_size
+        self.pool = None
+
+    def block_size(self, num_queries):
+        """
+        Entities per block, so that the float32 scores (num_queries x block)
+        and block (block x dim) of every thread fit in the memory budget.
+        """
+        dim = self.candidate_encoding.size(1)
+        block_size = self.memory_budget // (4 * self.num_threads * (num_queries + dim))
+        block_size = max(block_size, self.min_block_size)
+        return int(min(block_size, max(len(self.candidate_encoding), 1)))
+
+    def _search_range(self, queries, start, end, block_size, top_k):
+        best_scores = None
+        best_ids = None
+        for block_start in range(start, end, block_size):
+            block_end = min(block_start + block_size, end)
+            block = self.candidate_encoding[block_start:block_end]
+            block = block.to(dtype=queries.dtype)
+            scores = queries.mm(block.t())
+            scores, ids = scores.topk(min(top_k, scores.size(1)), dim=1)
+            ids += block_start
+            if best_scores is None:
+                best_scores, best_ids = scores, ids
+            else:
+                best_scores, best_ids = _merge_top_k(
+                    [best_scores, scores], [best_ids, ids], top_k
+                )
+        return best_scores, best_ids
+
+    def search_knn(self, query_vectors, top_k):
+        queries = torch.as_tensor(np.ascontiguousarray(query_vectors, dtype=np.float32))
+        num_entities = len(self.candidate_encoding)
+        block_size = self.block_size(queries.size(0))
+
+        # contiguous ranges of blocks, one per thread
+        num_blocks = (num_entities + block_size - 1) // block_size
+        blocks_per_thread = (num_blocks + self.num_threads - 1) // self.num_threads
+        ranges = [
+            (start, min(start + blocks_per_thread * block_size, num_entities))
+            for start in range(0, num_entities, blocks_per_thread * block_size)
+        ]
+        with torch.no_grad():
+            if len(ranges) == 1:
+                scores, ids = self._search_range(
+                    queries, ranges[0][0], ranges[0][1], block_size, top_k
+                )
+            else:
+                if self.pool is None:
+                    self.pool = ThreadPool(self.num_threads)
+                results = self.pool.starmap(
+                    self._search_range,
+                    [(queries, start, end, block_size, top_k) for start, end in ranges],
+                )
+                scores, ids = _merge_top_k(
+                    [result[0] for result in results],
+                    [result[1] for result in results],
+                    top_k,
+                )
+        return scores.numpy(), ids.numpy()
+
+    def close(self):
+        """Stop the search threads, they are started again by the next search."""
+        if self.pool is not None:
+            self.pool.close()
+            self.pool.join()
+            self.pool = None
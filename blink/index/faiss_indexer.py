@@ -7,11 +7,19 @@
 """
 FAISS-based index components. Original from 
 https://github.com/facebookresearch/DPR/blob/master/dpr/indexer/faiss_indexers.py
+
+``DenseIndexer.serialize`` writes, next to the faiss index, a sidecar manifest
+``<index_file>.meta.json`` with the index type, dimension, metric transform
+(HNSW ``phi``), search parameters, number of entities, id offset and the
+checksums of the encoding and catalogue it was built from. ``load_index``
+loads any index from it, and refuses an index built for another catalogue.
 """
 
 import os
+import json
 import logging
 import pickle
+from multiprocessing.pool import ThreadPool
 
 import faiss
 import numpy as np
@@ -19,11 +27,124 @@ import numpy as np
 logger = logging.getLogger()
 
 
+def iter_chunks(data, chunk_size):
+    """
+    Yield (start, contiguous float32 array of rows start:start + chunk_size)
+    of ``data``: an array (possibly memory-mapped), a tensor or a
+    ``blink.entity_encoding.EntityEncodingStore``. Only one chunk is in
+    memory at a time.
+    """
+    for start in range(0, len(data), chunk_size):
+        chunk = data[start : start + chunk_size]
+        if hasattr(chunk, "numpy"):
+            chunk = chunk.float().numpy()
+        yield start, np.ascontiguousarray(chunk, dtype=np.float32)
+
+
+def sample_rows(data, num_rows, seed=0):
+    """Random sample of ``num_rows`` rows of ``data``, read in storage order."""
+    n = len(data)
+    if num_rows >= n:
+        return np.concatenate([vectors for _, vectors in iter_chunks(data, 65536)])
+    rows = np.sort(np.random.RandomState(seed).choice(n, num_rows, replace=False))
+    vectors = data[rows]
+    if hasattr(vectors, "numpy"):
+        vectors = vectors.float().numpy()
+    return np.ascontiguousarray(vectors, dtype=np.float32)
+
+
+class RowSlice(object):
+    """
+    Rows ``start:end`` of ``data`` (see ``iter_chunks``), read only when
+    indexed, e.g. one shard of a memory-mapped encoding store.
+    """
+
+    def __init__(self, data, start, end):
+        self.data = data
+        self.start = start
+        self.end = end
+
+    def __len__(self):
+        return self.end - self.start
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            start, stop, step = index.indices(len(self))
+            if step != 1:
+                raise ValueError("RowSlice only supports contiguous slices")
+            return self.data[self.start + start : self.start + stop]
+        return self.data[np.asarray(index) + self.start]
+
+
+INDEX_META_VERSION = 1
+
+
+def index_meta_path(index_file):
+    return index_file + ".meta.json"
+
+
+def read_index_meta(index_file):
+    """The sidecar manifest of ``index_file``, None if it has none."""
+    meta_path = index_meta_path(index_file)
+    if not os.path.exists(meta_path):
+        return None
+    with open(meta_path) as fin:
+        meta = json.load(fin)
+    if meta.get("version") != INDEX_META_VERSION:
+        raise ValueError(
+            "Unsupported index manifest version {} in {} (expected {})".format(
+                meta.get("version"), meta_path, INDEX_META_VERSION
+            )
+        )
+    return meta
+
+
+def write_index_meta(index_file, meta):
+    meta = dict(meta, version=INDEX_META_VERSION)
+    with open(index_meta_path(index_file), "w") as fout:
+        json.dump(meta, fout, indent=2)
+
+
+def shard_bounds(num_rows, num_shards):
+    """(start, end) rows of ``num_shards`` contiguous shards of about the same size."""
+    return [
+        (i * num_rows // num_shards, (i + 1) * num_rows // num_shards)
+        for i in range(num_shards)
+    ]
+
+
+def max_norm(data, chunk_size):
+    """Maximum squared L2 norm of the rows of ``data``."""
+    phi = 0.0
+    for _, vectors in iter_chunks(data, chunk_size):
+        if len(vectors) > 0:
+            phi = max(phi, float(np.einsum("ij,ij->i", vectors, vectors).max()))
+    return phi
+
+
+def augment_vectors(vectors, phi):
+    """
+    Inner product -> L2 space: append ``sqrt(phi - |x|^2)`` to every row, so
+    that the L2 distance to a query augmented with 0 is
+    ``phi + |q|^2 - 2 * <q, x>``.
+    """
+    norms = np.einsum("ij,ij->i", vectors, vectors)
+    augmented = np.empty((len(vectors), vectors.shape[1] + 1), dtype=np.float32)
+    augmented[:, :-1] = vectors
+    # the maximum norm row can come out slightly negative
+    augmented[:, -1] = np.sqrt(np.maximum(phi - norms, 0))
+    return augmented
+
+
 class DenseIndexer(object):
+    index_type = None
+
     def __init__(self, buffer_size: int = 50000):
         self.buffer_size = buffer_size
         self.index_id_to_db_id = []
         self.index = None
+        # faiss id i is entity id_offset + i (non zero for shards)
+        self.id_offset = 0
 
     def index_data(self, data: np.array):
         raise NotImplementedError
@@ -31,9 +152,39 @@ class DenseIndexer(object):
     def search_knn(self, query_vectors: np.array, top_docs: int):
         raise NotImplementedError
 
-    def serialize(self, index_file: str):
+    def num_entities(self):
+        return self.index.ntotal
+
+    def get_search_params(self):
+        return {}
+
+    def set_search_params(self, params):
+        pass
+
+    def get_meta(self):
+        """Sidecar manifest of the index (see ``load_index``)."""
+        return {
+            "type": self.index_type,
+            "dim": self.index.d,
+            "metric": "inner_product",
+            "num_entities": self.num_entities(),
+            "id_offset": self.id_offset,
+            "search_params": self.get_search_params(),
+        }
+
+    def set_meta(self, meta):
+        """Restore what the faiss index file does not keep from ``meta``."""
+        self.id_offset = meta.get("id_offset", 0)
+        self.set_search_params(meta.get("search_params", {}))
+
+    def serialize(self, index_file: str, meta: dict = None):
+        """
+        Write the faiss index and its sidecar manifest, with the entries of
+        ``meta`` added (e.g. ``encoding_checksum``, ``catalogue_checksum``).
+        """
         logger.info("Serializing index to %s", index_file)
         faiss.write_index(self.index, index_file)
+        write_index_meta(index_file, dict(self.get_meta(), **(meta or {})))
 
     def deserialize_from(self, index_file: str):
         logger.info("Loading index from %s", index_file)
@@ -45,6 +196,8 @@ class DenseIndexer(object):
 
 # DenseFlatIndexer does exact search
 class DenseFlatIndexer(DenseIndexer):
+    index_type = "flat"
+
     def __init__(self, vector_sz: int = 1, buffer_size: int = 50000):
         super(DenseFlatIndexer, self).__init__(buffer_size=buffer_size)
         self.index = faiss.IndexFlatIP(vector_sz)
@@ -53,12 +206,8 @@ class DenseFlatIndexer(DenseIndexer):
         n = len(data)
         # indexing in batches is beneficial for many faiss index types
         logger.info("Indexing data, this may take a while.")
-        cnt = 0
-        for i in range(0, n, self.buffer_size):
-            vectors = [np.reshape(t, (1, -1)) for t in data[i : i + self.buffer_size]]
-            vectors = np.concatenate(vectors, axis=0)
+        for _, vectors in iter_chunks(data, self.buffer_size):
             self.index.add(vectors)
-            cnt += self.buffer_size
 
         logger.info("Total data indexed %d", n)
 
@@ -73,6 +222,8 @@ class DenseHNSWFlatIndexer(DenseIndexer):
      Efficient index for retrieval. Note: default settings are for hugh accuracy but also high RAM usage
     """
 
+    index_type = "hnsw"
+
     def __init__(
         self,
         vector_sz: int,
@@ -92,6 +243,12 @@ class DenseHNSWFlatIndexer(DenseIndexer):
         self.phi = 0
 
     def index_data(self, data: np.array):
+        """
+        Index ``data`` (see ``iter_chunks``) in two passes over chunks of
+        ``buffer_size`` rows, e.g. straight from a memory-mapped encoding
+        store: the first one finds the maximum norm, the second one adds the
+        augmented vectors.
+        """
         n = len(data)
 
         # max norm is required before putting all vectors in the index to convert inner product similarity to L2
@@ -100,31 +257,15 @@ class DenseHNSWFlatIndexer(DenseIndexer):
                 "DPR HNSWF index needs to index all data at once,"
                 "results will be unpredictable otherwise."
             )
-        phi = 0
-        for i, item in enumerate(data):
-            doc_vector = item
-            norms = (doc_vector ** 2).sum()
-            phi = max(phi, norms)
+        phi = max_norm(data, self.buffer_size)
         logger.info("HNSWF DotProduct -> L2 space phi={}".format(phi))
-        self.phi = 0
+        self.phi = phi
 
         # indexing in batches is beneficial for many faiss index types
         logger.info("Indexing data, this may take a while.")
-        cnt = 0
-        for i in range(0, n, self.buffer_size):
-            vectors = [np.reshape(t, (1, -1)) for t in data[i : i + self.buffer_size]]
-
-            norms = [(doc_vector ** 2).sum() for doc_vector in vectors]
-            aux_dims = [np.sqrt(phi - norm) for norm in norms]
-            hnsw_vectors = [
-                np.hstack((doc_vector, aux_dims[i].reshape(-1, 1)))
-                for i, doc_vector in enumerate(vectors)
-            ]
-            hnsw_vectors = np.concatenate(hnsw_vectors, axis=0)
-
-            self.index.add(hnsw_vectors)
-            cnt += self.buffer_size
-            logger.info("Indexed data %d" % cnt)
+        for start, vectors in iter_chunks(data, self.buffer_size):
+            self.index.add(augment_vectors(vectors, phi))
+            logger.info("Indexed data %d" % (start + len(vectors)))
 
         logger.info("Total data indexed %d" % n)
 
@@ -139,3 +280,472 @@ class DenseHNSWFlatIndexer(DenseIndexer):
         super(DenseHNSWFlatIndexer, self).deserialize_from(file)
         # to trigger warning on subsequent indexing
         self.phi = 1
+
+    def get_search_params(self):
+        return {"ef_search": self.index.hnsw.efSearch}
+
+    def set_search_params(self, params):
+        if params.get("ef_search"):
+            self.index.hnsw.efSearch = params["ef_search"]
+
+    def get_meta(self):
+        meta = super(DenseHNSWFlatIndexer, self).get_meta()
+        # L2 distances of vectors augmented with sqrt(phi - |x|^2)
+        meta.update(dim=self.index.d - 1, metric="l2_augmented", phi=self.phi)
+        return meta
+
+    def set_meta(self, meta):
+        super(DenseHNSWFlatIndexer, self).set_meta(meta)
+        self.phi = meta["phi"]
+
+
+# DenseSQIndexer does exhaustive search on scalar quantized vectors
+class DenseSQIndexer(DenseIndexer):
+    """
+    Flat inner product index of scalar quantized vectors: 2 bytes (fp16) or
+    1 byte (sq8, trained per dimension ranges) per component instead of 4,
+    with close to exact scores.
+    """
+
+    QUANTIZER_TYPES = {
+        "fp16": "QT_fp16",
+        "sq8": "QT_8bit",
+    }
+
+    def __init__(
+        self,
+        vector_sz: int = 1,
+        buffer_size: int = 50000,
+        quantizer: str = "sq8",
+        train_size: int = None,
+    ):
+        super(DenseSQIndexer, self).__init__(buffer_size=buffer_size)
+        if quantizer not in self.QUANTIZER_TYPES:
+            raise ValueError(
+                "Unsupported scalar quantizer {}. Choose from {}.".format(
+                    quantizer, ",".join(self.QUANTIZER_TYPES)
+                )
+            )
+        self.quantizer = quantizer
+        self.index_type = quantizer
+        self.train_size = train_size
+        self.index = faiss.IndexScalarQuantizer(
+            vector_sz,
+            getattr(faiss.ScalarQuantizer, self.QUANTIZER_TYPES[quantizer]),
+            faiss.METRIC_INNER_PRODUCT,
+        )
+
+    def index_data(self, data: np.array):
+        n = len(data)
+        if not self.index.is_trained:
+            # the value range of every dimension, from a sample of the data
+            train_size = min(self.train_size or 100000, n)
+            logger.info("Training index on %d vectors", train_size)
+            self.index.train(sample_rows(data, train_size))
+
+        logger.info("Indexing data, this may take a while.")
+        for _, vectors in iter_chunks(data, self.buffer_size):
+            self.index.add(vectors)
+
+        logger.info("Total data indexed %d", n)
+
+    def search_knn(self, query_vectors, top_k):
+        scores, indexes = self.index.search(query_vectors, top_k)
+        return scores, indexes
+
+
+# DenseIVFPQIndexer does approximate search on compressed vectors
+class DenseIVFPQIndexer(DenseIndexer):
+    """
+    Inverted file index of product quantized vectors, optionally rotated by
+    OPQ first: every vector takes ``pq_m * pq_nbits / 8`` bytes, e.g. 128
+    bytes instead of 4096 for 1024-d fp32 vectors.
+
+    The ``nprobe`` nearest of the ``nlist`` clusters are searched. With
+    ``rerank_encoding`` (e.g. a memory-mapped ``EntityEncodingStore``) and
+    ``rerank > top_k``, the ``rerank`` best candidates of the compressed
+    index are re-scored with the exact inner products.
+    """
+
+    index_type = "ivfpq"
+
+    def __init__(
+        self,
+        vector_sz: int = 1,
+        buffer_size: int = 50000,
+        nlist: int = None,
+        pq_m: int = 64,
+        pq_nbits: int = 8,
+        opq: bool = False,
+        nprobe: int = 64,
+        train_size: int = None,
+        rerank: int = 0,
+    ):
+        super(DenseIVFPQIndexer, self).__init__(buffer_size=buffer_size)
+        self.vector_sz = vector_sz
+        self.nlist = nlist
+        self.pq_m = pq_m
+        self.pq_nbits = pq_nbits
+        self.opq = opq
+        self.nprobe = nprobe
+        self.train_size = train_size
+        self.rerank = rerank
+        self.rerank_encoding = None
+
+    def _build_index(self, n):
+        if self.vector_sz % self.pq_m != 0:
+            raise ValueError(
+                "The vector size {} must be a multiple of --pq_m {}".format(
+                    self.vector_sz, self.pq_m
+                )
+            )
+        # about 4 * sqrt(n) clusters, with at least 39 training vectors each
+        nlist = self.nlist or max(1, min(int(4 * np.sqrt(n)), n // 39))
+        description = "IVF{},PQ{}x{}".format(nlist, self.pq_m, self.pq_nbits)
+        if self.opq:
+            description = "OPQ{},{}".format(self.pq_m, description)
+        logger.info("Building faiss index %s", description)
+        return faiss.index_factory(
+            self.vector_sz, description, faiss.METRIC_INNER_PRODUCT
+        )
+
+    def _set_nprobe(self):
+        if self.nprobe:
+            faiss.extract_index_ivf(self.index).nprobe = self.nprobe
+
+    def index_data(self, data: np.array):
+        n = len(data)
+        self.index = self._build_index(n)
+        ivf = faiss.extract_index_ivf(self.index)
+        # the clusters and codebooks are trained on a sample of the data
+        train_size = min(self.train_size or max(256 * ivf.nlist, 100000), n)
+        logger.info("Training index on %d vectors", train_size)
+        self.index.train(sample_rows(data, train_size))
+        self._set_nprobe()
+
+        logger.info("Indexing data, this may take a while.")
+        for start, vectors in iter_chunks(data, self.buffer_size):
+            self.index.add(vectors)
+            logger.info("Indexed data %d" % (start + len(vectors)))
+
+        logger.info("Total data indexed %d" % n)
+
+    def set_rerank_encoding(self, rerank_encoding, rerank=None):
+        """Exact vectors (num_entities x dim) used to re-score the shortlists."""
+        self.rerank_encoding = rerank_encoding
+        if rerank is not None:
+            self.rerank = rerank
+
+    def _rerank(self, query_vectors, indexes, top_k):
+        # read every shortlisted row once, in storage order
+        valid = indexes >= 0
+        rows, inverse = np.unique(indexes[valid], return_inverse=True)
+        vectors = self.rerank_encoding[rows]
+        if hasattr(vectors, "numpy"):
+            vectors = vectors.float().numpy()
+        row_scores = np.full(indexes.shape, -np.inf, dtype=np.float32)
+        flat_queries = np.repeat(np.arange(len(indexes)), valid.sum(axis=1))
+        row_scores[valid] = np.einsum(
+            "ij,ij->i", query_vectors[flat_queries], vectors[inverse]
+        )
+        order = np.argsort(-row_scores, axis=1, kind="stable")[:, :top_k]
+        return (
+            np.take_along_axis(row_scores, order, axis=1),
+            np.take_along_axis(indexes, order, axis=1),
+        )
+
+    def search_knn(self, query_vectors, top_k):
+        if self.rerank_encoding is None or self.rerank <= top_k:
+            scores, indexes = self.index.search(query_vectors, top_k)
+            return scores, indexes
+        _, indexes = self.index.search(query_vectors, self.rerank)
+        return self._rerank(query_vectors, indexes, top_k)
+
+    def deserialize_from(self, file: str):
+        super(DenseIVFPQIndexer, self).deserialize_from(file)
+        self._set_nprobe()
+
+    def get_search_params(self):
+        return {"nprobe": faiss.extract_index_ivf(self.index).nprobe}
+
+    def set_search_params(self, params):
+        if params.get("nprobe"):
+            self.nprobe = params["nprobe"]
+            self._set_nprobe()
+
+
+# DenseShardedIndexer searches several indexes of contiguous entity ranges
+class DenseShardedIndexer(DenseIndexer):
+    """
+    Entities split into ``num_shards`` contiguous shards, each one indexed by
+    its own ``new_indexer()`` (e.g. ``lambda: DenseHNSWFlatIndexer(1024)``).
+    Shards are built (``index_shard``) and serialized independently, so they
+    can come from parallel jobs.
+
+    ``search_knn`` searches the shards in ``num_threads`` threads (faiss
+    releases the GIL, by default one thread per shard) and merges their
+    top-k into the global top-k, with global entity ids. The scores are
+    inner products whatever the shard type: HNSW distances are converted
+    back with the ``phi`` of their shard.
+
+    The index file is a json manifest listing the shard files
+    ``<index_file>.shard<i>-of-<n>``; shard ``i`` starts after the entities
+    of the shards before it. Shards with a sidecar manifest are loaded with
+    ``load_index`` (``new_indexer`` is only needed for the others), and must
+    start at the entity they were built for.
+    """
+
+    index_type = "sharded"
+
+    def __init__(
+        self, new_indexer=None, num_shards: int = 1, num_threads: int = None
+    ):
+        super(DenseShardedIndexer, self).__init__()
+        self.new_indexer = new_indexer
+        self.num_shards = num_shards
+        self.num_threads = num_threads
+        self.shards = [None] * num_shards
+        self.offsets = []
+        self.phis = []
+        self.pool = None
+
+    @staticmethod
+    def shard_file(index_file, shard_id, num_shards):
+        return "{}.shard{}-of-{}".format(index_file, shard_id, num_shards)
+
+    @staticmethod
+    def is_manifest(index_file):
+        """Whether ``index_file`` is the manifest of a sharded index."""
+        with open(index_file, "rb") as fin:
+            return fin.read(1) == b"{"
+
+    def index_shard(self, data, shard_id):
+        """Index the rows of ``data`` in shard ``shard_id``."""
+        start, end = shard_bounds(len(data), self.num_shards)[shard_id]
+        logger.info("Indexing shard %d: rows %d to %d", shard_id, start, end)
+        shard = self.new_indexer()
+        shard.index_data(RowSlice(data, start, end))
+        shard.id_offset = start
+        self.shards[shard_id] = shard
+
+    def index_data(self, data: np.array):
+        for shard_id in range(self.num_shards):
+            self.index_shard(data, shard_id)
+        self._update_offsets()
+
+    def _update_offsets(self):
+        missing = [i for i, shard in enumerate(self.shards) if shard is None]
+        if missing:
+            raise ValueError("Missing shards {}".format(missing))
+        sizes = [shard.num_entities() for shard in self.shards]
+        self.offsets = np.cumsum([0] + sizes[:-1]).tolist()
+        self.phis = [self._phi(shard) for shard in self.shards]
+        for shard_id, (shard, offset) in enumerate(zip(self.shards, self.offsets)):
+            if shard.id_offset not in (0, offset):
+                raise ValueError(
+                    "Shard {} was built for the entities from {}, not {}: "
+                    "the shards come from different encodings".format(
+                        shard_id, shard.id_offset, offset
+                    )
+                )
+
+    def num_entities(self):
+        return sum(shard.num_entities() for shard in self.shards if shard is not None)
+
+    def get_search_params(self):
+        return {"num_threads": self.num_threads}
+
+    def set_search_params(self, params):
+        # the shard parameters (e.g. nprobe) are shared by all the shards
+        if params.get("num_threads"):
+            self.num_threads = params["num_threads"]
+        for shard in self.shards:
+            if shard is not None:
+                shard.set_search_params(params)
+
+    def get_meta(self):
+        built = [shard for shard in self.shards if shard is not None]
+        shard_meta = built[0].get_meta() if built else {}
+        return {
+            "type": self.index_type,
+            "shard_type": shard_meta.get("type"),
+            "dim": shard_meta.get("dim"),
+            "metric": "inner_product",
+            "num_shards": self.num_shards,
+            # unknown to the jobs building a single shard
+            "num_entities": (
+                self.num_entities() if len(built) == self.num_shards else None
+            ),
+            "id_offset": 0,
+            "search_params": self.get_search_params(),
+        }
+
+    @staticmethod
+    def _phi(shard):
+        # the augmented vectors of an HNSW index all have a squared norm of phi
+        if not isinstance(shard, DenseHNSWFlatIndexer) or shard.index.ntotal == 0:
+            return None
+        return float(np.sum(np.square(shard.index.reconstruct(0))))
+
+    def set_rerank_encoding(self, rerank_encoding, rerank=None):
+        """Exact vectors of all the entities, see ``DenseIVFPQIndexer``."""
+        for shard, offset in zip(self.shards, self.offsets):
+            if hasattr(shard, "set_rerank_encoding"):
+                shard.set_rerank_encoding(
+                    RowSlice(rerank_encoding, offset, offset + shard.index.ntotal),
+                    rerank,
+                )
+
+    def _search_shard(self, args):
+        shard_id, query_vectors, top_k = args
+        scores, indexes = self.shards[shard_id].search_knn(query_vectors, top_k)
+        phi = self.phis[shard_id]
+        if phi is not None:
+            # L2 distance phi + |q|^2 - 2 * <q, x> -> inner product
+            query_norms = np.einsum("ij,ij->i", query_vectors, query_vectors)
+            scores = (phi + query_norms[:, None] - scores) / 2
+        valid = indexes >= 0
+        scores = np.where(valid, scores, -np.inf).astype(np.float32)
+        indexes = np.where(valid, indexes + self.offsets[shard_id], -1)
+        return scores, indexes
+
+    def search_knn(self, query_vectors, top_k):
+        query_vectors = np.ascontiguousarray(query_vectors, dtype=np.float32)
+        args = [(i, query_vectors, top_k) for i in range(self.num_shards)]
+        if self.num_shards == 1 or self.num_threads == 1:
+            results = [self._search_shard(arg) for arg in args]
+        else:
+            if self.pool is None:
+                self.pool = ThreadPool(self.num_threads or self.num_shards)
+            results = self.pool.map(self._search_shard, args)
+        scores = np.concatenate([shard_scores for shard_scores, _ in results], axis=1)
+        indexes = np.concatenate([shard_ids for _, shard_ids in results], axis=1)
+        order = np.argsort(-scores, axis=1, kind="stable")[:, :top_k]
+        return (
+            np.take_along_axis(scores, order, axis=1),
+            np.take_along_axis(indexes, order, axis=1),
+        )
+
+    def serialize(self, index_file: str, meta: dict = None):
+        """Write the manifests and the shards built by this indexer."""
+        for shard_id, shard in enumerate(self.shards):
+            if shard is not None:
+                shard.serialize(
+                    self.shard_file(index_file, shard_id, self.num_shards), meta
+                )
+        manifest = {
+            "num_shards": self.num_shards,
+            "shards": [
+                os.path.basename(self.shard_file(index_file, i, self.num_shards))
+                for i in range(self.num_shards)
+            ],
+        }
+        with open(index_file, "w") as fout:
+            json.dump(manifest, fout, indent=2)
+        write_index_meta(index_file, dict(self.get_meta(), **(meta or {})))
+
+    def deserialize_from(self, index_file: str):
+        logger.info("Loading sharded index from %s", index_file)
+        with open(index_file) as fin:
+            manifest = json.load(fin)
+        index_dir = os.path.dirname(index_file)
+        self.num_shards = manifest["num_shards"]
+        self.shards = []
+        for shard_file in manifest["shards"]:
+            shard_file = os.path.join(index_dir, shard_file)
+            if read_index_meta(shard_file) is not None:
+                shard = load_index(shard_file)
+            elif self.new_indexer is None:
+                raise ValueError(
+                    "The shard {} has no manifest {} and the type of its index "
+                    "is unknown".format(shard_file, index_meta_path(shard_file))
+                )
+            else:
+                shard = self.new_indexer()
+                shard.deserialize_from(shard_file)
+            self.shards.append(shard)
+        self._update_offsets()
+
+
+def make_indexer(index_type):
+    """Empty indexer of ``index_type``, to deserialize an index into."""
+    if index_type == "flat":
+        return DenseFlatIndexer(1)
+    elif index_type == "hnsw":
+        return DenseHNSWFlatIndexer(1)
+    elif index_type == "ivfpq":
+        return DenseIVFPQIndexer(1, nprobe=None)
+    elif index_type in DenseSQIndexer.QUANTIZER_TYPES:
+        return DenseSQIndexer(1, quantizer=index_type)
+    elif index_type == "sharded":
+        return DenseShardedIndexer()
+    raise ValueError("Unsupported index type {}".format(index_type))
+
+
+def check_index_meta(
+    meta, index_file, num_entities=None, catalogue_checksum=None, encoding_checksum=None
+):
+    """
+    Raise a ValueError if the index was built for a catalogue with another
+    ``catalogue_checksum`` or number of entities; only warn for another
+    ``encoding_checksum`` (e.g. the same encoding in another precision).
+    Checksums the index does not record are not checked.
+    """
+    if (
+        num_entities is not None
+        and meta.get("num_entities") is not None
+        and meta["num_entities"] != num_entities
+    ):
+        raise ValueError(
+            "The index {} has {} entities, the catalogue {}".format(
+                index_file, meta["num_entities"], num_entities
+            )
+        )
+    if (
+        catalogue_checksum is not None
+        and meta.get("catalogue_checksum") is not None
+        and meta["catalogue_checksum"] != catalogue_checksum
+    ):
+        raise ValueError(
+            "The index {} was built for another entity catalogue".format(index_file)
+        )
+    if (
+        encoding_checksum is not None
+        and meta.get("encoding_checksum") is not None
+        and meta["encoding_checksum"] != encoding_checksum
+    ):
+        logger.warning(
+            "The index %s was built from another entity encoding", index_file
+        )
+
+
+def load_index(
+    index_file, num_entities=None, catalogue_checksum=None, search_params=None
+):
+    """
+    Load an index of any type from its sidecar manifest, with the search
+    parameters it was saved with, overridden by ``search_params``. Refuses
+    (see ``check_index_meta``) an index built for another catalogue.
+    """
+    meta = read_index_meta(index_file)
+    if meta is None:
+        raise ValueError(
+            "The index {} has no manifest {}".format(
+                index_file, index_meta_path(index_file)
+            )
+        )
+    check_index_meta(meta, index_file, num_entities, catalogue_checksum)
+    indexer = make_indexer(meta["type"])
+    if isinstance(indexer, DenseShardedIndexer) and meta.get("shard_type"):
+        # for the shards built without a manifest of their own
+        shard_type = meta["shard_type"]
+        indexer.new_indexer = lambda: make_indexer(shard_type)
+    indexer.deserialize_from(index_file)
+    indexer.set_meta(meta)
+    if search_params:
+        indexer.set_search_params(search_params)
+    # the manifest of a sharded index may not know the number of entities
+    check_index_meta(
+        dict(meta, num_entities=indexer.num_entities()), index_file, num_entities
+    )
+    return indexer
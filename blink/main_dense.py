@@ -6,7 +6,9 @@
 #
 import argparse
 import json
+import os
 import sys
+import time
 
 from tqdm import tqdm
 import logging
@@ -25,8 +27,44 @@ from blink.biencoder.data_process import (
 )
 import blink.candidate_ranking.utils as utils
 from blink.crossencoder.train_cross import modify, evaluate
-from blink.crossencoder.data_process import prepare_crossencoder_data
-from blink.index.faiss_indexer import DenseFlatIndexer, DenseHNSWFlatIndexer
+from blink.crossencoder.data_process import (
+    prepare_crossencoder_data,
+    truncate_candidates,
+)
+from blink.crossencoder.candidate_cache import load_candidate_cache
+from blink.crossencoder.score_cache import CrossencoderScoreCache
+from blink.metrics import (
+    CONFIDENCE_METRICS,
+    biencoder_confidence,
+    biencoder_metrics,
+    crossencoder_metrics,
+    top1,
+)
+from blink.common.length_bucketing import length_bucketed_dataloader, restore_order
+from blink.common.inference import inference_mode, set_num_threads
+from blink.common.stage_timer import StageTimer, stage
+from blink.common.profiling import add_profiler_args, get_profiler, record_function
+from blink.biencoder.export import CompiledContextEncoder
+from blink.index.faiss_indexer import (
+    DenseFlatIndexer,
+    DenseHNSWFlatIndexer,
+    DenseIVFPQIndexer,
+    DenseSQIndexer,
+    DenseShardedIndexer,
+    check_index_meta,
+    load_index,
+    read_index_meta,
+)
+from blink.index.blockwise_search import BlockwiseTopKSearcher
+from blink.entity_encoding import encoding_checksum, load_entity_encoding
+from blink.entity_catalogue import (
+    EntityCatalogue,
+    WikipediaId2LocalId,
+    catalogue_checksum,
+    is_entity_catalogue,
+    parse_wikipedia_id,
+    wikipedia_id2url,
+)
 
 
 HIGHLIGHTS = [
@@ -95,51 +133,147 @@ def _annotate(ner_model, input_sentences):
     return samples
 
 
+def _ner_parameters(args):
+    return {
+        "ner_batch_size": getattr(args, "ner_batch_size", None),
+        "ner_workers": getattr(args, "ner_workers", None),
+    }
+
+
+def _annotate_raw_text(ner_model, raw_text, logger=None):
+    """Mentions of the sentences (one per line) of the ``raw_text`` file."""
+    with open(raw_text, "r") as fin:
+        sentences = [line.strip() for line in fin if line.strip()]
+    samples = _annotate(ner_model, sentences)
+    for idx, sample in enumerate(samples):
+        sample["id"] = idx
+    if logger:
+        logger.info(
+            "NER: %d mentions in %d sentences (%.1f sentences/s)"
+            % (len(samples), len(sentences), ner_model.sentences_per_second())
+        )
+    return samples
+
+
+FAISS_INDEXES = ["flat", "hnsw", "ivfpq", "sq8", "fp16"]
+
+
+def _new_indexer(faiss_index, nprobe=None):
+    if faiss_index == "flat":
+        return DenseFlatIndexer(1)
+    elif faiss_index == "hnsw":
+        return DenseHNSWFlatIndexer(1)
+    elif faiss_index == "ivfpq":
+        return DenseIVFPQIndexer(1, nprobe=nprobe)
+    elif faiss_index in DenseSQIndexer.QUANTIZER_TYPES:
+        return DenseSQIndexer(1, quantizer=faiss_index)
+    raise ValueError(
+        "Error! Unsupported indexer type! Choose from {}.".format(
+            ",".join(FAISS_INDEXES)
+        )
+    )
+
+
+def _load_indexer(
+    faiss_index,
+    index_path,
+    entity_encoding=None,
+    nprobe=None,
+    rerank=0,
+    logger=None,
+    entity_catalogue=None,
+    num_entities=None,
+):
+    """
+    Load a ``faiss_index`` (one of FAISS_INDEXES) index, or the shards of
+    such indexes if ``index_path`` is a sharded index manifest. The clusters
+    searched by an ivfpq index can be set with ``nprobe``; with ``rerank``,
+    its shortlists of ``rerank`` entities are re-scored with the exact
+    ``entity_encoding`` (memory-mapped if it is an encoding store).
+
+    An index with a sidecar manifest is loaded from it, and refused if it
+    was built for another ``entity_catalogue`` or number of entities.
+    """
+    assert index_path is not None, "Error! Empty indexer path."
+    meta = read_index_meta(index_path)
+    if meta is None:
+        if logger:
+            logger.warning(
+                "%s has no manifest, it cannot be checked against the catalogue"
+                % index_path
+            )
+        if DenseShardedIndexer.is_manifest(index_path):
+            indexer = DenseShardedIndexer(lambda: _new_indexer(faiss_index, nprobe))
+        else:
+            indexer = _new_indexer(faiss_index, nprobe)
+        indexer.deserialize_from(index_path)
+    else:
+        index_type = meta["shard_type"] if meta["type"] == "sharded" else meta["type"]
+        if index_type != faiss_index:
+            raise ValueError(
+                "--faiss_index {} but {} is a {} index".format(
+                    faiss_index, index_path, index_type
+                )
+            )
+        checksum = None
+        if entity_catalogue is not None and meta.get("catalogue_checksum"):
+            checksum = catalogue_checksum(entity_catalogue)
+        indexer = load_index(
+            index_path,
+            num_entities=num_entities,
+            catalogue_checksum=checksum,
+            search_params={"nprobe": nprobe},
+        )
+    if logger and isinstance(indexer, DenseShardedIndexer):
+        logger.info("searching %d index shards in parallel" % indexer.num_shards)
+    if faiss_index == "ivfpq" and rerank:
+        if logger:
+            logger.info("re-ranking the top %d ivfpq candidates" % rerank)
+        rerank_encoding = load_entity_encoding(entity_encoding)
+        if meta is not None:
+            check_index_meta(
+                meta, index_path, encoding_checksum=encoding_checksum(rerank_encoding)
+            )
+        indexer.set_rerank_encoding(rerank_encoding, rerank)
+    return indexer
+
+
 def _load_candidates(
-    entity_catalogue, entity_encoding, faiss_index=None, index_path=None, logger=None
+    entity_catalogue,
+    entity_encoding,
+    faiss_index=None,
+    index_path=None,
+    logger=None,
+    nprobe=None,
+    rerank=0,
 ):
+    """
+    Entity encodings or faiss index (see ``_load_indexer``), and entity
+    catalogue.
+    """
+    # the catalogue first, to check the index against it
+    title2id, id2title, id2text, wikipedia_id2local_id = _load_catalogue(
+        entity_catalogue, logger
+    )
+
     # only load candidate encoding if not using faiss index
     if faiss_index is None:
-        candidate_encoding = torch.load(entity_encoding)
+        candidate_encoding = load_entity_encoding(entity_encoding)
         indexer = None
     else:
         if logger:
             logger.info("Using faiss index to retrieve entities.")
         candidate_encoding = None
-        assert index_path is not None, "Error! Empty indexer path."
-        if faiss_index == "flat":
-            indexer = DenseFlatIndexer(1)
-        elif faiss_index == "hnsw":
-            indexer = DenseHNSWFlatIndexer(1)
-        else:
-            raise ValueError("Error! Unsupported indexer type! Choose from flat,hnsw.")
-        indexer.deserialize_from(index_path)
-
-    # load all the 5903527 entities
-    title2id = {}
-    id2title = {}
-    id2text = {}
-    wikipedia_id2local_id = {}
-    local_idx = 0
-    with open(entity_catalogue, "r") as fin:
-        lines = fin.readlines()
-        for line in lines:
-            entity = json.loads(line)
-
-            if "idx" in entity:
-                split = entity["idx"].split("curid=")
-                if len(split) > 1:
-                    wikipedia_id = int(split[-1].strip())
-                else:
-                    wikipedia_id = entity["idx"].strip()
-
-                assert wikipedia_id not in wikipedia_id2local_id
-                wikipedia_id2local_id[wikipedia_id] = local_idx
-
-            title2id[entity["title"]] = local_idx
-            id2title[local_idx] = entity["title"]
-            id2text[local_idx] = entity["text"]
-            local_idx += 1
+        indexer = _load_indexer(
+            faiss_index,
+            index_path,
+            entity_encoding,
+            nprobe,
+            rerank,
+            logger,
+            entity_catalogue=entity_catalogue,
+            num_entities=len(id2title),
+        )
     return (
         candidate_encoding,
         title2id,
@@ -150,6 +284,46 @@ def _load_candidates(
     )
 
 
+def _load_catalogue(entity_catalogue, logger=None):
+    if is_entity_catalogue(entity_catalogue):
+        # compiled catalogue: memory-mapped, texts are decoded lazily
+        if logger:
+            logger.info("Using compiled entity catalogue.")
+        catalogue = EntityCatalogue(entity_catalogue)
+        title2id = catalogue.title2id
+        id2title = catalogue.id2title
+        id2text = catalogue.id2text
+        wikipedia_id2local_id = catalogue.wikipedia_id2local_id
+    else:
+        # load all the 5903527 entities
+        title2id = {}
+        id2title = {}
+        id2text = {}
+        wikipedia_id2local_id = {}
+        local_idx = 0
+        with open(entity_catalogue, "r") as fin:
+            for line in fin:
+                entity = json.loads(line)
+
+                if "idx" in entity:
+                    wikipedia_id = parse_wikipedia_id(entity["idx"])
+
+                    assert wikipedia_id not in wikipedia_id2local_id
+                    wikipedia_id2local_id[wikipedia_id] = local_idx
+
+                title2id[entity["title"]] = local_idx
+                id2title[local_idx] = entity["title"]
+                id2text[local_idx] = entity["text"]
+                local_idx += 1
+    return title2id, id2title, id2text, wikipedia_id2local_id
+
+
+def _get_id2url(wikipedia_id2local_id):
+    if isinstance(wikipedia_id2local_id, WikipediaId2LocalId):
+        return wikipedia_id2local_id.catalogue.id2url
+    return {v: wikipedia_id2url(k) for k, v in wikipedia_id2local_id.items()}
+
+
 def __map_test_entities(test_entities_path, title2id, logger):
     # load the 732859 tac_kbp_ref_know_base entities
     kb2id = {}
@@ -169,43 +343,71 @@ def __map_test_entities(test_entities_path, title2id, logger):
     return kb2id
 
 
+def _process_test_record(record, kb2id, wikipedia_id2local_id):
+    """
+    Map the label of a test ``record`` to a local entity id. Returns None if
+    the label is not in the entity collection.
+    """
+    record["label"] = str(record["label_id"])
+
+    # for tac kbp we should use a separate knowledge source to get the entity id (label_id)
+    if kb2id and len(kb2id) > 0:
+        if record["label"] in kb2id:
+            record["label_id"] = kb2id[record["label"]]
+        else:
+            return None
+
+    # check that each entity id (label_id) is in the entity collection
+    elif wikipedia_id2local_id and len(wikipedia_id2local_id) > 0:
+        try:
+            key = int(record["label"].strip())
+            if key in wikipedia_id2local_id:
+                record["label_id"] = wikipedia_id2local_id[key]
+            else:
+                return None
+        except:
+            return None
+
+    # LOWERCASE EVERYTHING !
+    record["context_left"] = record["context_left"].lower()
+    record["context_right"] = record["context_right"].lower()
+    record["mention"] = record["mention"].lower()
+    return record
+
+
 def __load_test(test_filename, kb2id, wikipedia_id2local_id, logger):
     test_samples = []
+    num_lines = 0
     with open(test_filename, "r") as fin:
-        lines = fin.readlines()
-        for line in lines:
-            record = json.loads(line)
-            record["label"] = str(record["label_id"])
-
-            # for tac kbp we should use a separate knowledge source to get the entity id (label_id)
-            if kb2id and len(kb2id) > 0:
-                if record["label"] in kb2id:
-                    record["label_id"] = kb2id[record["label"]]
-                else:
-                    continue
-
-            # check that each entity id (label_id) is in the entity collection
-            elif wikipedia_id2local_id and len(wikipedia_id2local_id) > 0:
-                try:
-                    key = int(record["label"].strip())
-                    if key in wikipedia_id2local_id:
-                        record["label_id"] = wikipedia_id2local_id[key]
-                    else:
-                        continue
-                except:
-                    continue
-
-            # LOWERCASE EVERYTHING !
-            record["context_left"] = record["context_left"].lower()
-            record["context_right"] = record["context_right"].lower()
-            record["mention"] = record["mention"].lower()
-            test_samples.append(record)
+        for line in fin:
+            num_lines += 1
+            record = _process_test_record(
+                json.loads(line), kb2id, wikipedia_id2local_id
+            )
+            if record is not None:
+                test_samples.append(record)
 
     if logger:
-        logger.info("{}/{} samples considered".format(len(test_samples), len(lines)))
+        logger.info("{}/{} samples considered".format(len(test_samples), num_lines))
     return test_samples
 
 
+def _iter_test_samples(
+    test_filename, test_entities_path, title2id, wikipedia_id2local_id, logger
+):
+    """Lazy version of _get_test_samples, reads one line at a time."""
+    kb2id = None
+    if test_entities_path:
+        kb2id = __map_test_entities(test_entities_path, title2id, logger)
+    with open(test_filename, "r") as fin:
+        for line in fin:
+            record = _process_test_record(
+                json.loads(line), kb2id, wikipedia_id2local_id
+            )
+            if record is not None:
+                yield record
+
+
 def _get_test_samples(
     test_filename, test_entities_path, title2id, wikipedia_id2local_id, logger
 ):
@@ -216,16 +418,25 @@ def _get_test_samples(
     return test_samples
 
 
-def _process_biencoder_dataloader(samples, tokenizer, biencoder_params):
-    _, tensor_data = process_mention_data(
-        samples,
-        tokenizer,
-        biencoder_params["max_context_length"],
-        biencoder_params["max_cand_length"],
-        silent=True,
-        logger=None,
-        debug=biencoder_params["debug"],
-    )
+def _process_biencoder_dataloader(
+    samples, tokenizer, biencoder_params, length_bucketing=False, timer=None
+):
+    with stage(timer, "biencoder_tokenize", len(samples)):
+        _, tensor_data = process_mention_data(
+            samples,
+            tokenizer,
+            biencoder_params["max_context_length"],
+            biencoder_params["max_cand_length"],
+            silent=True,
+            logger=None,
+            debug=biencoder_params["debug"],
+            tokenizer_backend=biencoder_params.get("tokenizer_backend", "python"),
+            tokenizer_workers=biencoder_params.get("tokenizer_workers"),
+        )
+    if length_bucketing:
+        return length_bucketed_dataloader(
+            tensor_data, biencoder_params["eval_batch_size"]
+        )
     sampler = SequentialSampler(tensor_data)
     dataloader = DataLoader(
         tensor_data, sampler=sampler, batch_size=biencoder_params["eval_batch_size"]
@@ -233,63 +444,512 @@ def _process_biencoder_dataloader(samples, tokenizer, biencoder_params):
     return dataloader
 
 
-def _run_biencoder(biencoder, dataloader, candidate_encoding, top_k=100, indexer=None):
+def _context_key(token_ids):
+    # trailing padding is ignored, so that trimmed batches of different
+    # lengths give the same key
+    return np.trim_zeros(np.asarray(token_ids), "b").tobytes()
+
+
+def _biencoder_top_k(
+    biencoder, context_input, candidate_encoding, top_k, indexer, timer=None
+):
+    num_contexts = context_input.size(0)
+    with inference_mode():
+        if indexer is not None:
+            with stage(timer, "biencoder_encode", num_contexts):
+                context_encoding = biencoder.encode_context(context_input).numpy()
+                context_encoding = np.ascontiguousarray(context_encoding)
+            with stage(timer, "search_knn", num_contexts):
+                with record_function("faiss_search"):
+                    scores, indicies = indexer.search_knn(context_encoding, top_k)
+        else:
+            with stage(timer, "biencoder_score_candidates", num_contexts):
+                scores = biencoder.score_candidate(
+                    context_input, None, cand_encs=candidate_encoding  # .to(device)
+                )
+                scores, indicies = scores.topk(top_k)
+            scores = scores.data.numpy()
+            indicies = indicies.data.numpy()
+    return scores, indicies
+
+
+def _run_biencoder(
+    biencoder,
+    dataloader,
+    candidate_encoding,
+    top_k=100,
+    indexer=None,
+    dedup=False,
+    logger=None,
+    timer=None,
+    profiler=None,
+):
+    """
+    Top-k candidates of every mention. With ``dedup``, every distinct context
+    (token ids) is encoded once and its candidates are reused for the
+    duplicate mentions. The encoding and search times are recorded in the
+    ``timer`` (``blink.common.stage_timer.StageTimer``), if given, and
+    ``profiler.step()`` is called after every batch.
+    """
     biencoder.model.eval()
     labels = []
     nns = []
     all_scores = []
+    # candidates of the contexts encoded so far, by context token ids
+    encoded = {}
+    num_samples = 0
     for batch in tqdm(dataloader):
         context_input, _, label_ids = batch
-        with torch.no_grad():
-            if indexer is not None:
-                context_encoding = biencoder.encode_context(context_input).numpy()
-                context_encoding = np.ascontiguousarray(context_encoding)
-                scores, indicies = indexer.search_knn(context_encoding, top_k)
-            else:
-                scores = biencoder.score_candidate(
-                    context_input, None, cand_encs=candidate_encoding  # .to(device)
+        num_samples += context_input.size(0)
+        if not dedup:
+            scores, indicies = _biencoder_top_k(
+                biencoder, context_input, candidate_encoding, top_k, indexer, timer
+            )
+        else:
+            keys = [_context_key(token_ids) for token_ids in context_input.numpy()]
+            new_rows = []
+            for i, key in enumerate(keys):
+                if key not in encoded:
+                    encoded[key] = None
+                    new_rows.append(i)
+            if len(new_rows) > 0:
+                new_scores, new_indicies = _biencoder_top_k(
+                    biencoder,
+                    context_input[torch.LongTensor(new_rows)],
+                    candidate_encoding,
+                    top_k,
+                    indexer,
+                    timer,
                 )
-                scores, indicies = scores.topk(top_k)
-                scores = scores.data.numpy()
-                indicies = indicies.data.numpy()
+                for i, mention_scores, mention_indicies in zip(
+                    new_rows, new_scores, new_indicies
+                ):
+                    encoded[keys[i]] = (mention_scores, mention_indicies)
+            scores = [encoded[key][0] for key in keys]
+            indicies = [encoded[key][1] for key in keys]
 
         labels.extend(label_ids.data.numpy())
         nns.extend(indicies)
         all_scores.extend(scores)
+        if profiler is not None:
+            profiler.step()
+    if dedup and logger:
+        logger.info(
+            "biencoder dedup: encoded %d distinct contexts for %d mentions "
+            "(dedup ratio %.2f)"
+            % (len(encoded), num_samples, num_samples / max(len(encoded), 1))
+        )
+    labels = restore_order(labels, dataloader)
+    nns = restore_order(nns, dataloader)
+    all_scores = restore_order(all_scores, dataloader)
     return labels, nns, all_scores
 
 
-def _process_crossencoder_dataloader(context_input, label_input, crossencoder_params):
+def _process_crossencoder_dataloader(
+    context_input,
+    label_input,
+    crossencoder_params,
+    length_bucketing=False,
+    batch_size=None,
+):
+    batch_size = batch_size or crossencoder_params["eval_batch_size"]
     tensor_data = TensorDataset(context_input, label_input)
+    if length_bucketing:
+        # every candidate keeps at least its [SEP] after the context, so the
+        # trimmed inputs are always longer than the context
+        return length_bucketed_dataloader(tensor_data, batch_size)
     sampler = SequentialSampler(tensor_data)
-    dataloader = DataLoader(
-        tensor_data, sampler=sampler, batch_size=crossencoder_params["eval_batch_size"]
-    )
+    dataloader = DataLoader(tensor_data, sampler=sampler, batch_size=batch_size)
     return dataloader
 
 
-def _run_crossencoder(crossencoder, dataloader, logger, context_len, device="cuda"):
+def _run_crossencoder(
+    crossencoder, dataloader, logger, context_len, device="cuda", profiler=None
+):
     crossencoder.model.eval()
     accuracy = 0.0
     crossencoder.to(device)
 
-    res = evaluate(crossencoder, dataloader, device, logger, context_len, silent=False)
+    res = evaluate(
+        crossencoder,
+        dataloader,
+        device,
+        logger,
+        context_len,
+        silent=False,
+        profiler=profiler,
+    )
     accuracy = res["normalized_accuracy"]
-    logits = res["logits"]
+    logits = restore_order(res["logits"], dataloader)
 
     predictions = np.argsort(logits, axis=1)
     return accuracy, predictions, logits
 
 
+def _score_crossencoder(
+    crossencoder,
+    crossencoder_params,
+    context_input,
+    candidate_input,
+    label_input,
+    nns,
+    logger,
+    context_len,
+    device="cuda",
+    length_bucketing=False,
+    score_cache=None,
+    dedup=False,
+    timer=None,
+    profiler=None,
+):
+    """
+    Crossencoder scores of the (mention context, candidate) pairs of
+    ``prepare_crossencoder_data``. Mentions can have different numbers of
+    candidates (``nns``), their (context, candidate) pairs are then flattened
+    into the crossencoder batches instead of scoring the padding. With a
+    ``score_cache``, only the pairs that are not cached are scored by the
+    model. With ``dedup``, mentions with the same context and candidates are
+    scored once. The ``modify`` and model times are recorded in the ``timer``,
+    if given, and ``profiler.step()`` is called after every crossencoder
+    batch. Returns the accuracy, the indices of the candidates sorted by
+    score and the scores.
+    """
+    max_seq_length = crossencoder_params["max_seq_length"]
+    num_samples, num_cands = candidate_input.size(0), candidate_input.size(1)
+    if dedup:
+        # (context, candidates) tuples: both have variable lengths, their
+        # concatenated bytes could be shared by different pairs
+        keys = [
+            (_context_key(token_ids), np.asarray(nn, dtype=np.int64).tobytes())
+            for token_ids, nn in zip(context_input.numpy(), nns)
+        ]
+        unique_rows = {}
+        for i, key in enumerate(keys):
+            unique_rows.setdefault(key, i)
+        if len(unique_rows) < num_samples:
+            if logger:
+                logger.info(
+                    "crossencoder dedup: scoring %d distinct mentions out of %d"
+                    % (len(unique_rows), num_samples)
+                )
+            rows = list(unique_rows.values())
+            _, index_array, logits = _score_crossencoder(
+                crossencoder,
+                crossencoder_params,
+                context_input[torch.LongTensor(rows)],
+                candidate_input[torch.LongTensor(rows)],
+                label_input[torch.LongTensor(rows)],
+                [nns[i] for i in rows],
+                logger,
+                context_len,
+                device=device,
+                length_bucketing=length_bucketing,
+                score_cache=score_cache,
+                timer=timer,
+                profiler=profiler,
+            )
+            # scatter the scores back to the duplicate mentions
+            position = {key: j for j, key in enumerate(unique_rows)}
+            index_array = [index_array[position[key]] for key in keys]
+            logits = [logits[position[key]] for key in keys]
+            accuracy = float(np.mean(top1(logits) == label_input.numpy()))
+            return accuracy, index_array, logits
+
+    counts = [min(len(nn), num_cands) for nn in nns]
+    if score_cache is None and all(count == num_cands for count in counts):
+        num_pairs = num_samples * num_cands
+        with stage(timer, "crossencoder_modify", num_pairs):
+            context_input = modify(context_input, candidate_input, max_seq_length)
+        dataloader = _process_crossencoder_dataloader(
+            context_input, label_input, crossencoder_params, length_bucketing
+        )
+        with stage(timer, "crossencoder_run", num_pairs):
+            return _run_crossencoder(
+                crossencoder,
+                dataloader,
+                logger,
+                context_len=context_len,
+                device=device,
+                profiler=profiler,
+            )
+
+    pairs = [(i, j) for i in range(num_samples) for j in range(counts[i])]
+    logits = np.full((num_samples, num_cands), -np.inf, dtype=np.float32)
+    missing = list(range(len(pairs)))
+    if score_cache is not None:
+        context_keys = [score_cache.context_key(ids) for ids in context_input.numpy()]
+        keys = [(context_keys[i], nns[i][j]) for i, j in pairs]
+        cached_scores = score_cache.get_many(keys)
+        missing = []
+        for pair_idx, score in enumerate(cached_scores):
+            if score is None:
+                missing.append(pair_idx)
+            else:
+                logits[pairs[pair_idx]] = score
+
+    if len(missing) > 0:
+        # every missing pair is scored as a mention with a single candidate,
+        # in batches of as many pairs as the mention batches
+        rows = torch.LongTensor([pairs[pair_idx][0] for pair_idx in missing])
+        cols = torch.LongTensor([pairs[pair_idx][1] for pair_idx in missing])
+        with stage(timer, "crossencoder_modify", len(missing)):
+            pair_input = modify(
+                context_input[rows],
+                candidate_input[rows, cols].unsqueeze(1),
+                max_seq_length,
+            )
+        dataloader = _process_crossencoder_dataloader(
+            pair_input,
+            torch.zeros(len(missing), dtype=torch.long),
+            crossencoder_params,
+            length_bucketing,
+            batch_size=crossencoder_params["eval_batch_size"] * max(num_cands, 1),
+        )
+        with stage(timer, "crossencoder_run", len(missing)):
+            _, _, pair_scores = _run_crossencoder(
+                crossencoder,
+                dataloader,
+                logger,
+                context_len=context_len,
+                device=device,
+                profiler=profiler,
+            )
+        pair_scores = [float(score[0]) for score in pair_scores]
+        for pair_idx, score in zip(missing, pair_scores):
+            logits[pairs[pair_idx]] = score
+        if score_cache is not None:
+            score_cache.put_many([keys[pair_idx] for pair_idx in missing], pair_scores)
+
+    if score_cache is not None and logger:
+        logger.info(
+            "crossencoder score cache: %d/%d pairs cached, %s"
+            % (len(pairs) - len(missing), len(pairs), score_cache.stats())
+        )
+    accuracy = 0.0
+    if num_samples > 0:
+        accuracy = utils.accuracy(logits, label_input.numpy()) / num_samples
+    logits = [logits[i, : counts[i]] for i in range(num_samples)]
+    return accuracy, [np.argsort(row) for row in logits], logits
+
+
+def _get_score_cache(args, crossencoder_params):
+    if not getattr(args, "crossencoder_cache_size", 0):
+        return None
+    return CrossencoderScoreCache(
+        args.crossencoder_cache_size,
+        spill_path=getattr(args, "crossencoder_cache_spill", None),
+        namespace=_score_cache_namespace(args, crossencoder_params),
+    )
+
+
+def _close_searcher(indexer):
+    # the threads of the blockwise search, restarted by the next search
+    if isinstance(indexer, BlockwiseTopKSearcher):
+        indexer.close()
+
+
+def _score_cache_namespace(args, crossencoder_params):
+    """
+    Everything that changes the crossencoder scores of a (context, entity)
+    pair: the model, its int8 quantization and the candidate token ids.
+    """
+    return json.dumps(
+        [
+            crossencoder_params["path_to_model"] or "",
+            bool(getattr(args, "quantize_crossencoder", False)),
+            crossencoder_params.get("max_seq_length"),
+            crossencoder_params.get("max_context_length"),
+            crossencoder_params.get("max_cand_length"),
+        ]
+    )
+
+
+def _to_similarities(scores, indexer=None):
+    """
+    Biencoder scores as similarities, in descending order: the HNSW index
+    returns (ascending) L2 distances of the augmented vectors, i.e.
+    ``norm - 2 * inner product`` with the same norm for all the candidates.
+    """
+    if isinstance(indexer, DenseHNSWFlatIndexer):
+        return [-np.asarray(mention_scores) / 2 for mention_scores in scores]
+    return scores
+
+
+def _crossencoder_candidates(
+    nns, scores, indexer=None, top_k=100, score_drop=None, min_k=1
+):
+    """Biencoder candidates of every mention reranked by the crossencoder."""
+    return truncate_candidates(
+        nns, _to_similarities(scores, indexer), top_k, score_drop, min_k
+    )
+
+
+def _merge_rankings(reranked, index_array, unsorted_scores, nns, scores):
+    """
+    Crossencoder rankings of the ``reranked`` mentions, biencoder rankings
+    (its candidates are already in descending order) of the other ones.
+    """
+    all_index_array = []
+    all_scores = []
+    crossencoder_rankings = iter(zip(index_array, unsorted_scores))
+    for i, is_reranked in enumerate(reranked):
+        if is_reranked:
+            index_list, scores_list = next(crossencoder_rankings)
+        else:
+            index_list = np.arange(len(nns[i]))[::-1]
+            scores_list = scores[i]
+        all_index_array.append(index_list)
+        all_scores.append(scores_list)
+    return all_index_array, all_scores
+
+
+def _link_samples(
+    samples,
+    biencoder,
+    biencoder_params,
+    crossencoder,
+    crossencoder_params,
+    candidate_encoding,
+    id2title,
+    id2text,
+    faiss_indexer=None,
+    top_k=10,
+    logger=None,
+    candidate_cache=None,
+    length_bucketing=False,
+    score_cache=None,
+    cascade_threshold=None,
+    cascade_metric="margin",
+    crossencoder_top_k=100,
+    crossencoder_score_drop=None,
+    crossencoder_min_k=1,
+    dedup=False,
+    timer=None,
+):
+    """
+    Link unlabelled mention ``samples`` with the biencoder and, if given, the
+    crossencoder. With a ``cascade_threshold``, only the mentions whose
+    biencoder confidence is below it are reranked by the crossencoder. The
+    crossencoder scores the first ``crossencoder_top_k`` biencoder candidates
+    of every mention, with a ``crossencoder_score_drop`` only the ones whose
+    biencoder score is within it of the top-1 (see ``truncate_candidates``).
+    With ``dedup``, duplicate mentions are encoded and scored once. The time
+    of every stage is recorded in the ``timer``, if given.
+    Returns the candidate entity ids and their scores of every sample, in
+    descending order of score.
+    """
+    dataloader = _process_biencoder_dataloader(
+        samples, biencoder.tokenizer, biencoder_params, length_bucketing, timer
+    )
+    with stage(timer, "biencoder", len(samples)):
+        labels, nns, scores = _run_biencoder(
+            biencoder,
+            dataloader,
+            candidate_encoding,
+            top_k,
+            faiss_indexer,
+            dedup=dedup,
+            logger=logger,
+            timer=timer,
+        )
+    if crossencoder is None:
+        return nns, scores
+
+    reranked = np.ones(len(samples), dtype=bool)
+    if cascade_threshold is not None:
+        confidence = biencoder_confidence(
+            _to_similarities(scores, faiss_indexer), cascade_metric
+        )
+        reranked = confidence < cascade_threshold
+    uncertain = np.flatnonzero(reranked)
+    cross_nns = _crossencoder_candidates(
+        [nns[i] for i in uncertain],
+        [scores[i] for i in uncertain],
+        faiss_indexer,
+        crossencoder_top_k,
+        crossencoder_score_drop,
+        crossencoder_min_k,
+    )
+
+    index_array = []
+    unsorted_scores = []
+    if len(uncertain) > 0:
+        with stage(timer, "crossencoder_prepare", len(uncertain)):
+            context_input, candidate_input, _ = prepare_crossencoder_data(
+                crossencoder.tokenizer,
+                [samples[i] for i in uncertain],
+                [labels[i] for i in uncertain],
+                cross_nns,
+                id2title,
+                id2text,
+                keep_all=True,
+                candidate_cache=candidate_cache,
+                topk=crossencoder_top_k,
+            )
+        label_input = torch.zeros(len(uncertain), dtype=torch.long)
+        with stage(timer, "crossencoder", len(uncertain)):
+            _, index_array, unsorted_scores = _score_crossencoder(
+                crossencoder,
+                crossencoder_params,
+                context_input,
+                candidate_input,
+                label_input,
+                cross_nns,
+                logger,
+                context_len=biencoder_params["max_context_length"],
+                device=crossencoder.device,
+                length_bucketing=length_bucketing,
+                score_cache=score_cache,
+                dedup=dedup,
+                timer=timer,
+            )
+    cross_nns = iter(cross_nns)
+    nns = [
+        next(cross_nns) if is_reranked else nn for nn, is_reranked in zip(nns, reranked)
+    ]
+    index_array, unsorted_scores = _merge_rankings(
+        reranked, index_array, unsorted_scores, nns, scores
+    )
+
+    reranked_nns = []
+    reranked_scores = []
+    for entity_list, index_list, scores_list in zip(nns, index_array, unsorted_scores):
+        # descending order
+        index_list = index_list[::-1]
+        reranked_nns.append(np.asarray(entity_list)[index_list])
+        reranked_scores.append(np.asarray(scores_list)[index_list])
+    return reranked_nns, reranked_scores
+
+
 def load_models(args, logger=None):
 
+    cpu = getattr(args, "cpu", False)
+    if cpu or getattr(args, "num_threads", None):
+        set_num_threads(
+            getattr(args, "num_threads", None),
+            getattr(args, "num_interop_threads", None),
+            logger=logger,
+        )
+
     # load biencoder model
     if logger:
         logger.info("loading biencoder model")
     with open(args.biencoder_config) as json_file:
         biencoder_params = json.load(json_file)
         biencoder_params["path_to_model"] = args.biencoder_model
+        if cpu:
+            biencoder_params["no_cuda"] = True
+        # the command line overrides the tokenizer of the config
+        for key in ("tokenizer_backend", "tokenizer_workers"):
+            if getattr(args, key, None) is not None:
+                biencoder_params[key] = getattr(args, key)
     biencoder = load_biencoder(biencoder_params)
+    if getattr(args, "context_encoder", None):
+        if logger:
+            logger.info("loading compiled context encoder")
+        biencoder.set_context_encoder(
+            CompiledContextEncoder(args.context_encoder, biencoder.device)
+        )
 
     crossencoder = None
     crossencoder_params = None
@@ -300,7 +960,13 @@ def load_models(args, logger=None):
         with open(args.crossencoder_config) as json_file:
             crossencoder_params = json.load(json_file)
             crossencoder_params["path_to_model"] = args.crossencoder_model
+            if cpu:
+                crossencoder_params["no_cuda"] = True
         crossencoder = load_crossencoder(crossencoder_params)
+        if getattr(args, "quantize_crossencoder", False):
+            if logger:
+                logger.info("quantizing crossencoder to int8")
+            crossencoder.quantize()
 
     # load candidate entities
     if logger:
@@ -313,8 +979,31 @@ def load_models(args, logger=None):
         wikipedia_id2local_id,
         faiss_indexer,
     ) = _load_candidates(
-        args.entity_catalogue, args.entity_encoding, faiss_index=args.faiss_index, index_path=args.index_path, logger=logger
+        args.entity_catalogue,
+        args.entity_encoding,
+        faiss_index=args.faiss_index,
+        index_path=args.index_path,
+        logger=logger,
+        nprobe=getattr(args, "faiss_nprobe", None),
+        rerank=getattr(args, "faiss_rerank", 0),
     )
+    if faiss_indexer is None and getattr(args, "blockwise_search", False):
+        # exact search over the entity encodings, block by block
+        faiss_indexer = BlockwiseTopKSearcher(
+            candidate_encoding,
+            num_threads=getattr(args, "search_threads", 4),
+            memory_budget_mb=getattr(args, "search_memory_mb", 256),
+        )
+
+    candidate_cache = None
+    if crossencoder is not None and getattr(args, "candidate_cache", None):
+        if logger:
+            logger.info("loading candidate token cache")
+        candidate_cache = load_candidate_cache(
+            args.candidate_cache,
+            crossencoder.tokenizer,
+            num_entities=len(id2title),
+        )
 
     return (
         biencoder,
@@ -327,9 +1016,28 @@ def load_models(args, logger=None):
         id2text,
         wikipedia_id2local_id,
         faiss_indexer,
+        candidate_cache,
     )
 
 
+def _report_stages(args, timer, metrics=None, logger=None):
+    """
+    Add the per-stage report of ``timer`` to ``metrics`` (as "stages") and
+    write it to ``args.timing_report``, if set.
+    """
+    report = timer.report()
+    if metrics is not None:
+        metrics["stages"] = report
+    if logger:
+        logger.info("stage timings:\n%s" % timer.summary())
+    timing_report = getattr(args, "timing_report", None)
+    if timing_report:
+        timer.save(timing_report)
+        if logger:
+            logger.info("stage timings written to %s" % timing_report)
+    return report
+
+
 def run(
     args,
     logger,
@@ -343,10 +1051,75 @@ def run(
     id2text,
     wikipedia_id2local_id,
     faiss_indexer=None,
+    candidate_cache=None,
     test_data=None,
+    metrics=None,
 ):
+    """
+    If ``metrics`` is a dict, it is filled with the biencoder_* and
+    crossencoder_* metrics of blink.metrics (e.g. the full recall curve), and
+    with the wall time, item count and peak memory of every stage of the run
+    ("stages", see ``blink.common.stage_timer``). With ``args.profile``, a
+    window of biencoder and of crossencoder batches is profiled (see
+    ``blink.common.profiling``).
+    """
+    score_cache = None
+    if crossencoder is not None and not args.fast:
+        score_cache = _get_score_cache(args, crossencoder_params)
+    try:
+        return _run(
+            args,
+            logger,
+            biencoder,
+            biencoder_params,
+            crossencoder,
+            crossencoder_params,
+            candidate_encoding,
+            title2id,
+            id2title,
+            id2text,
+            wikipedia_id2local_id,
+            faiss_indexer=faiss_indexer,
+            candidate_cache=candidate_cache,
+            test_data=test_data,
+            metrics=metrics,
+            score_cache=score_cache,
+        )
+    finally:
+        # with a spill file, the scores still in memory are written on close
+        if score_cache is not None:
+            if logger:
+                logger.info("crossencoder score cache: %s" % score_cache.stats())
+            score_cache.close()
+        _close_searcher(faiss_indexer)
+
 
-    if not test_data and not args.test_mentions and not args.interactive:
+def _run(
+    args,
+    logger,
+    biencoder,
+    biencoder_params,
+    crossencoder,
+    crossencoder_params,
+    candidate_encoding,
+    title2id,
+    id2title,
+    id2text,
+    wikipedia_id2local_id,
+    faiss_indexer=None,
+    candidate_cache=None,
+    test_data=None,
+    metrics=None,
+    score_cache=None,
+):
+
+    raw_text = getattr(args, "raw_text", None)
+    if (
+        not test_data
+        and not args.test_mentions
+        and not args.interactive
+        and not raw_text
+    ):
         msg = (
             "ERROR: either you start BLINK with the "
             "interactive option (-i) or you pass in input test mentions (--test_mentions)"
@@ -354,10 +1127,13 @@ def run(
         )
         raise ValueError(msg)
 
-    id2url = {
-        v: "https://en.wikipedia.org/wiki?curid=%s" % k
-        for k, v in wikipedia_id2local_id.items()
-    }
+    id2url = _get_id2url(wikipedia_id2local_id)
+
+    timer = StageTimer()
+    ner_model = None
+    if args.interactive or (raw_text and not test_data):
+        # Load NER model
+        ner_model = NER.get_model(_ner_parameters(args))
 
     stopping_condition = False
     while not stopping_condition:
@@ -369,9 +1145,6 @@ def run(
 
             # biencoder_params["eval_batch_size"] = 1
 
-            # Load NER model
-            ner_model = NER.get_model()
-
             # Interactive
             text = input("insert text:")
 
@@ -379,12 +1152,21 @@ def run(
             samples = _annotate(ner_model, [text])
 
             _print_colorful_text(text, samples)
+            if len(samples) == 0:
+                continue
 
         else:
             logger.info("test dataset mode")
 
             if test_data:
                 samples = test_data
+            elif raw_text:
+                # Identify mentions
+                with stage(timer, "ner"):
+                    samples = _annotate_raw_text(ner_model, raw_text, logger)
+                if len(samples) == 0:
+                    _report_stages(args, timer, metrics, logger)
+                    return (-1, -1, -1, -1, 0, [], [])
             else:
                 # Load test mentions
                 samples = _get_test_samples(
@@ -407,15 +1189,31 @@ def run(
         # prepare the data for biencoder
         logger.info("preparing data for biencoder")
         dataloader = _process_biencoder_dataloader(
-            samples, biencoder.tokenizer, biencoder_params
+            samples,
+            biencoder.tokenizer,
+            biencoder_params,
+            getattr(args, "length_bucketing", False),
+            timer,
         )
 
         # run biencoder
         logger.info("run biencoder")
         top_k = args.top_k
-        labels, nns, scores = _run_biencoder(
-            biencoder, dataloader, candidate_encoding, top_k, faiss_indexer
-        )
+        with stage(timer, "biencoder", len(samples)), get_profiler(
+            vars(args), "biencoder", logger
+        ) as profiler:
+            labels, nns, scores = _run_biencoder(
+                biencoder,
+                dataloader,
+                candidate_encoding,
+                top_k,
+                faiss_indexer,
+                dedup=getattr(args, "dedup_mentions", False),
+                logger=logger,
+                timer=timer,
+                profiler=profiler,
+            )
+        nns_scores = scores
 
         if args.interactive:
 
@@ -447,22 +1245,15 @@ def run(
             if not keep_all:
                 # get recall values
                 top_k = args.top_k
-                x = []
-                y = []
-                for i in range(1, top_k):
-                    temp_y = 0.0
-                    for label, top in zip(labels, nns):
-                        if label in top[:i]:
-                            temp_y += 1
-                    if len(labels) > 0:
-                        temp_y /= len(labels)
-                    x.append(i)
-                    y.append(temp_y)
-                # plt.plot(x, y)
-                biencoder_accuracy = y[0]
-                recall_at = y[-1]
+                bi_metrics = biencoder_metrics(labels, nns, top_k)
+                if metrics is not None:
+                    metrics.update(
+                        {"biencoder_" + key: value for key, value in bi_metrics.items()}
+                    )
+                biencoder_accuracy = bi_metrics["accuracy"]
+                recall_at = bi_metrics["recall_at"]
                 print("biencoder accuracy: %.4f" % biencoder_accuracy)
-                print("biencoder recall@%d: %.4f" % (top_k, y[-1]))
+                print("biencoder recall@%d: %.4f" % (top_k, recall_at))
 
             if args.fast:
 
@@ -474,6 +1265,7 @@ def run(
                         sample_prediction.append(e_title)
                     predictions.append(sample_prediction)
 
+                _report_stages(args, timer, metrics, logger)
                 # use only biencoder
                 return (
                     biencoder_accuracy,
@@ -485,25 +1277,95 @@ def run(
                     scores,
                 )
 
-        # prepare crossencoder data
-        context_input, candidate_input, label_input = prepare_crossencoder_data(
-            crossencoder.tokenizer, samples, labels, nns, id2title, id2text, keep_all,
+        # cascade: mentions the biencoder is confident about skip the crossencoder
+        confident = np.zeros(len(samples), dtype=bool)
+        cascade_threshold = getattr(args, "cascade_threshold", None)
+        if cascade_threshold is not None:
+            confidence = biencoder_confidence(
+                _to_similarities(scores, faiss_indexer),
+                getattr(args, "cascade_metric", "margin"),
+            )
+            confident = confidence >= cascade_threshold
+            logger.info(
+                "cascade: %d/%d mentions skip the crossencoder"
+                % (confident.sum(), len(samples))
+            )
+        uncertain = np.flatnonzero(~confident)
+        crossencoder_top_k = getattr(args, "crossencoder_top_k", 100)
+        cross_nns = _crossencoder_candidates(
+            nns,
+            scores,
+            faiss_indexer,
+            crossencoder_top_k,
+            getattr(args, "crossencoder_score_drop", None),
+            getattr(args, "crossencoder_min_k", 1),
         )
+        if getattr(args, "crossencoder_score_drop", None) is not None:
+            logger.info(
+                "crossencoder candidates per mention: %.2f"
+                % np.mean([len(cross_nns[i]) for i in uncertain] or [0])
+            )
 
-        context_input = modify(
-            context_input, candidate_input, crossencoder_params["max_seq_length"]
-        )
+        # mentions reranked by the crossencoder, i.e. the uncertain ones and,
+        # with labels, whose gold entity is among their candidates
+        reranked = ~confident
+        if not keep_all:
+            reranked &= np.array(
+                [label in nn for label, nn in zip(labels, cross_nns)], dtype=bool
+            )
 
-        dataloader = _process_crossencoder_dataloader(
-            context_input, label_input, crossencoder_params
-        )
+        accuracy = 0.0
+        index_array = []
+        unsorted_scores = []
+        label_input = torch.LongTensor([])
+        if reranked.any():
+            # prepare crossencoder data
+            with stage(timer, "crossencoder_prepare", len(uncertain)):
+                (
+                    context_input,
+                    candidate_input,
+                    label_input,
+                ) = prepare_crossencoder_data(
+                    crossencoder.tokenizer,
+                    [samples[i] for i in uncertain],
+                    [labels[i] for i in uncertain],
+                    [cross_nns[i] for i in uncertain],
+                    id2title,
+                    id2text,
+                    keep_all,
+                    candidate_cache=candidate_cache,
+                    topk=crossencoder_top_k,
+                )
 
-        # run crossencoder and get accuracy
-        accuracy, index_array, unsorted_scores = _run_crossencoder(
-            crossencoder,
-            dataloader,
-            logger,
-            context_len=biencoder_params["max_context_length"],
+            # run crossencoder and get accuracy
+            with stage(timer, "crossencoder", len(label_input)), get_profiler(
+                vars(args), "crossencoder", logger
+            ) as profiler:
+                accuracy, index_array, unsorted_scores = _score_crossencoder(
+                    crossencoder,
+                    crossencoder_params,
+                    context_input,
+                    candidate_input,
+                    label_input,
+                    [cross_nns[i] for i in np.flatnonzero(reranked)],
+                    logger,
+                    context_len=biencoder_params["max_context_length"],
+                    device=crossencoder.device,
+                    length_bucketing=getattr(args, "length_bucketing", False),
+                    score_cache=score_cache,
+                    dedup=getattr(args, "dedup_mentions", False),
+                    timer=timer,
+                    profiler=profiler,
+                )
+        crossencoder_scores = unsorted_scores
+
+        # rankings of all the mentions, the others keep the biencoder ones
+        nns = [
+            cross_nns[i] if is_reranked else nns[i]
+            for i, is_reranked in enumerate(reranked)
+        ]
+        index_array, unsorted_scores = _merge_rankings(
+            reranked, index_array, unsorted_scores, nns, scores
         )
 
         if args.interactive:
@@ -550,18 +1412,52 @@ def run(
             crossencoder_normalized_accuracy = -1
             overall_unormalized_accuracy = -1
             if not keep_all:
-                crossencoder_normalized_accuracy = accuracy
+                cross_metrics = crossencoder_metrics(
+                    crossencoder_scores, label_input, len(samples)
+                )
+                # per mention: biencoder top-1 for the confident mentions,
+                # crossencoder top-1 for the reranked ones
+                crossencoder_correct = np.zeros(len(samples), dtype=bool)
+                if reranked.any():
+                    crossencoder_correct[reranked] = (
+                        top1(crossencoder_scores) == label_input.numpy()
+                    )
+                correct = crossencoder_correct | (
+                    confident & (bi_metrics["gold_ranks"] == 0)
+                )
+                if metrics is not None:
+                    metrics.update(
+                        {
+                            "crossencoder_" + key: value
+                            for key, value in cross_metrics.items()
+                        }
+                    )
+                    similarities = _to_similarities(nns_scores, faiss_indexer)
+                    metrics.update(
+                        {
+                            "biencoder_margin": biencoder_confidence(
+                                similarities, "margin"
+                            ),
+                            "biencoder_prob": biencoder_confidence(similarities, "prob"),
+                            "biencoder_time": timer.time("biencoder"),
+                            "crossencoder_correct": crossencoder_correct,
+                            "crossencoder_time": timer.time("crossencoder_prepare")
+                            + timer.time("crossencoder"),
+                            "crossencoder_num_samples": int(reranked.sum()),
+                            "num_confident": int(confident.sum()),
+                        }
+                    )
+                crossencoder_normalized_accuracy = cross_metrics["normalized_accuracy"]
                 print(
                     "crossencoder normalized accuracy: %.4f"
                     % crossencoder_normalized_accuracy
                 )
 
-                overall_unormalized_accuracy = (
-                    crossencoder_normalized_accuracy * len(label_input) / len(samples)
-                )
+                overall_unormalized_accuracy = float(np.mean(correct))
                 print(
                     "overall unnormalized accuracy: %.4f" % overall_unormalized_accuracy
                 )
+            _report_stages(args, timer, metrics, logger)
             return (
                 biencoder_accuracy,
                 recall_at,
@@ -573,7 +1469,150 @@ def run(
             )
 
 
-if __name__ == "__main__":
+def _iter_chunks(iterable, chunk_size):
+    chunk = []
+    for item in iterable:
+        chunk.append(item)
+        if len(chunk) == chunk_size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def run_stream(
+    args,
+    logger,
+    biencoder,
+    biencoder_params,
+    crossencoder,
+    crossencoder_params,
+    candidate_encoding,
+    title2id,
+    id2title,
+    id2text,
+    wikipedia_id2local_id,
+    faiss_indexer=None,
+    candidate_cache=None,
+    test_data=None,
+):
+    """
+    Streaming version of ``run`` for large annotation jobs. Test mentions are
+    read, linked and written to ``args.stream_output`` (jsonl) in chunks of
+    ``args.stream_chunk_size``, so memory stays flat and the first results
+    are on disk after the first chunk.
+
+    Returns the number of linked samples and the accuracy of the final
+    predictions (-1 if the samples have no labels). The stage timings of all
+    the chunks are written to ``args.timing_report``, if set.
+    """
+    timer = StageTimer()
+    if test_data:
+        samples = iter(test_data)
+    elif getattr(args, "raw_text", None):
+        ner_model = NER.get_model(_ner_parameters(args))
+        with stage(timer, "ner"):
+            samples = iter(_annotate_raw_text(ner_model, args.raw_text, logger))
+    elif args.test_mentions:
+        samples = _iter_test_samples(
+            args.test_mentions,
+            args.test_entities,
+            title2id,
+            wikipedia_id2local_id,
+            logger,
+        )
+    else:
+        raise ValueError(
+            "ERROR: streaming mode needs input test mentions (--test_mentions)"
+        )
+
+    output_file = getattr(args, "stream_output", None) or os.path.join(
+        args.output_path, "predictions.jsonl"
+    )
+    chunk_size = getattr(args, "stream_chunk_size", 1024)
+    if args.fast:
+        crossencoder = None
+    score_cache = None
+    if crossencoder is not None:
+        score_cache = _get_score_cache(args, crossencoder_params)
+
+    num_samples = 0
+    num_labelled = 0
+    num_correct = 0
+    start_time = time.time()
+    try:
+        with open(output_file, "w") as fout:
+            for chunk in _iter_chunks(samples, chunk_size):
+                nns, scores = _link_samples(
+                    chunk,
+                    biencoder,
+                    biencoder_params,
+                    crossencoder,
+                    crossencoder_params,
+                    candidate_encoding,
+                    id2title,
+                    id2text,
+                    faiss_indexer=faiss_indexer,
+                    top_k=args.top_k,
+                    logger=logger,
+                    candidate_cache=candidate_cache,
+                    length_bucketing=getattr(args, "length_bucketing", False),
+                    score_cache=score_cache,
+                    cascade_threshold=getattr(args, "cascade_threshold", None),
+                    cascade_metric=getattr(args, "cascade_metric", "margin"),
+                    crossencoder_top_k=getattr(args, "crossencoder_top_k", 100),
+                    crossencoder_score_drop=getattr(
+                        args, "crossencoder_score_drop", None
+                    ),
+                    crossencoder_min_k=getattr(args, "crossencoder_min_k", 1),
+                    dedup=getattr(args, "dedup_mentions", False),
+                    timer=timer,
+                )
+                for sample, entity_list, scores_list in zip(chunk, nns, scores):
+                    entity_list = [int(e_id) for e_id in entity_list]
+                    label_id = int(sample.get("label_id", -1))
+                    if label_id >= 0 and sample.get("label") != "unknown":
+                        num_labelled += 1
+                        num_correct += int(entity_list[0] == label_id)
+                    prediction = {
+                        "id": sample.get("id"),
+                        "mention": sample["mention"],
+                        "sent_idx": sample.get("sent_idx"),
+                        "start_pos": sample.get("start_pos"),
+                        "end_pos": sample.get("end_pos"),
+                        "label_id": label_id,
+                        "entity_ids": entity_list,
+                        "predictions": [id2title[e_id] for e_id in entity_list],
+                        "scores": [float(score) for score in scores_list],
+                    }
+                    fout.write(json.dumps(prediction) + "\n")
+                fout.flush()
+
+                num_samples += len(chunk)
+                if logger:
+                    elapsed = time.time() - start_time
+                    logger.info(
+                        "Linked %d samples (%.1f samples/s), written to %s"
+                        % (num_samples, num_samples / max(elapsed, 1e-6), output_file)
+                    )
+    finally:
+        # flush the cached scores and the timings of the chunks linked so far,
+        # even if a chunk fails
+        if score_cache is not None:
+            if logger:
+                logger.info("crossencoder score cache: %s" % score_cache.stats())
+            score_cache.close()
+        _close_searcher(faiss_indexer)
+        _report_stages(args, timer, logger=logger)
+
+    accuracy = -1
+    if num_labelled > 0:
+        accuracy = num_correct / num_labelled
+        print("accuracy: %.4f" % accuracy)
+    return num_samples, accuracy
+
+
+def get_parser():
     parser = argparse.ArgumentParser()
 
     parser.add_argument(
@@ -609,7 +1648,8 @@ if __name__ == "__main__":
         type=str,
         # default="models/tac_entity.jsonl",  # TAC-KBP
         default="models/entity.jsonl",  # ALL WIKIPEDIA!
-        help="Path to the entity catalogue.",
+        help="Path to the entity catalogue (jsonl, or a directory compiled "
+        "with blink/entity_catalogue.py).",
     )
     parser.add_argument(
         "--entity_encoding",
@@ -617,7 +1657,15 @@ if __name__ == "__main__":
         type=str,
         # default="models/tac_candidate_encode_large.t7",  # TAC-KBP
         default="models/all_entities_large.t7",  # ALL WIKIPEDIA!
-        help="Path to the entity catalogue.",
+        help="Path to the entity encoding (.t7, or a directory converted "
+        "with blink/entity_encoding.py).",
+    )
+    parser.add_argument(
+        "--candidate_cache",
+        type=str,
+        default=None,
+        help="Path to the crossencoder token ids of the entities, built with "
+        "blink/crossencoder/candidate_cache.py (default: tokenize on the fly).",
     )
 
     # crossencoder
@@ -656,6 +1704,69 @@ if __name__ == "__main__":
     parser.add_argument(
         "--fast", dest="fast", action="store_true", help="only biencoder mode"
     )
+    parser.add_argument(
+        "--crossencoder_cache_size",
+        type=int,
+        default=0,
+        help="Cache up to this many crossencoder scores of (context, entity) "
+        "pairs in memory, 0 to disable the cache.",
+    )
+    parser.add_argument(
+        "--crossencoder_cache_spill",
+        type=str,
+        default=None,
+        help="sqlite file to keep the scores evicted from the crossencoder "
+        "cache in, and reuse them across runs.",
+    )
+    parser.add_argument(
+        "--length_bucketing",
+        action="store_true",
+        help="Batch mentions of similar length together and trim the padding "
+        "of every batch. Predictions are returned in the input order.",
+    )
+
+    parser.add_argument(
+        "--raw_text",
+        dest="raw_text",
+        type=str,
+        default=None,
+        help="Plain text file (one sentence per line) to find mentions in with "
+        "NER and link.",
+    )
+    parser.add_argument(
+        "--ner_batch_size",
+        dest="ner_batch_size",
+        type=int,
+        default=32,
+        help="Sentences tagged at once by the NER model.",
+    )
+    parser.add_argument(
+        "--ner_workers",
+        dest="ner_workers",
+        type=int,
+        default=0,
+        help="Processes tagging large documents with NER, each loads its own model.",
+    )
+
+    parser.add_argument(
+        "--stream",
+        action="store_true",
+        help="Link --test_mentions in bounded chunks and write predictions as "
+        "they are produced, instead of loading the whole file.",
+    )
+    parser.add_argument(
+        "--stream_chunk_size",
+        type=int,
+        default=1024,
+        help="Number of mentions per chunk in streaming mode.",
+    )
+    parser.add_argument(
+        "--stream_output",
+        type=str,
+        default=None,
+        help="Predictions file (jsonl) in streaming mode "
+        "(default: <output_path>/predictions.jsonl).",
+    )
 
     parser.add_argument(
         "--show_url",
@@ -665,16 +1776,176 @@ if __name__ == "__main__":
     )
 
     parser.add_argument(
-        "--faiss_index", type=str, default=None, help="whether to use faiss index",
+        "--cpu",
+        dest="cpu",
+        action="store_true",
+        help="Run the biencoder and crossencoder on CPU, even if a GPU is available.",
+    )
+    parser.add_argument(
+        "--num_threads",
+        dest="num_threads",
+        type=int,
+        default=None,
+        help="Intra-op threads of torch on CPU (default: torch default).",
+    )
+    parser.add_argument(
+        "--num_interop_threads",
+        dest="num_interop_threads",
+        type=int,
+        default=None,
+        help="Inter-op threads of torch on CPU (default: torch default).",
+    )
+    parser.add_argument(
+        "--context_encoder",
+        dest="context_encoder",
+        type=str,
+        default=None,
+        help="Compiled biencoder context encoder (blink/biencoder/export.py) "
+        "to use instead of the eager model.",
+    )
+    parser.add_argument(
+        "--quantize_crossencoder",
+        dest="quantize_crossencoder",
+        action="store_true",
+        help="Dynamic int8 quantization of the crossencoder linear layers (CPU only).",
+    )
+
+    parser.add_argument(
+        "--tokenizer_backend",
+        dest="tokenizer_backend",
+        default=None,
+        choices=["python", "process", "fast"],
+        help="How to tokenize the test mentions (see blink/common/params.py), "
+        "default: the tokenizer_backend of the biencoder config, or python.",
+    )
+    parser.add_argument(
+        "--tokenizer_workers",
+        dest="tokenizer_workers",
+        type=int,
+        default=None,
+        help="Number of processes of the process tokenizer backend "
+        "(default: the biencoder config, or the number of CPUs).",
+    )
+
+    parser.add_argument(
+        "--dedup_mentions",
+        dest="dedup_mentions",
+        action="store_true",
+        help="Encode and score mentions with the same context only once.",
+    )
+
+    parser.add_argument(
+        "--crossencoder_top_k",
+        dest="crossencoder_top_k",
+        type=int,
+        default=100,
+        help="Number of biencoder candidates of every mention reranked by the "
+        "crossencoder (at most --top_k).",
+    )
+    parser.add_argument(
+        "--crossencoder_score_drop",
+        dest="crossencoder_score_drop",
+        type=float,
+        default=None,
+        help="Adaptive number of crossencoder candidates: only rerank the "
+        "candidates whose biencoder score is within this margin of the top-1.",
+    )
+    parser.add_argument(
+        "--crossencoder_min_k",
+        dest="crossencoder_min_k",
+        type=int,
+        default=1,
+        help="Minimum number of crossencoder candidates per mention with "
+        "--crossencoder_score_drop.",
+    )
+
+    parser.add_argument(
+        "--cascade_threshold",
+        dest="cascade_threshold",
+        type=float,
+        default=None,
+        help="Skip the crossencoder for the mentions whose biencoder confidence "
+        "(see --cascade_metric) is at least this threshold.",
+    )
+    parser.add_argument(
+        "--cascade_metric",
+        dest="cascade_metric",
+        type=str,
+        default="margin",
+        choices=CONFIDENCE_METRICS,
+        help="Biencoder confidence: margin between the top-1 and top-2 scores, "
+        "or softmax probability of the top-1 over the top-k candidates.",
+    )
+
+    parser.add_argument(
+        "--faiss_index",
+        type=str,
+        default=None,
+        choices=FAISS_INDEXES,
+        help="whether to use faiss index",
+    )
+    parser.add_argument(
+        "--faiss_nprobe",
+        type=int,
+        default=None,
+        help="Clusters searched by an ivfpq index (default: the one it was built with).",
+    )
+    parser.add_argument(
+        "--faiss_rerank",
+        type=int,
+        default=0,
+        help="Re-score the top N candidates of an ivfpq index with the exact "
+        "--entity_encoding (best as a memory-mapped encoding store).",
     )
 
     parser.add_argument(
         "--index_path", type=str, default=None, help="path to load indexer",
     )
 
+    parser.add_argument(
+        "--blockwise_search",
+        dest="blockwise_search",
+        action="store_true",
+        help="Without a faiss index, find the exact top-k entities by scanning "
+        "the entity encodings in blocks instead of scoring all of them at once.",
+    )
+    parser.add_argument(
+        "--search_threads",
+        dest="search_threads",
+        type=int,
+        default=4,
+        help="Threads scanning the entity encodings with --blockwise_search.",
+    )
+    parser.add_argument(
+        "--search_memory_mb",
+        dest="search_memory_mb",
+        type=int,
+        default=256,
+        help="Memory budget (MB) of the scores and blocks of --blockwise_search.",
+    )
+
+    parser.add_argument(
+        "--timing_report",
+        dest="timing_report",
+        type=str,
+        default=None,
+        help="Write the wall time, item count and peak memory of every stage "
+        "(tokenization, biencoder, search, crossencoder) to this JSON file.",
+    )
+
+    add_profiler_args(parser)
+
+    return parser
+
+
+if __name__ == "__main__":
+    parser = get_parser()
     args = parser.parse_args()
 
     logger = utils.get_logger(args.output_path)
 
     models = load_models(args, logger)
-    run(args, logger, *models)
+    if args.stream:
+        run_stream(args, logger, *models)
+    else:
+        run(args, logger, *models)
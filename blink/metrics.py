@@ -0,0 +1,169 @@
+# Copyright (c) Facebook, Inc. and its affiliates.
+# All rights reserved.
+#
+# This source code is licensed under the license found in the
+# LICENSE file in the root directory of this source tree.
+#
+"""
+Entity linking metrics.
+
+The rank of the gold entity among the biencoder candidates is computed once
+per mention, every metric (accuracy, recall@k for all k, crossencoder
+normalized / unnormalized accuracy) is derived from these ranks.
+"""
+import numpy as np
+
+
+def gold_ranks(labels, nns):
+    """
+    0-based rank of the gold entity ``labels[i]`` in the candidate list
+    ``nns[i]`` of every mention, -1 if it was not retrieved.
+    """
+    labels = np.asarray(labels).reshape(-1)
+    if len(labels) == 0:
+        return np.zeros(0, dtype=np.int64)
+
+    lengths = set(len(nn) for nn in nns)
+    if len(lengths) == 1:
+        matches = np.asarray(list(nns)).reshape(len(labels), -1) == labels[:, None]
+        ranks = matches.argmax(axis=1)
+        ranks[~matches.any(axis=1)] = -1
+        return ranks.astype(np.int64)
+
+    # candidate lists of different lengths
+    ranks = np.full(len(labels), -1, dtype=np.int64)
+    for i, (label, nn) in enumerate(zip(labels, nns)):
+        matches = np.flatnonzero(np.asarray(nn) == label)
+        if len(matches) > 0:
+            ranks[i] = matches[0]
+    return ranks
+
+
+def recall_curve(ranks, top_k):
+    """recall@k for k = 1, ..., top_k, as an array of length top_k."""
+    ranks = np.asarray(ranks)
+    if len(ranks) == 0:
+        return np.zeros(top_k)
+    retrieved = ranks[(ranks >= 0) & (ranks < top_k)]
+    counts = np.bincount(retrieved, minlength=top_k)
+    return np.cumsum(counts) / len(ranks)
+
+
+def recall_at_k(ranks, k):
+    ranks = np.asarray(ranks)
+    if len(ranks) == 0:
+        return 0.0
+    return float(np.sum((ranks >= 0) & (ranks < k)) / len(ranks))
+
+
+def biencoder_metrics(labels, nns, top_k):
+    """
+    Accuracy (recall@1), recall@top_k and the full recall curve of the
+    biencoder candidates.
+    """
+    ranks = gold_ranks(labels, nns)
+    curve = recall_curve(ranks, top_k)
+    return {
+        "gold_ranks": ranks,
+        "recall_curve": curve,
+        "accuracy": float(curve[0]) if top_k > 0 else 0.0,
+        "recall_at": float(curve[-1]) if top_k > 0 else 0.0,
+    }
+
+
+def top1(logits):
+    """
+    Index of the best candidate of every mention, the mentions can have
+    different numbers of candidates.
+    """
+    if len(logits) == 0:
+        return np.zeros(0, dtype=np.int64)
+    if len(set(len(row) for row in logits)) == 1:
+        return np.asarray(logits).reshape(len(logits), -1).argmax(axis=1)
+    return np.array([np.argmax(row) for row in logits], dtype=np.int64)
+
+
+def crossencoder_metrics(logits, label_input, num_samples):
+    """
+    Crossencoder accuracy over the mentions it was run on (the ones whose gold
+    entity was retrieved, ``label_input`` is its index among the candidates),
+    and over all the ``num_samples`` mentions. ``logits`` has a row of
+    candidate scores per mention.
+    """
+    label_input = np.asarray(label_input).reshape(-1)
+    num_correct = 0
+    if len(label_input) > 0:
+        num_correct = int(np.sum(top1(logits) == label_input))
+    normalized_accuracy = num_correct / len(label_input) if len(label_input) else 0.0
+    unnormalized_accuracy = num_correct / num_samples if num_samples else 0.0
+    return {
+        "num_correct": num_correct,
+        "normalized_accuracy": normalized_accuracy,
+        "unnormalized_accuracy": unnormalized_accuracy,
+    }
+
+
+CONFIDENCE_METRICS = ["margin", "prob"]
+
+
+def biencoder_confidence(scores, method="margin"):
+    """
+    Confidence of the biencoder in its top-1 candidate, from the similarity
+    scores of the top-k candidates of every mention (descending):
+
+        margin: difference between the top-1 and top-2 scores
+        prob:   softmax probability of the top-1 candidate over the top-k
+    """
+    confidence = np.zeros(len(scores))
+    for i, mention_scores in enumerate(scores):
+        mention_scores = np.asarray(mention_scores, dtype=np.float64)
+        if len(mention_scores) < 2:
+            confidence[i] = np.inf if method == "margin" else 1.0
+        elif method == "margin":
+            confidence[i] = mention_scores[0] - mention_scores[1]
+        elif method == "prob":
+            exp_scores = np.exp(mention_scores - mention_scores.max())
+            confidence[i] = exp_scores[0] / exp_scores.sum()
+        else:
+            raise ValueError(
+                "Unsupported confidence {}. Choose from {}.".format(
+                    method, ",".join(CONFIDENCE_METRICS)
+                )
+            )
+    return confidence
+
+
+def cascade_tradeoff(metrics, thresholds, method="margin"):
+    """
+    Accuracy and estimated latency of the biencoder -> crossencoder cascade
+    for every threshold, from the ``metrics`` of a full (non-cascaded) run:
+    mentions whose biencoder confidence clears the threshold keep the
+    biencoder top-1, the others get the crossencoder prediction.
+    """
+    confidence = metrics["biencoder_" + method]
+    biencoder_correct = metrics["biencoder_gold_ranks"] == 0
+    crossencoder_correct = metrics["crossencoder_correct"]
+    num_samples = len(confidence)
+    # crossencoder time per mention that reaches it
+    crossencoder_time = metrics["crossencoder_time"] / max(
+        metrics["crossencoder_num_samples"], 1
+    )
+
+    rows = []
+    for threshold in thresholds:
+        confident = confidence >= threshold
+        correct = np.where(confident, biencoder_correct, crossencoder_correct)
+        num_crossencoder = int(np.sum(~confident))
+        total_time = (
+            metrics["biencoder_time"] + num_crossencoder * crossencoder_time
+        )
+        rows.append(
+            {
+                "threshold": threshold,
+                "accuracy": float(np.mean(correct)) if num_samples else 0.0,
+                "crossencoder_fraction": num_crossencoder / max(num_samples, 1),
+                "time": total_time,
+                "ms_per_mention": 1000 * total_time / max(num_samples, 1),
+            }
+        )
+    return rows
@@ -4,12 +4,33 @@
 # This source code is licensed under the license found in the
 # LICENSE file in the root directory of this source tree.
 #
+import multiprocessing
+import time
+
 from flair.models import SequenceTagger
 from flair.data import Sentence
 
 
+# loaded NER models, by parameters
+_MODELS = {}
+
+
 def get_model(parameters=None):
-    return Flair(parameters)
+    """
+    NER model, loaded once per process and parameters:
+        ner_model       flair model name (default "ner")
+        ner_batch_size  sentences tagged at once (default 32)
+        ner_workers     processes tagging large documents (default 0, i.e. none)
+    """
+    parameters = parameters or {}
+    key = (
+        parameters.get("ner_model") or "ner",
+        parameters.get("ner_batch_size") or 32,
+        parameters.get("ner_workers") or 0,
+    )
+    if key not in _MODELS:
+        _MODELS[key] = Flair(parameters)
+    return _MODELS[key]
 
 
 class NER_model:
@@ -26,18 +47,88 @@ class NER_model:
         pass
 
 
+def _tag(model, sentences, batch_size):
+    sentences = [Sentence(sent, use_tokenizer=True) for sent in sentences]
+    if len(sentences) > 0:
+        model.predict(sentences, mini_batch_size=batch_size)
+    return [sent.to_dict(tag_type="ner")["entities"] for sent in sentences]
+
+
+def _init_ner_worker(model_name):
+    global _worker_model
+    _worker_model = SequenceTagger.load(model_name)
+
+
+def _worker_tag(sentences, batch_size):
+    return _tag(_worker_model, sentences, batch_size)
+
+
 class Flair(NER_model):
     def __init__(self, parameters=None):
-        self.model = SequenceTagger.load("ner")
+        parameters = parameters or {}
+        self.model_name = parameters.get("ner_model") or "ner"
+        self.batch_size = parameters.get("ner_batch_size") or 32
+        self.num_workers = parameters.get("ner_workers") or 0
+        self._model = None
+        if self.num_workers <= 1:
+            self._model = SequenceTagger.load(self.model_name)
+        self.pool = None
+        self.num_sentences = 0
+        self.elapsed = 0.0
+
+    @property
+    def model(self):
+        # with workers, the parent only needs a tagger for small documents
+        if self._model is None:
+            self._model = SequenceTagger.load(self.model_name)
+        return self._model
+
+    def _get_pool(self):
+        if self.pool is None:
+            # every worker loads its own tagger once
+            self.pool = multiprocessing.Pool(
+                self.num_workers,
+                initializer=_init_ner_worker,
+                initargs=(self.model_name,),
+            )
+        return self.pool
 
     def predict(self, sentences):
+        """
+        Tag ``sentences`` in mini-batches of ``batch_size``; documents of more
+        than ``num_workers`` batches are split across the worker processes.
+        """
+        start_time = time.time()
+        chunk_size = self.batch_size * 4
+        if self.num_workers > 1 and len(sentences) > self.num_workers * self.batch_size:
+            chunks = [
+                sentences[i : i + chunk_size]
+                for i in range(0, len(sentences), chunk_size)
+            ]
+            sent_entities = []
+            # starmap keeps the order of the chunks
+            for chunk_entities in self._get_pool().starmap(
+                _worker_tag, [(chunk, self.batch_size) for chunk in chunks]
+            ):
+                sent_entities.extend(chunk_entities)
+        else:
+            sent_entities = _tag(self.model, sentences, self.batch_size)
+
         mentions = []
-        for sent_idx, sent in enumerate(sentences):
-            sent = Sentence(sent, use_tokenizer=True)
-            self.model.predict(sent)
-            sent_mentions = sent.to_dict(tag_type="ner")["entities"]
+        for sent_idx, sent_mentions in enumerate(sent_entities):
             for mention in sent_mentions:
                 mention["sent_idx"] = sent_idx
             mentions.extend(sent_mentions)
+
+        self.num_sentences += len(sentences)
+        self.elapsed += time.time() - start_time
         return {"sentences": sentences, "mentions": mentions}
 
+    def sentences_per_second(self):
+        return self.num_sentences / self.elapsed if self.elapsed > 0 else 0.0
+
+    def close(self):
+        if self.pool is not None:
+            self.pool.close()
+            self.pool.join()
+            self.pool = None
@@ -9,6 +9,7 @@ import prettytable
 
 import blink.main_dense as main_dense
 import blink.candidate_ranking.utils as utils
+from blink.metrics import recall_at_k
 
 DATASETS = [
     {
@@ -48,6 +49,7 @@ PARAMETERS = {
     "fast": False,
     "top_k": 100,
 }
+RECALL_AT = [10, 30, 100]
 args = argparse.Namespace(**PARAMETERS)
 
 logger = utils.get_logger(args.output_path)
@@ -58,7 +60,9 @@ table = prettytable.PrettyTable(
     [
         "DATASET",
         "biencoder accuracy",
-        "recall at 100",
+    ]
+    + ["recall at {}".format(k) for k in RECALL_AT]
+    + [
         "crossencoder normalized accuracy",
         "overall unormalized accuracy",
         "support",
@@ -70,6 +74,7 @@ for dataset in DATASETS:
     PARAMETERS["test_mentions"] = dataset["filename"]
 
     args = argparse.Namespace(**PARAMETERS)
+    metrics = {}
     (
         biencoder_accuracy,
         recall_at,
@@ -78,13 +83,14 @@ for dataset in DATASETS:
         num_datapoints,
         predictions,
         scores,
-    ) = main_dense.run(args, logger, *models)
+    ) = main_dense.run(args, logger, *models, metrics=metrics)
 
+    # all the recall values come from the gold ranks computed once in run
+    ranks = metrics["biencoder_gold_ranks"]
     table.add_row(
-        [
-            dataset["name"],
-            round(biencoder_accuracy, 4),
-            round(recall_at, 4),
+        [dataset["name"], round(biencoder_accuracy, 4)]
+        + [round(recall_at_k(ranks, k), 4) for k in RECALL_AT]
+        + [
             round(crossencoder_normalized_accuracy, 4),
             round(overall_unormalized_accuracy, 4),
             num_datapoints,
@@ -0,0 +1,365 @@
+# Copyright (c) Facebook, Inc. and its affiliates.
+# All rights reserved.
+#
+# This source code is licensed under the license found in the
+# LICENSE file in the root directory of this source tree.
+#
+"""
+Long-running BLINK linking server.
+
+The biencoder, crossencoder, entity catalogue and index are loaded once and
+kept resident. Concurrent requests are gathered into micro-batches of up to
+``--max_batch_size`` mentions, or for at most ``--max_wait_ms`` after the
+first request arrived, before they are linked together.
+
+Two front ends are available:
+
+    HTTP:  python blink/server.py --port 8000
+           curl -X POST localhost:8000/link -d '{"mentions": [...]}'
+    stdin: python blink/server.py --stdin < requests.jsonl > responses.jsonl
+
+Every request is a list of mentions in the ``test_data`` format of
+``main_dense.run`` (``context_left``, ``mention``, ``context_right``, and
+optionally ``id``).
+"""
+import json
+import queue
+import sys
+import threading
+import time
+
+from concurrent.futures import Future
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from socketserver import ThreadingMixIn
+
+import blink.main_dense as main_dense
+import blink.candidate_ranking.utils as utils
+from blink.common.stage_timer import StageTimer
+
+
+class MicroBatcher(object):
+    """
+    Collects requests from any number of threads and links them together in
+    a single worker thread, so the models are only ever used by one thread.
+    """
+
+    def __init__(self, link_fn, max_batch_size, max_wait_ms, logger=None):
+        self.link_fn = link_fn
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000.0
+        self.logger = logger
+        self.queue = queue.Queue()
+        self.worker = threading.Thread(target=self._loop, daemon=True)
+        self.worker.start()
+
+    def submit(self, samples):
+        future = Future()
+        if len(samples) == 0:
+            future.set_result(([], []))
+        else:
+            self.queue.put((samples, future))
+        return future
+
+    def close(self):
+        """Link the requests already submitted and stop the worker thread."""
+        self.queue.put(None)
+        self.worker.join()
+
+    def _loop(self):
+        while True:
+            item = self.queue.get()
+            if item is None:
+                return
+            batch = [item]
+            num_samples = len(batch[0][0])
+            deadline = time.time() + self.max_wait
+            while num_samples < self.max_batch_size:
+                timeout = deadline - time.time()
+                if timeout <= 0:
+                    break
+                try:
+                    item = self.queue.get(timeout=timeout)
+                except queue.Empty:
+                    break
+                if item is None:
+                    self._run(batch, num_samples)
+                    return
+                batch.append(item)
+                num_samples += len(item[0])
+            self._run(batch, num_samples)
+
+    def _run(self, batch, num_samples):
+        samples = [sample for item_samples, _ in batch for sample in item_samples]
+        start_time = time.time()
+        try:
+            nns, scores = self.link_fn(samples)
+        except Exception as e:
+            for _, future in batch:
+                future.set_exception(e)
+            return
+        if self.logger:
+            elapsed = time.time() - start_time
+            self.logger.info(
+                "Linked %d mentions from %d requests in %.3fs (%.1f mentions/s)"
+                % (num_samples, len(batch), elapsed, num_samples / max(elapsed, 1e-6))
+            )
+        start = 0
+        for item_samples, future in batch:
+            end = start + len(item_samples)
+            future.set_result((nns[start:end], scores[start:end]))
+            start = end
+
+
+class LinkingService(object):
+    def __init__(self, args, logger=None):
+        self.args = args
+        self.logger = logger
+        (
+            self.biencoder,
+            self.biencoder_params,
+            self.crossencoder,
+            self.crossencoder_params,
+            self.candidate_encoding,
+            self.title2id,
+            self.id2title,
+            self.id2text,
+            self.wikipedia_id2local_id,
+            self.faiss_indexer,
+            self.candidate_cache,
+        ) = main_dense.load_models(args, logger)
+        self.id2url = main_dense._get_id2url(self.wikipedia_id2local_id)
+        # stage timings since the start of the server
+        self.timer = StageTimer()
+        self.score_cache = None
+        if self.crossencoder is not None:
+            self.score_cache = main_dense._get_score_cache(
+                args, self.crossencoder_params
+            )
+
+        max_batch_size = args.max_batch_size or self.biencoder_params["eval_batch_size"]
+        self.batcher = MicroBatcher(
+            self._link, max_batch_size, args.max_wait_ms, logger=logger
+        )
+
+    def close(self):
+        """
+        Stop linking, stop the blockwise search threads and close the
+        crossencoder score cache, which writes the scores still in memory to
+        its spill file.
+        """
+        self.batcher.close()
+        if self.score_cache is not None:
+            self.score_cache.close()
+        main_dense._close_searcher(self.faiss_indexer)
+
+    def _link(self, samples):
+        return main_dense._link_samples(
+            samples,
+            self.biencoder,
+            self.biencoder_params,
+            self.crossencoder,
+            self.crossencoder_params,
+            self.candidate_encoding,
+            self.id2title,
+            self.id2text,
+            faiss_indexer=self.faiss_indexer,
+            top_k=self.args.top_k,
+            logger=self.logger,
+            candidate_cache=self.candidate_cache,
+            length_bucketing=self.args.length_bucketing,
+            score_cache=self.score_cache,
+            cascade_threshold=self.args.cascade_threshold,
+            cascade_metric=self.args.cascade_metric,
+            crossencoder_top_k=self.args.crossencoder_top_k,
+            crossencoder_score_drop=self.args.crossencoder_score_drop,
+            crossencoder_min_k=self.args.crossencoder_min_k,
+            dedup=self.args.dedup_mentions,
+            timer=self.timer,
+        )
+
+    @staticmethod
+    def _prepare_sample(record):
+        sample = dict(record)
+        sample.setdefault("label", "unknown")
+        sample.setdefault("label_id", -1)
+        # LOWERCASE EVERYTHING !
+        sample["context_left"] = sample.get("context_left", "").lower()
+        sample["context_right"] = sample.get("context_right", "").lower()
+        sample["mention"] = sample["mention"].lower()
+        return sample
+
+    def submit(self, mentions):
+        """Queue a request, returns a future of its predictions."""
+        samples = [self._prepare_sample(record) for record in mentions]
+        future = Future()
+
+        def done(link_future):
+            try:
+                nns, scores = link_future.result()
+                future.set_result(self._format(mentions, nns, scores))
+            except Exception as e:
+                future.set_exception(e)
+
+        self.batcher.submit(samples).add_done_callback(done)
+        return future
+
+    def stats(self):
+        stats = {"status": "ok", "stages": self.timer.report()}
+        if self.score_cache is not None:
+            stats["crossencoder_score_cache"] = self.score_cache.stats()
+        return stats
+
+    def _format(self, mentions, nns, scores):
+        predictions = []
+        for record, entity_list, scores_list in zip(mentions, nns, scores):
+            entities = []
+            for e_id, score in zip(entity_list, scores_list):
+                entities.append(
+                    {
+                        "id": int(e_id),
+                        "title": self.id2title[e_id],
+                        "url": self.id2url.get(int(e_id)),
+                        "score": float(score),
+                    }
+                )
+            predictions.append(
+                {"id": record.get("id"), "mention": record["mention"], "entities": entities}
+            )
+        return predictions
+
+
+def _parse_request(request):
+    if isinstance(request, dict):
+        return request["mentions"]
+    return request
+
+
+class _ThreadingHTTPServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
+def serve_http(service, host, port, logger=None):
+    class Handler(BaseHTTPRequestHandler):
+        def _reply(self, code, obj):
+            body = json.dumps(obj).encode("utf-8")
+            self.send_response(code)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def do_GET(self):
+            if self.path == "/health":
+                self._reply(200, service.stats())
+            else:
+                self._reply(404, {"error": "not found"})
+
+        def do_POST(self):
+            if self.path != "/link":
+                self._reply(404, {"error": "not found"})
+                return
+            try:
+                length = int(self.headers.get("Content-Length", 0))
+                request = json.loads(self.rfile.read(length).decode("utf-8"))
+                mentions = _parse_request(request)
+            except (ValueError, KeyError) as e:
+                self._reply(400, {"error": "malformed request: {}".format(e)})
+                return
+            try:
+                predictions = service.submit(mentions).result()
+            except Exception as e:
+                self._reply(500, {"error": str(e)})
+                return
+            self._reply(200, {"predictions": predictions})
+
+        def log_message(self, format, *args):
+            if logger:
+                logger.debug(format % args)
+
+    server = _ThreadingHTTPServer((host, port), Handler)
+    if logger:
+        logger.info("Serving BLINK on http://%s:%d/link" % (host, port))
+    server.serve_forever()
+
+
+def serve_stdin(service, fin, fout, max_pending=64):
+    """
+    Read one request per line from ``fin`` and write one response per line to
+    ``fout``, in input order. Up to ``max_pending`` requests are in flight at
+    once so that they can be batched together.
+    """
+    pending = queue.Queue(maxsize=max_pending)
+
+    def writer():
+        while True:
+            future = pending.get()
+            if future is None:
+                return
+            try:
+                response = {"predictions": future.result()}
+            except Exception as e:
+                response = {"error": str(e)}
+            fout.write(json.dumps(response) + "\n")
+            fout.flush()
+
+    writer_thread = threading.Thread(target=writer)
+    writer_thread.start()
+    for line in fin:
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            future = service.submit(_parse_request(json.loads(line)))
+        except (ValueError, KeyError) as e:
+            future = Future()
+            future.set_exception(e)
+        pending.put(future)
+    pending.put(None)
+    writer_thread.join()
+
+
+if __name__ == "__main__":
+    parser = main_dense.get_parser()
+    parser.add_argument(
+        "--stdin",
+        action="store_true",
+        help="Read JSONL requests from stdin and write responses to stdout "
+        "instead of serving HTTP.",
+    )
+    parser.add_argument("--host", type=str, default="127.0.0.1", help="HTTP host.")
+    parser.add_argument("--port", type=int, default=8000, help="HTTP port.")
+    parser.add_argument(
+        "--max_batch_size",
+        type=int,
+        default=None,
+        help="Maximum number of mentions per micro-batch "
+        "(default: the biencoder eval_batch_size).",
+    )
+    parser.add_argument(
+        "--max_wait_ms",
+        type=float,
+        default=10.0,
+        help="Maximum time to wait for a micro-batch to fill up.",
+    )
+    args = parser.parse_args()
+
+    if args.stdin:
+        # keep stdout for responses, progress bars and logs go to stderr: the
+        # logger's stream handler binds sys.stdout when it is created
+        stdout = sys.stdout
+        sys.stdout = sys.stderr
+        logger = utils.get_logger(args.output_path)
+        service = LinkingService(args, logger)
+        try:
+            serve_stdin(service, sys.stdin, stdout)
+        finally:
+            service.close()
+    else:
+        logger = utils.get_logger(args.output_path)
+        service = LinkingService(args, logger)
+        try:
+            serve_http(service, args.host, args.port, logger)
+        except KeyboardInterrupt:
+            pass
+        finally:
+            service.close()
@@ -22,6 +22,8 @@ from pytorch_transformers.tokenization_bert import BertTokenizer
 
 from elq.common.ranker_base import BertEncoder, get_model_obj
 from blink.common.optimizer import get_bert_optimizer
+from blink.entity_encoding import EntityEncodingStore
+from blink.common.profiling import record_function
 from elq.biencoder.allennlp_span_utils import batched_span_select, batched_index_select
 from elq.biencoder.utils import batch_reshape_mask_left
 
@@ -248,6 +250,8 @@ class BiEncoderModule(torch.nn.Module):
                 param.requires_grad = False
 
         self.config = ctxt_bert.config
+        # compiled raw context encoder, see blink.biencoder.export
+        self.compiled_context_encoder = None
 
         ctxt_bert_output_dim = ctxt_bert.embeddings.word_embeddings.weight.size(1)
 
@@ -283,9 +287,12 @@ class BiEncoderModule(torch.nn.Module):
         Returns:
             torch.FloatTensor (bsz, seqlen, embed_dim)
         """
-        raw_ctxt_encoding, _, _ = self.context_encoder.bert_model(
-            token_idx_ctxt, segment_idx_ctxt, mask_ctxt,
-        )
+        if self.compiled_context_encoder is not None:
+            return self.compiled_context_encoder(token_idx_ctxt)
+        with record_function("bert_encoder"):
+            raw_ctxt_encoding, _, _ = self.context_encoder.bert_model(
+                token_idx_ctxt, segment_idx_ctxt, mask_ctxt,
+            )
         return raw_ctxt_encoding
 
     def get_ctxt_mention_scores(
@@ -311,9 +318,10 @@ class BiEncoderModule(torch.nn.Module):
             )
 
         # (num_total_mentions,); (num_total_mentions,)
-        return self.classification_heads['mention_scores'](
-            raw_ctxt_encoding, mask_ctxt,
-        )
+        with record_function("elq_mention_head"):
+            return self.classification_heads['mention_scores'](
+                raw_ctxt_encoding, mask_ctxt,
+            )
 
     def prune_ctxt_mentions(
         self,
@@ -589,6 +597,13 @@ class BiEncoderRanker(torch.nn.Module):
     def build_model(self):
         self.model = BiEncoderModule(self.params)
 
+    def set_context_encoder(self, context_encoder):
+        """
+        Use a compiled raw context encoder (blink.biencoder.export) instead of
+        the eager BERT model to encode the contexts at inference.
+        """
+        get_model_obj(self.model).compiled_context_encoder = context_encoder
+
     def save_model(self, output_dir):
         if not os.path.exists(output_dir):
             os.makedirs(output_dir)
@@ -781,7 +796,12 @@ class BiEncoderRanker(torch.nn.Module):
             # matmul across all cand_encs (in-batch, if cand_encs is None, or across all cand_encs)
             # (all_batch_pred_mentions, num_cands)
             # similarity score between ctxt i and cand j
-            all_scores = embedding_ctxt.mm(embedding_cands.t())
+            with record_function("candidate_scoring"):
+                if isinstance(embedding_cands, EntityEncodingStore):
+                    # memory-mapped encodings are upcast block by block
+                    all_scores = embedding_cands.score(embedding_ctxt)
+                else:
+                    all_scores = embedding_ctxt.mm(embedding_cands.t())
                 
             return all_scores, mention_logits, mention_bounds
 
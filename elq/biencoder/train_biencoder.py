@@ -39,6 +39,7 @@ import elq.candidate_ranking.utils as utils
 from elq.biencoder.data_process import process_mention_data
 from blink.biencoder.zeshel_utils import DOC_PATH, WORLDS, world_to_id
 from blink.common.optimizer import get_bert_optimizer
+from blink.common.profiling import add_profiler_args, get_profiler
 from elq.common.params import ElqParser
 from elq.index.faiss_indexer import DenseFlatIndexer, DenseHNSWFlatIndexer, DenseIVFFlatIndexer
 
@@ -342,6 +343,8 @@ def main(params):
     best_epoch_idx = -1
     best_score = -1
     logger.info("Num samples per batch : %d" % num_samples_per_batch)
+    # --profile: operator profile of a window of training batches
+    profiler = get_profiler(params, "train_elq_biencoder", logger)
     for epoch_idx in trange(params["last_epoch"] + 1, int(num_train_epochs), desc="Epoch"):
         tr_loss = 0
         results = None
@@ -528,6 +531,8 @@ def main(params):
                 model.train()
                 logger.info("\n")
 
+            profiler.step()
+
         logger.info("***** Saving fine - tuned model *****")
         epoch_output_folder_path = os.path.join(
             model_output_path, "epoch_{}".format(epoch_idx)
@@ -560,6 +565,7 @@ def main(params):
         best_score = ls[np.argmax(ls)]
         best_epoch_idx = li[np.argmax(ls)]
         logger.info("\n")
+    profiler.close()
 
     execution_time = (time.time() - time_start) / 60
     utils.write_to_file(
@@ -583,6 +589,7 @@ def main(params):
 if __name__ == "__main__":
     parser = ElqParser(add_model_args=True)
     parser.add_training_args()
+    add_profiler_args(parser)
 
     args = parser.parse_args()
     print(args)
@@ -11,7 +11,8 @@ import os
 import time
 import torch
 
-from elq.index.faiss_indexer import DenseFlatIndexer, DenseIVFFlatIndexer, DenseHNSWFlatIndexer
+from elq.index.faiss_indexer import DenseFlatIndexer, DenseIVFFlatIndexer, DenseHNSWFlatIndexer, DenseIVFPQIndexer, DenseSQIndexer
+from blink.entity_encoding import load_entity_encoding
 import elq.candidate_ranking.utils as utils
 
 logger = utils.get_logger()
@@ -20,7 +21,7 @@ def main(params):
     output_path = params["output_path"]
 
     logger.info("Loading candidate encoding from path: %s" % params["candidate_encoding"])
-    candidate_encoding = torch.load(params["candidate_encoding"])
+    candidate_encoding = load_entity_encoding(params["candidate_encoding"], chunks=True)
     vector_size = candidate_encoding.size(1)
     index_buffer = params["index_buffer"]
     if params["faiss_index"] == "hnsw":
@@ -29,12 +30,34 @@ def main(params):
     elif params["faiss_index"] == "ivfflat":
         logger.info("Using IVF Flat index in FAISS")
         index = DenseIVFFlatIndexer(vector_size, 75, 100)
+    elif params["faiss_index"] == "ivfpq":
+        logger.info("Using IVF-PQ index in FAISS")
+        index = DenseIVFPQIndexer(
+            vector_size,
+            index_buffer,
+            nlist=params["nlist"],
+            pq_m=params["pq_m"],
+            pq_nbits=params["pq_nbits"],
+            opq=params["opq"],
+            nprobe=params["nprobe"],
+            train_size=params["train_size"],
+        )
+    elif params["faiss_index"] in DenseSQIndexer.QUANTIZER_TYPES:
+        logger.info("Using %s scalar quantized index in FAISS" % params["faiss_index"])
+        index = DenseSQIndexer(
+            vector_size,
+            index_buffer,
+            quantizer=params["faiss_index"],
+            train_size=params["train_size"],
+        )
     else:
         logger.info("Using Flat index in FAISS")
         index = DenseFlatIndexer(vector_size, index_buffer)
 
     logger.info("Building index.")
-    index.index_data(candidate_encoding.numpy())
+    # trained on a sample where needed, then added one --index_buffer batch at
+    # a time: encoding chunks are never merged in memory
+    index.index_data(candidate_encoding)
     logger.info("Done indexing data.")
 
     if params.get("save_index", None):
@@ -53,10 +76,10 @@ if __name__ == '__main__':
         "--candidate_encoding",
         default="models/all_entities_large.t7",
         type=str,
-        help="file path for candidte encoding.",
+        help="file path for candidte encoding (.t7 tensor, encoding store directory, or directory / .json manifest of {start}_{end}.t7 chunks from scripts/generate_candidates.py).",
     )
     parser.add_argument(
-        "--faiss_index", type=str, choices=["hnsw", "flat", "ivfflat"],
+        "--faiss_index", type=str, choices=["hnsw", "flat", "ivfflat", "ivfpq", "sq8", "fp16"],
         help='Which faiss index to use',
     )
     parser.add_argument(
@@ -67,6 +90,30 @@ if __name__ == '__main__':
         '--index_buffer', type=int, default=50000,
         help="Temporal memory data buffer size (in samples) for indexer",
     )
+    parser.add_argument(
+        '--nlist', type=int, default=None,
+        help="ivfpq: number of clusters (default: about 4 * sqrt(number of entities))",
+    )
+    parser.add_argument(
+        '--pq_m', type=int, default=64,
+        help="ivfpq: number of sub-quantizers, i.e. bytes per vector with 8 bits",
+    )
+    parser.add_argument(
+        '--pq_nbits', type=int, default=8,
+        help="ivfpq: bits per sub-quantizer code",
+    )
+    parser.add_argument(
+        "--opq", action='store_true',
+        help='ivfpq: rotate the vectors with OPQ before quantizing them',
+    )
+    parser.add_argument(
+        '--nprobe', type=int, default=64,
+        help="ivfpq: clusters searched per query (can be changed at search time)",
+    )
+    parser.add_argument(
+        '--train_size', type=int, default=None,
+        help="ivfpq, sq8: number of vectors sampled to train the clusters and codebooks, or the value ranges",
+    )
 
     params = parser.parse_args()
     params = params.__dict__
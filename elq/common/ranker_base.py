@@ -7,6 +7,8 @@
 from torch import nn
 import torch
 
+from blink.common.profiling import record_function
+
 
 def get_model_obj(model):
     model = model.module if hasattr(model, "module") else model
@@ -32,9 +34,10 @@ class BertEncoder(nn.Module):
             import pdb
             pdb.set_trace()
         try:
-            output_bert, output_pooler, _ = self.bert_model(
-                token_ids, segment_ids, attention_mask
-            )
+            with record_function("bert_encoder"):
+                output_bert, output_pooler, _ = self.bert_model(
+                    token_ids, segment_ids, attention_mask
+                )
         except RuntimeError as e:
             print(token_ids.size())
             print(segment_ids.size())
@@ -16,6 +16,10 @@ import pickle
 import faiss
 import numpy as np
 
+# the compressed indexes are shared with BLINK (scores are inner products)
+from blink.index.faiss_indexer import DenseIVFPQIndexer, DenseSQIndexer
+from blink.index.faiss_indexer import iter_chunks, sample_rows
+
 logger = logging.getLogger()
 
 
@@ -53,12 +57,8 @@ class DenseFlatIndexer(DenseIndexer):
         n = len(data)
         # indexing in batches is beneficial for many faiss index types
         logger.info("Indexing data, this may take a while.")
-        cnt = 0
-        for i in range(0, n, self.buffer_size):
-            vectors = [np.reshape(t, (1, -1)) for t in data[i : i + self.buffer_size]]
-            vectors = np.concatenate(vectors, axis=0)
+        for _, vectors in iter_chunks(data, self.buffer_size):
             self.index.add(vectors)
-            cnt += self.buffer_size
 
         logger.info("Total data indexed %d", n)
 
@@ -81,8 +81,10 @@ class DenseIVFFlatIndexer(DenseIndexer):
         n = len(data)
         # indexing in batches is beneficial for many faiss index types
         logger.info("Indexing data, this may take a while.")
-        self.index.train(data)
-        self.index.add(data)
+        # faiss trains k-means on at most 256 vectors per cluster anyway
+        self.index.train(sample_rows(data, min(256 * self.nlist, n)))
+        for _, vectors in iter_chunks(data, self.buffer_size):
+            self.index.add(vectors)
         logger.info("Total data indexed %d", n)
 
     def search_knn(self, query_vectors, top_k):
@@ -116,7 +118,9 @@ class DenseHNSWFlatIndexer(DenseIndexer):
 
         # indexing in batches is beneficial for many faiss index types
         logger.info("Indexing data, this may take a while.")
-        self.index.add(data)
+        for start, vectors in iter_chunks(data, self.buffer_size):
+            self.index.add(vectors)
+            logger.info("Indexed data %d" % (start + len(vectors)))
         logger.info("Total data indexed %d" % n)
 
     def search_knn(self, query_vectors, top_k):
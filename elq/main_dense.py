@@ -7,7 +7,7 @@
 import argparse
 import json
 import sys
-from elq.index.faiss_indexer import DenseFlatIndexer, DenseHNSWFlatIndexer, DenseIVFFlatIndexer
+from elq.index.faiss_indexer import DenseFlatIndexer, DenseHNSWFlatIndexer, DenseIVFFlatIndexer, DenseIVFPQIndexer, DenseSQIndexer
 
 import logging
 import torch
@@ -25,6 +25,10 @@ from elq.biencoder.data_process import (
     get_candidate_representation,
 )
 import elq.candidate_ranking.utils as utils
+from blink.entity_encoding import EntityEncodingStore, load_entity_encoding
+from blink.common.length_bucketing import length_bucketed_dataloader, restore_order
+from blink.biencoder.export import CompiledContextEncoder
+from blink.common.profiling import add_profiler_args, get_profiler, record_function
 import math
 
 from elq.vcg_utils.measures import entity_linking_tp_with_overlap
@@ -93,10 +97,10 @@ def _print_colorful_prediction(all_entity_preds, pred_triples, id2text, id2wikid
 def _load_candidates(
     entity_catalogue, entity_encoding,
     faiss_index="none", index_path=None,
-    logger=None,
+    logger=None, nprobe=None, rerank=0,
 ):
     if faiss_index == "none":
-        candidate_encoding = torch.load(entity_encoding)
+        candidate_encoding = load_entity_encoding(entity_encoding)
         indexer = None
     else:
         candidate_encoding = None
@@ -107,11 +111,16 @@ def _load_candidates(
             indexer = DenseHNSWFlatIndexer(1)
         elif faiss_index == "ivfflat":
             indexer = DenseIVFFlatIndexer(1)
+        elif faiss_index == "ivfpq":
+            indexer = DenseIVFPQIndexer(1, nprobe=nprobe)
+        elif faiss_index in DenseSQIndexer.QUANTIZER_TYPES:
+            indexer = DenseSQIndexer(1, quantizer=faiss_index)
         else:
-            raise ValueError("Error! Unsupported indexer type! Choose from flat,hnsw,ivfflat.")
+            raise ValueError("Error! Unsupported indexer type! Choose from flat,hnsw,ivfflat,ivfpq,sq8,fp16.")
         indexer.deserialize_from(index_path)
-
-    candidate_encoding = torch.load(entity_encoding)
+        if faiss_index == "ivfpq" and rerank:
+            # exact scores of the shortlists, from the (memory-mapped) encodings
+            indexer.set_rerank_encoding(load_entity_encoding(entity_encoding), rerank)
 
     if not os.path.exists("models/id2title.json"):
         id2title = {}
@@ -241,13 +250,30 @@ def _process_biencoder_dataloader(samples, tokenizer, biencoder_params, logger):
     return dataloader
 
 
+def _min_context_length(num_cand_mentions, max_mention_length=10):
+    """
+    Shortest context with at least ``num_cand_mentions`` candidate spans, so
+    that the mention pruning can take its top-k on trimmed batches.
+    """
+    length = 1
+    while True:
+        num_spans = length * length
+        if max_mention_length is not None and length > max_mention_length + 1:
+            # spans longer than max_mention_length are filtered out
+            num_spans -= (length - max_mention_length - 1) * (length - max_mention_length) // 2
+        if num_spans >= num_cand_mentions:
+            return length
+        length += 1
+
+
 def _run_biencoder(
     args, biencoder, dataloader, candidate_encoding, samples,
     num_cand_mentions=50, num_cand_entities=10,
     device="cpu", sample_to_all_context_inputs=None,
-    threshold=0.0, indexer=None,
+    threshold=0.0, indexer=None, profiler=None,
 ):
     """
+    ``profiler.step()`` is called after every batch, if given.
     Returns: tuple
         labels (List[int]) [(max_num_mentions_gold) x exs]: gold labels -- returns None if no labels
         nns (List[Array[int]]) [(# of pred mentions, cands_per_mention) x exs]: predicted entity IDs in each example
@@ -271,6 +297,16 @@ def _run_biencoder(
     sample_idx = 0
     ctxt_idx = 0
     label_ids = None
+    if getattr(args, "length_bucketing", False):
+        # batch questions of similar length and trim their padding
+        dataloader = length_bucketed_dataloader(
+            dataloader.dataset,
+            dataloader.batch_size,
+            null_idx=biencoder.NULL_IDX,
+            min_length=_min_context_length(
+                num_cand_mentions, biencoder.params.get("max_mention_length", 10)
+            ),
+        )
     for step, batch in enumerate(tqdm(dataloader)):
         context_input = batch[0].to(device)
         mask_ctxt = context_input != biencoder.NULL_IDX
@@ -293,7 +329,11 @@ def _run_biencoder(
                     cand_logits, _, _ = biencoder.score_candidate(
                         context_input, None,
                         text_encs=embedding_ctxt,
-                        cand_encs=candidate_encoding.to(device),
+                        cand_encs=(
+                            candidate_encoding
+                            if isinstance(candidate_encoding, EntityEncodingStore)
+                            else candidate_encoding.to(device)
+                        ),
                     )
                     # DIM (all_pred_mentions_batch, num_cand_entities); (all_pred_mentions_batch, num_cand_entities)
                     top_cand_logits_shape, top_cand_indices_shape = cand_logits.topk(num_cand_entities, dim=-1, sorted=True)
@@ -330,7 +370,8 @@ def _run_biencoder(
                             done = True
             else:
                 # DIM (all_pred_mentions_batch, num_cand_entities); (all_pred_mentions_batch, num_cand_entities)
-                top_cand_logits_shape, top_cand_indices_shape = indexer.search_knn(embedding_ctxt.cpu().numpy(), num_cand_entities)
+                with record_function("faiss_search"):
+                    top_cand_logits_shape, top_cand_indices_shape = indexer.search_knn(embedding_ctxt.cpu().numpy(), num_cand_entities)
                 top_cand_logits_shape = torch.tensor(top_cand_logits_shape).to(embedding_ctxt.device)
                 top_cand_indices_shape = torch.tensor(top_cand_indices_shape).to(embedding_ctxt.device)
 
@@ -367,7 +408,14 @@ def _run_biencoder(
                 mention_scores.append(chosen_mention_logits[idx][left_align_mask[idx]].data.cpu().numpy())
                 # [(max_num_mentions, cands_per_mention) x exs] <= (bsz, max_num_mentions=num_cand_mentions, cands_per_mention)
                 cand_scores.append(top_cand_logits[idx][left_align_mask[idx]].data.cpu().numpy())
-
+        if profiler is not None:
+            profiler.step()
+
+    nns = restore_order(nns, dataloader)
+    dists = restore_order(dists, dataloader)
+    pred_mention_bounds = restore_order(pred_mention_bounds, dataloader)
+    mention_scores = restore_order(mention_scores, dataloader)
+    cand_scores = restore_order(cand_scores, dataloader)
     return nns, dists, pred_mention_bounds, mention_scores, cand_scores
 
 
@@ -623,10 +671,15 @@ def load_models(args, logger):
     if getattr(args, 'max_context_length', None) is not None:
         biencoder_params["max_context_length"] = args.max_context_length
     biencoder = load_biencoder(biencoder_params)
-    if biencoder_params["no_cuda"] and type(biencoder.model).__name__ == 'DataParallel':
+    context_encoder = getattr(args, 'context_encoder', None)
+    if (biencoder_params["no_cuda"] or context_encoder) and type(biencoder.model).__name__ == 'DataParallel':
+        # the compiled context encoder runs on a single device
         biencoder.model = biencoder.model.module
-    elif not biencoder_params["no_cuda"] and type(biencoder.model).__name__ != 'DataParallel':
+    elif not biencoder_params["no_cuda"] and not context_encoder and type(biencoder.model).__name__ != 'DataParallel':
         biencoder.model = torch.nn.DataParallel(biencoder.model)
+    if context_encoder:
+        if logger: logger.info("Loading compiled context encoder")
+        biencoder.set_context_encoder(CompiledContextEncoder(context_encoder, biencoder.device))
 
     # load candidate entities
     if logger: logger.info("Loading candidate entities")
@@ -640,6 +693,7 @@ def load_models(args, logger):
     ) = _load_candidates(
         args.entity_catalogue, args.entity_encoding,
         args.faiss_index, args.index_path, logger=logger,
+        nprobe=getattr(args, 'faiss_nprobe', None), rerank=getattr(args, 'faiss_rerank', 0),
     )
 
     return (
@@ -756,12 +810,13 @@ def run(
             if logger: logger.info("Running biencoder...")
 
             start_time = time.time()
-            nns, dists, pred_mention_bounds, mention_scores, cand_scores = _run_biencoder(
-                args, biencoder, dataloader, candidate_encoding, samples=samples,
-                num_cand_mentions=args.num_cand_mentions, num_cand_entities=args.num_cand_entities,
-                device="cpu" if biencoder_params["no_cuda"] else "cuda",
-                threshold=mention_threshold, indexer=indexer,
-            )
+            with get_profiler(vars(args), "elq_biencoder", logger) as profiler:
+                nns, dists, pred_mention_bounds, mention_scores, cand_scores = _run_biencoder(
+                    args, biencoder, dataloader, candidate_encoding, samples=samples,
+                    num_cand_mentions=args.num_cand_mentions, num_cand_entities=args.num_cand_entities,
+                    device="cpu" if biencoder_params["no_cuda"] else "cuda",
+                    threshold=mention_threshold, indexer=indexer, profiler=profiler,
+                )
             end_time = time.time()
             if logger: logger.info("Finished running biencoder")
 
@@ -892,7 +947,8 @@ if __name__ == "__main__":
         dest="entity_encoding",
         type=str,
         default="models/all_entities_large.t7",  # ALL WIKIPEDIA!
-        help="Path to the entity catalogue.",
+        help="Path to the entity encoding (.t7, or a directory converted "
+        "with blink/entity_encoding.py). Only loaded with --faiss_index none.",
     )
     parser.add_argument(
         "--eval_batch_size",
@@ -901,14 +957,34 @@ if __name__ == "__main__":
         default=8,
         help="Crossencoder's batch size for evaluation",
     )
+    parser.add_argument(
+        "--length_bucketing",
+        action="store_true",
+        help="Run the biencoder on batches of questions of similar length, "
+        "trimmed to their longest question. Predictions keep the input order.",
+    )
     parser.add_argument(
         "--faiss_index",
         dest="faiss_index",
         type=str,
         default="hnsw",
-        choices=["hnsw", "flat", "ivfflat", "none"],
+        choices=["hnsw", "flat", "ivfflat", "ivfpq", "sq8", "fp16", "none"],
         help="whether to use faiss index",
     )
+    parser.add_argument(
+        "--faiss_nprobe",
+        dest="faiss_nprobe",
+        type=int,
+        default=None,
+        help="Clusters searched by an ivfpq index (default: the one it was built with)",
+    )
+    parser.add_argument(
+        "--faiss_rerank",
+        dest="faiss_rerank",
+        type=int,
+        default=0,
+        help="Re-score the top N candidates of an ivfpq index with the exact --entity_encoding",
+    )
     parser.add_argument(
         "--index_path",
         dest="index_path",
@@ -935,9 +1011,17 @@ if __name__ == "__main__":
     parser.add_argument(
         "--use_cuda", dest="use_cuda", action="store_true", default=False, help="run on gpu"
     )
+    parser.add_argument(
+        "--context_encoder",
+        dest="context_encoder",
+        type=str,
+        default=None,
+        help="Compiled context encoder (blink/biencoder/export.py --elq) to use instead of the eager BERT model",
+    )
     parser.add_argument(
         "--no_logger", dest="no_logger", action="store_true", default=False, help="don't log progress"
     )
+    add_profiler_args(parser)
 
 
     args = parser.parse_args()
@@ -0,0 +1,104 @@
+# Copyright (c) Facebook, Inc. and its affiliates.
+# All rights reserved.
+#
+# This source code is licensed under the license found in the
+# LICENSE file in the root directory of this source tree.
+#
+"""
+Throughput of the tokenizer backends of blink.biencoder.data_process on a
+BLINK mention dataset, e.g.
+
+    python scripts/benchmark_tokenization.py --data_path data/BLINK_benchmark/aida-A.jsonl
+
+Every backend is checked to produce the same token ids as the python one.
+"""
+import argparse
+import json
+import time
+
+from pytorch_transformers.tokenization_bert import BertTokenizer
+
+from blink.biencoder.data_process import (
+    TOKENIZER_BACKENDS,
+    get_fast_tokenizer,
+    get_mention_data_representations,
+    verify_representations,
+)
+
+
+def load_samples(data_path, num_samples=None):
+    samples = []
+    with open(data_path, "r") as fin:
+        for line in fin:
+            samples.append(json.loads(line))
+            if num_samples is not None and len(samples) >= num_samples:
+                break
+    return samples
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "--data_path", type=str, required=True, help="BLINK format .jsonl dataset."
+    )
+    parser.add_argument("--bert_model", type=str, default="bert-large-uncased")
+    parser.add_argument("--lowercase", type=bool, default=True)
+    parser.add_argument("--max_context_length", type=int, default=32)
+    parser.add_argument("--max_cand_length", type=int, default=128)
+    parser.add_argument("--num_samples", type=int, default=None)
+    parser.add_argument(
+        "--backends",
+        type=str,
+        default=",".join(TOKENIZER_BACKENDS),
+        help="Comma separated tokenizer backends to benchmark.",
+    )
+    parser.add_argument(
+        "--num_workers",
+        type=int,
+        default=None,
+        help="Processes of the process backend (default: number of CPUs).",
+    )
+    parser.add_argument("--chunk_size", type=int, default=1024)
+    args = parser.parse_args()
+
+    tokenizer = BertTokenizer.from_pretrained(
+        args.bert_model, do_lower_case=args.lowercase
+    )
+    samples = load_samples(args.data_path, args.num_samples)
+    print("Loaded %d samples from %s" % (len(samples), args.data_path))
+
+    expected_representations = None
+    for backend in ["python"] + [
+        backend for backend in args.backends.split(",") if backend != "python"
+    ]:
+        kwargs = {}
+        if backend == "fast":
+            # building the Rust tokenizer is a one-off cost, leave it out
+            kwargs["fast_tokenizer"] = get_fast_tokenizer(tokenizer)
+        start_time = time.time()
+        representations = get_mention_data_representations(
+            samples,
+            tokenizer,
+            args.max_context_length,
+            args.max_cand_length,
+            backend=backend,
+            num_workers=args.num_workers,
+            chunk_size=args.chunk_size,
+            **kwargs
+        )
+        elapsed = time.time() - start_time
+
+        if expected_representations is None:
+            expected_representations = representations
+            python_elapsed = elapsed
+        else:
+            verify_representations(representations, expected_representations)
+        print(
+            "%-8s %8.2fs %10.1f samples/s  %5.2fx  identical ids"
+            % (
+                backend,
+                elapsed,
+                len(samples) / max(elapsed, 1e-6),
+                python_elapsed / max(elapsed, 1e-6),
+            )
+        )
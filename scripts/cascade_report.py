@@ -0,0 +1,68 @@
+# Copyright (c) Facebook, Inc. and its affiliates.
+# All rights reserved.
+#
+# This source code is licensed under the license found in the
+# LICENSE file in the root directory of this source tree.
+#
+"""
+Accuracy / latency trade-off of the confidence-gated biencoder ->
+crossencoder cascade (--cascade_threshold in blink/main_dense.py) on a
+labelled dataset, e.g.
+
+    python scripts/cascade_report.py --test_mentions data/BLINK_benchmark/msnbc_questions.jsonl \
+        --thresholds 0,1,2,4,8
+
+The biencoder and crossencoder are run once on all the mentions, every
+threshold is then evaluated from the per-mention results.
+"""
+import prettytable
+
+import blink.main_dense as main_dense
+import blink.candidate_ranking.utils as utils
+from blink.metrics import cascade_tradeoff
+
+
+if __name__ == "__main__":
+    parser = main_dense.get_parser()
+    parser.add_argument(
+        "--thresholds",
+        type=str,
+        default="0,0.5,1,2,4,8",
+        help="Comma separated confidence thresholds to report.",
+    )
+    args = parser.parse_args()
+    thresholds = [float(threshold) for threshold in args.thresholds.split(",")]
+    # the report needs the crossencoder results of all the mentions
+    args.fast = False
+    args.cascade_threshold = None
+
+    logger = utils.get_logger(args.output_path)
+    models = main_dense.load_models(args, logger)
+
+    metrics = {}
+    main_dense.run(args, logger, *models, metrics=metrics)
+    if "crossencoder_correct" not in metrics:
+        raise ValueError("The cascade report needs labelled test mentions")
+
+    table = prettytable.PrettyTable(
+        [
+            "threshold",
+            "accuracy",
+            "crossencoder fraction",
+            "time (s)",
+            "ms per mention",
+        ]
+    )
+    for row in cascade_tradeoff(metrics, thresholds, args.cascade_metric):
+        table.add_row(
+            [
+                row["threshold"],
+                round(row["accuracy"], 4),
+                round(row["crossencoder_fraction"], 4),
+                round(row["time"], 2),
+                round(row["ms_per_mention"], 2),
+            ]
+        )
+    logger.info(
+        "cascade trade-off (%s confidence):\n%s" % (args.cascade_metric, table)
+    )
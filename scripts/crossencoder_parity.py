@@ -0,0 +1,115 @@
+# Copyright (c) Facebook, Inc. and its affiliates.
+# All rights reserved.
+#
+# This source code is licensed under the license found in the
+# LICENSE file in the root directory of this source tree.
+#
+"""
+Accuracy parity of the int8 (dynamically quantized) crossencoder against the
+fp32 one on CPU, on the BLINK benchmark sets, e.g.
+
+    python scripts/crossencoder_parity.py --num_threads 16
+
+accepts the same arguments as blink/main_dense.py. Both crossencoders rerank
+the same biencoder candidates; the script fails if the int8 normalized
+accuracy drops by more than --max_accuracy_drop on any dataset.
+"""
+import copy
+import time
+
+import prettytable
+
+import blink.main_dense as main_dense
+import blink.candidate_ranking.utils as utils
+
+DATASETS = [
+    "data/BLINK_benchmark/AIDA-YAGO2_testa.jsonl",
+    "data/BLINK_benchmark/AIDA-YAGO2_testb.jsonl",
+    "data/BLINK_benchmark/ace2004_questions.jsonl",
+    "data/BLINK_benchmark/aquaint_questions.jsonl",
+    "data/BLINK_benchmark/clueweb_questions.jsonl",
+    "data/BLINK_benchmark/msnbc_questions.jsonl",
+    "data/BLINK_benchmark/wnedwiki_questions.jsonl",
+]
+
+
+if __name__ == "__main__":
+    parser = main_dense.get_parser()
+    parser.add_argument(
+        "--datasets",
+        type=str,
+        default=",".join(DATASETS),
+        help="Comma separated BLINK format .jsonl test sets.",
+    )
+    parser.add_argument(
+        "--max_accuracy_drop",
+        type=float,
+        default=0.005,
+        help="Maximum drop of the int8 crossencoder normalized accuracy.",
+    )
+    args = parser.parse_args()
+    args.cpu = True
+    args.fast = False
+    args.quantize_crossencoder = False
+    # both models must score every pair: a score cache would hand the int8 run
+    # the fp32 scores (and skew the timings)
+    args.crossencoder_cache_size = 0
+
+    logger = utils.get_logger(args.output_path)
+    models = list(main_dense.load_models(args, logger))
+    crossencoder = models[2]
+    quantized_crossencoder = copy.deepcopy(crossencoder)
+    quantized_crossencoder.quantize()
+
+    table = prettytable.PrettyTable(
+        [
+            "dataset",
+            "fp32 accuracy",
+            "int8 accuracy",
+            "top-1 agreement",
+            "fp32 crossencoder (s)",
+            "int8 crossencoder (s)",
+            "support",
+        ]
+    )
+    failed = []
+    for test_mentions in args.datasets.split(","):
+        logger.info(test_mentions)
+        args.test_mentions = test_mentions
+        results = {}
+        for name, model in [("fp32", crossencoder), ("int8", quantized_crossencoder)]:
+            models[2] = model
+            metrics = {}
+            start_time = time.time()
+            output = main_dense.run(args, logger, *models, metrics=metrics)
+            results[name] = (output, metrics, time.time() - start_time)
+
+        fp32_output, fp32_metrics, _ = results["fp32"]
+        int8_output, int8_metrics, _ = results["int8"]
+        predictions = zip(fp32_output[5], int8_output[5])
+        agreement = sum(
+            fp32_prediction[:1] == int8_prediction[:1]
+            for fp32_prediction, int8_prediction in predictions
+        ) / max(fp32_output[4], 1)
+        accuracy_drop = fp32_output[2] - int8_output[2]
+        if accuracy_drop > args.max_accuracy_drop:
+            failed.append(test_mentions)
+        table.add_row(
+            [
+                test_mentions,
+                round(fp32_output[2], 4),
+                round(int8_output[2], 4),
+                round(agreement, 4),
+                round(fp32_metrics.get("crossencoder_time", -1), 2),
+                round(int8_metrics.get("crossencoder_time", -1), 2),
+                fp32_output[4],
+            ]
+        )
+
+    logger.info("\n{}".format(table))
+    if failed:
+        raise ValueError(
+            "int8 crossencoder accuracy dropped by more than {} on {}".format(
+                args.max_accuracy_drop, ", ".join(failed)
+            )
+        )
@@ -0,0 +1,141 @@
+# Copyright (c) Facebook, Inc. and its affiliates.
+# All rights reserved.
+#
+# This source code is licensed under the license found in the
+# LICENSE file in the root directory of this source tree.
+#
+"""
+Recall of compressed faiss indexes against the exact flat index on the BLINK
+benchmark sets, e.g.
+
+    python scripts/index_recall_report.py --faiss_index flat \
+        --index_path models/faiss_flat_index.pkl \
+        --indexes sq8:models/faiss_sq8_index.pkl,fp16:models/faiss_fp16_index.pkl
+
+accepts the same arguments as blink/main_dense.py (--faiss_index flat and
+--index_path give the reference index; --faiss_nprobe and --faiss_rerank
+apply to ivfpq indexes). For every dataset and index, reports the overlap of
+the top-k entities with the flat ones, the recall@k of the gold entities,
+the search latency and the size of the index file.
+"""
+import os
+import time
+
+import numpy as np
+import prettytable
+
+import blink.main_dense as main_dense
+import blink.candidate_ranking.utils as utils
+from blink.common.inference import inference_mode
+
+DATASETS = [
+    "data/BLINK_benchmark/AIDA-YAGO2_testa.jsonl",
+    "data/BLINK_benchmark/AIDA-YAGO2_testb.jsonl",
+    "data/BLINK_benchmark/ace2004_questions.jsonl",
+    "data/BLINK_benchmark/aquaint_questions.jsonl",
+    "data/BLINK_benchmark/clueweb_questions.jsonl",
+    "data/BLINK_benchmark/msnbc_questions.jsonl",
+    "data/BLINK_benchmark/wnedwiki_questions.jsonl",
+]
+
+
+def _encode_mentions(biencoder, dataloader):
+    encodings = []
+    labels = []
+    biencoder.model.eval()
+    with inference_mode():
+        for context_input, _, label_ids in dataloader:
+            encodings.append(biencoder.encode_context(context_input).numpy())
+            labels.extend(label_ids.numpy())
+    encodings = np.ascontiguousarray(np.concatenate(encodings), dtype=np.float32)
+    return encodings, labels
+
+
+if __name__ == "__main__":
+    parser = main_dense.get_parser()
+    parser.add_argument(
+        "--datasets",
+        type=str,
+        default=",".join(DATASETS),
+        help="Comma separated BLINK format .jsonl test sets.",
+    )
+    parser.add_argument(
+        "--indexes",
+        type=str,
+        required=True,
+        help="Comma separated type:path of the indexes to compare to the flat "
+        "one, with type in {}.".format(",".join(main_dense.FAISS_INDEXES)),
+    )
+    args = parser.parse_args()
+    if args.faiss_index != "flat":
+        raise ValueError(
+            "The reference index must be exact: --faiss_index flat --index_path ..."
+        )
+    args.fast = True
+
+    logger = utils.get_logger(args.output_path)
+    models = main_dense.load_models(args, logger)
+    biencoder, biencoder_params = models[0], models[1]
+    title2id, wikipedia_id2local_id, flat_indexer = models[5], models[8], models[9]
+
+    indexers = [("flat", flat_indexer, args.index_path)]
+    for spec in args.indexes.split(","):
+        faiss_index, index_path = spec.split(":", 1)
+        indexer = main_dense._load_indexer(
+            faiss_index,
+            index_path,
+            args.entity_encoding,
+            args.faiss_nprobe,
+            args.faiss_rerank,
+            logger,
+        )
+        indexers.append((faiss_index, indexer, index_path))
+
+    table = prettytable.PrettyTable(
+        [
+            "dataset",
+            "index",
+            "overlap@%d with flat" % args.top_k,
+            "gold recall@%d" % args.top_k,
+            "ms / mention",
+            "index size (MB)",
+            "support",
+        ]
+    )
+    for test_mentions in args.datasets.split(","):
+        logger.info(test_mentions)
+        samples = main_dense._get_test_samples(
+            test_mentions, args.test_entities, title2id, wikipedia_id2local_id, logger
+        )
+        dataloader = main_dense._process_biencoder_dataloader(
+            samples, biencoder.tokenizer, biencoder_params
+        )
+        queries, labels = _encode_mentions(biencoder, dataloader)
+
+        flat_ids = None
+        for name, indexer, index_path in indexers:
+            start_time = time.time()
+            _, ids = indexer.search_knn(queries, args.top_k)
+            elapsed = time.time() - start_time
+            if flat_ids is None:
+                flat_ids = ids
+            overlap = np.mean(
+                [
+                    len(set(row) & set(flat_row)) / args.top_k
+                    for row, flat_row in zip(ids, flat_ids)
+                ]
+            )
+            recall = np.mean([label in row for label, row in zip(labels, ids)])
+            table.add_row(
+                [
+                    test_mentions,
+                    name,
+                    round(overlap, 4),
+                    round(recall, 4),
+                    round(1000 * elapsed / max(len(queries), 1), 3),
+                    round(os.path.getsize(index_path) / 2 ** 20, 1),
+                    len(queries),
+                ]
+            )
+
+    logger.info("\n{}".format(table))
@@ -4,33 +4,34 @@
 # This source code is licensed under the license found in the
 # LICENSE file in the root directory of this source tree.
 #
+# Merging is optional: blink/build_faiss_index.py, elq/build_faiss_index.py and
+# blink/entity_encoding.py read the chunk directory directly, one chunk at a time.
 import torch
 import json
 import os
 
+import numpy as np
+
 import argparse
 
+from blink.entity_encoding import ChunkedEntityEncoding
 
 
 parser = argparse.ArgumentParser()
 parser.add_argument('--path_to_saved_chunks', type=str, required=True, help='filepath to directory containing saved chunks')
-parser.add_argument('--chunk_size', type=int, default=1000000, help='size of each chunk')
+parser.add_argument('--chunk_size', type=int, default=None, help='expected size of each chunk but the last one, checked if given (the chunks are found from their {start}_{end}.t7 names)')
 args = parser.parse_args()
 
-CHUNK_SIZES = args.chunk_size
-
-all_chunks = []
-
-for fn in range(0, 5903526, CHUNK_SIZES):
-    f_chunk = os.path.join(
-        args.path_to_saved_chunks, '{}_{}.t7'.format(fn, fn+CHUNK_SIZES),
-    )
-    if not os.path.exists(f_chunk) or os.path.getsize(f_chunk) == 0:
-        continue
-    loaded_chunk = torch.load(f_chunk)
-    all_chunks.append(loaded_chunk[:CHUNK_SIZES])
-
-all_chunks = torch.cat(all_chunks, dim=0)
+encoding = ChunkedEntityEncoding(args.path_to_saved_chunks)
+if args.chunk_size is not None:
+    sizes = np.diff(encoding.offsets)
+    for chunk_file, size in zip(encoding.chunk_files, sizes):
+        is_last = chunk_file == encoding.chunk_files[-1]
+        if size > args.chunk_size or (size < args.chunk_size and not is_last):
+            raise ValueError('Chunk {} has {} rows, expected {}'.format(
+                chunk_file, size, args.chunk_size,
+            ))
+all_chunks = encoding[:]
 torch.save(all_chunks, os.path.join(
-    args.path_to_saved_chunks, 'all.t7'.format(fn, fn+CHUNK_SIZES),
+    args.path_to_saved_chunks, 'all.t7',
 ))